@@ -0,0 +1,403 @@
+"""
+fadg : aio.py
+=============
+
+Copyright 2024 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Asynchronous versions of SearchCSW and Collocate. CSW GetRecords
+requests are sent as POST requests, and dataset metadata is read
+from the OPeNDAP DAS response, all concurrently on one event loop.
+
+This module requires aiohttp, which is installed with the "async"
+extra, i.e., pip install fadg[async].
+"""
+import asyncio
+import logging
+
+from types import SimpleNamespace
+from contextlib import asynccontextmanager
+
+from fadg import csw
+from fadg.cache import get_availability_cache
+from fadg.dap import das_url
+from fadg.dap import UNAVAILABLE_STATUSES
+from fadg.dap import global_attributes
+from fadg.find_and_collocate import SearchCSW
+from fadg.find_and_collocate import Collocate
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None
+
+logger = logging.getLogger(__name__)
+
+
+def _require_aiohttp():
+    """ Raise ImportError if aiohttp is not installed.
+    """
+    if aiohttp is None:
+        raise ImportError("The fadg async API requires aiohttp. "
+                          "Install it with: pip install fadg[async]")
+
+
+async def fetch_metadata(session, url):
+    """ Fetch the DAS response of the given OPeNDAP url, and return a
+    metadata dict (see Collocate.probe). The dataset is considered
+    unavailable if the server responds with HTTP 404 or 410. If the
+    request fails or times out, the server responds with another
+    error, or the DAS response cannot be parsed, the availability is
+    unknown (None).
+    """
+    try:
+        async with session.get(das_url(url)) as response:
+            if response.status in UNAVAILABLE_STATUSES:
+                logger.debug("The archive file %s is not available (HTTP %d).",
+                             url, response.status)
+                return Collocate._unavailable_metadata(url)
+            if response.status != 200:
+                logger.debug("Could not read DAS of %s (HTTP %d).", url, response.status)
+                return Collocate._unavailable_metadata(url, available=None)
+            text = await response.text()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as ee:
+        logger.debug("Could not read DAS of %s: %s", url, ee)
+        return Collocate._unavailable_metadata(url, available=None)
+
+    try:
+        attributes = global_attributes(text)
+    except ValueError as ee:
+        logger.debug("Could not parse DAS of %s: %s", url, ee)
+        return Collocate._unavailable_metadata(url, available=None)
+
+    return Collocate._read_metadata(SimpleNamespace(**attributes), url)
+
+
+class _AsyncCSWMixin:
+    """Shared session handling and CSW paging for the asynchronous
+    classes.
+    """
+
+    @asynccontextmanager
+    async def _session(self):
+        """ Yield the session given on initialisation, or a temporary
+        session that is closed afterwards.
+        """
+        if self.session is not None:
+            yield self.session
+            return
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            yield session
+
+    async def _getrecords(self, session, filter_list, endpoint, startposition, maxrecords,
+                          outputschema, elements=None):
+        """ Send one GetRecords request, and return the records dict
+        and the results dict.
+        """
+        data = csw.getrecords_xml(filter_list, startposition=startposition,
+                                  maxrecords=maxrecords, outputschema=outputschema,
+                                  elements=elements)
+        self.request_count += 1
+        async with session.post(endpoint, data=data,
+                                headers={"Content-Type": "application/xml"}) as response:
+            response.raise_for_status()
+            content = await response.read()
+        return csw.parse_getrecords_response(content, outputschema=outputschema)
+
+    async def _aiter_pages(self, session, filter_list, pagesize=10, max_records=1000,
+                           endpoint="https://data.csw.met.no", outputschema=csw.CSW_SCHEMA,
+                           elements=None):
+        """ Yield a records dict for each page of the search. The
+        first page gives the number of matching records, and the
+        remaining pages are requested concurrently, limited by
+        self.workers. Pages are yielded as they arrive. With elements,
+        only the given Dublin Core elements are requested.
+
+        The temporal filter is adapted to the capabilities of the
+        endpoint if they are cached (fadg.csw.CAPABILITIES), and falls
+        back to the begin date filter otherwise. As in
+        SearchCSW._iter_pages_parallel, the remaining pages are no
+        larger than the first page, and pages that are not returned in
+        full are completed with further requests.
+        """
+        self.request_count = 0
+        capabilities = csw.CAPABILITIES.peek(endpoint)
+        filter_list = SearchCSW._adapt_temporal_filter(filter_list, capabilities)
+        pagesize = max(SearchCSW._advertised_pagesize(capabilities, max_pagesize=pagesize), 1)
+        records, results = await self._getrecords(session, filter_list, endpoint, 1,
+                                                  min(pagesize, max_records), outputschema,
+                                                  elements=elements)
+        returned = len(records)
+        yield records
+
+        matches = min(results["matches"], max_records)
+        if returned == 0:
+            return
+        pagesize = min(pagesize, returned)
+        starts = list(range(1 + returned, matches + 1, pagesize))
+        if len(starts) == 0:
+            return
+
+        semaphore = asyncio.Semaphore(self.workers)
+
+        async def get_page(start):
+            stop = min(start + pagesize, matches + 1)
+            page = {}
+            async with semaphore:
+                while start < stop:
+                    records, results = await self._getrecords(
+                        session, filter_list, endpoint, start, stop - start, outputschema,
+                        elements=elements)
+                    page.update(records)
+                    if len(records) == 0:
+                        break
+                    start += len(records)
+            return page
+
+        tasks = [asyncio.ensure_future(get_page(start)) for start in starts]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+class AsyncSearchCSW(_AsyncCSWMixin, SearchCSW):
+    """Asynchronous version of SearchCSW. The search is not executed
+    on initialisation, but with the coroutine execute, or page by
+    page with the asynchronous generators iter_records and
+    iter_odap_urls.
+
+    Input
+    =====
+    See SearchCSW. In addition:
+    pagesize : int (default 10)
+        Number of records per GetRecords request
+    max_records : int (default 1000)
+        Maximum number of records
+    endpoint : string (default https://data.csw.met.no)
+        CSW service url
+    outputschema : string
+        Dublin Core (SearchCSW.CSW_SCHEMA) or ISO 19139
+        (SearchCSW.ISO_SCHEMA)
+    workers : int (default 4)
+        Maximum number of concurrent GetRecords requests
+    session : aiohttp.ClientSession (default None)
+        Session to use. A temporary session is created for each
+        search if not given.
+    timeout : float (default 60)
+        Total timeout in seconds of temporary sessions
+    elements : list (default None)
+        Dublin Core elements to request instead of the full records,
+        e.g., fadg.csw.SLIM_ELEMENTS
+    """
+
+    def __init__(self, time=None, dt=24, bbox=None, text=None,
+                 crs="urn:ogc:def:crs:OGC:1.3:CRS84", pagesize=10, max_records=1000,
+                 endpoint="https://data.csw.met.no", outputschema=csw.CSW_SCHEMA, workers=4,
+                 session=None, timeout=60, polygon=None, elements=None):
+        _require_aiohttp()
+        super().__init__(time=time, dt=dt, bbox=bbox, text=text, crs=crs, lazy=True,
+                         polygon=polygon)
+
+        self.pagesize = pagesize
+        self.max_records = max_records
+        self.endpoint = endpoint
+        self.outputschema = outputschema
+        self.workers = workers
+        self.session = session
+        self.timeout = timeout
+        self.elements = elements
+        self.request_count = 0
+
+    async def iter_records(self):
+        """ Yield (key, record) tuples of the search results, page by
+        page as they are retrieved from the CSW service.
+        """
+        seen = set()
+        async with self._session() as session:
+            async for page in self._aiter_pages(session, self.filter_list,
+                                                pagesize=self.pagesize,
+                                                max_records=self.max_records,
+                                                endpoint=self.endpoint,
+                                                outputschema=self.outputschema,
+                                                elements=self.elements):
+                for key, record in self._filter_footprint(page).items():
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    yield key, record
+
+    async def iter_odap_urls(self):
+        """ Yield the OPeNDAP urls of the search results, page by page
+        as they are retrieved from the CSW service.
+        """
+        async for key, record in self.iter_records():
+            yield SearchCSW.get_odap_url(record)
+
+    async def execute(self):
+        """ Execute the search, set self.records and self.urls, and
+        return the records dict.
+        """
+        self.records = {}
+        async for key, record in self.iter_records():
+            self.records[key] = record
+        self.urls = [SearchCSW.get_odap_url(record) for record in self.records.values()]
+
+        return self.records
+
+
+class AsyncCollocate(_AsyncCSWMixin, Collocate):
+    """Asynchronous version of Collocate. Create instances with the
+    coroutine AsyncCollocate.create, which reads the metadata of the
+    input dataset from its OPeNDAP DAS response.
+
+    Input
+    =====
+    url : string
+        Dataset OPeNDAP url
+    metadata : dict
+        Metadata of the input dataset (see Collocate.probe)
+    session : aiohttp.ClientSession (default None)
+        Session to use. A temporary session is created for each
+        operation if not given.
+    workers : int (default 8)
+        Maximum number of concurrent requests
+    timeout : float (default 60)
+        Total timeout in seconds of temporary sessions
+    cache : fadg.cache.MetadataCache (default None)
+        Optional persistent cache of dataset metadata
+    """
+
+    def __init__(self, url, metadata, session=None, workers=8, timeout=60, cache=None):
+        _require_aiohttp()
+        if not metadata["available"] or metadata["time_coverage_start"] is None:
+            raise ValueError("Could not read the time coverage of %s" % url)
+
+        Collocate.__init__(self, url, cache=cache, reader="das", metadata=metadata)
+        self.session = session
+        self.workers = workers
+        self.timeout = timeout
+        self.request_count = 0
+
+        # Set central time, bounding box and polygon footprint
+        self._set_metadata(metadata)
+
+    @classmethod
+    async def create(cls, url, session=None, **kwargs):
+        """ Read the metadata of the given dataset, and return a new
+        instance.
+        """
+        _require_aiohttp()
+        if session is None:
+            timeout = aiohttp.ClientTimeout(total=kwargs.get("timeout", 60))
+            async with aiohttp.ClientSession(timeout=timeout) as tmp_session:
+                metadata = await fetch_metadata(tmp_session, url)
+        else:
+            metadata = await fetch_metadata(session, url)
+
+        return cls(url, metadata, session=session, **kwargs)
+
+    async def get_collocations(self, constraints=None, dt=24,
+                               endpoint="https://data.csw.met.no",
+                               crs="urn:ogc:def:crs:OGC:1.3:CRS84", pagesize=10,
+                               max_records=1000, outputschema=csw.CSW_SCHEMA, elements=None):
+        """ Return a dict of records collocated with the input
+        dataset, see Collocate.get_collocations.
+        """
+        filter_list = self._get_collocation_filter(constraints, dt=dt, crs=crs)
+        records = {}
+        async with self._session() as session:
+            async for page in self._aiter_pages(session, filter_list, pagesize=pagesize,
+                                                max_records=max_records, endpoint=endpoint,
+                                                outputschema=outputschema,
+                                                elements=elements):
+                records.update(page)
+
+        return self._filter_footprint(records)
+
+    async def probe_many(self, urls):
+        """ Fetch the metadata of the given datasets concurrently, and
+        return a list of metadata dicts in the same order as the
+        input urls. The caches are used as in Collocate.probe_many,
+        and datasets whose availability is unknown are not cached.
+        """
+        urls = list(urls)
+        probes = [None]*len(urls)
+        if self.cache is not None:
+            probes = [self.cache.get(url) for url in urls]
+        availability = get_availability_cache()
+        if availability is not None:
+            for ii, metadata in enumerate(probes):
+                if metadata is None and availability.get(urls[ii]) is False:
+                    probes[ii] = Collocate._unavailable_metadata(urls[ii])
+        missing = [ii for ii, metadata in enumerate(probes) if metadata is None]
+
+        semaphore = asyncio.Semaphore(self.workers)
+
+        async def probe(session, url):
+            async with semaphore:
+                return await fetch_metadata(session, url)
+
+        async with self._session() as session:
+            results = await asyncio.gather(*[probe(session, urls[ii]) for ii in missing])
+
+        for ii, metadata in zip(missing, results):
+            probes[ii] = metadata
+            if metadata["available"] is None:
+                # No usable response, so that the availability is unknown
+                continue
+            if self.cache is not None:
+                self.cache.put(metadata)
+            if availability is not None:
+                availability.put(urls[ii], metadata["available"])
+
+        return probes
+
+    async def _get_nearest_by_time(self, records, index, rel=0):
+        """ Return the record that is closest to self.time by given
+        index, see Collocate._get_nearest_by_time.
+        """
+        if not bool(records):
+            raise ValueError("Input records dict is empty.")
+        fields = ["time_coverage_start", "time_coverage_end"]
+        odaps = [Collocate.get_odap_url(record) for record in records.values()]
+        probes = dict(zip(records.keys(), await self.probe_many(odaps)))
+
+        return self._select_nearest(records, probes, fields[index], rel=rel)
+
+    async def get_nearest_collocation_by_time_coverage_start(self, records, rel=0):
+        """ Return the record that has time_coverage_start closest to
+        self.time.
+        """
+        return await self._get_nearest_by_time(records, 0, rel=rel)
+
+    async def get_nearest_collocation_by_time_coverage_end(self, records, rel=0):
+        """ Return the record that has time_coverage_end closest to
+        self.time.
+        """
+        return await self._get_nearest_by_time(records, 1, rel=rel)
+
+    async def get_odap_url_of_nearest(self, *args, rel=0, **kwargs):
+        """ Return the OPeNDAP url of the nearest collocated dataset.
+        """
+        url = None
+        records = await self.get_collocations(*args, **kwargs)
+        if bool(records):
+            nearest = await self.get_nearest_collocation_by_time_coverage_start(records,
+                                                                                rel=rel)
+            url = Collocate.get_odap_url(nearest)
+        return url
@@ -0,0 +1,510 @@
+"""
+fadg : cache.py
+===============
+
+Copyright 2024 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import os
+import time
+import pickle
+import sqlite3
+import hashlib
+import logging
+import datetime
+import threading
+
+from collections import OrderedDict
+from xdg import xdg_cache_home
+from owslib import fes
+from owslib.etree import etree
+from dateutil.parser import parse
+
+logger = logging.getLogger(__name__)
+
+
+class MetadataCache:
+    """Persistent cache of dataset metadata, stored in an SQLite
+    database and keyed by the dataset url. The cache holds the ACDD
+    time coverage, geospatial bounds and footprint (geospatial_bounds),
+    the availability of the dataset, and the time when the metadata
+    was fetched.
+
+    Metadata of archived products does not change, so by default the
+    entries of available datasets never expire. Entries of
+    unavailable datasets expire after failure_ttl seconds, so that
+    temporary server problems are not remembered forever.
+
+    Input
+    =====
+    path : string (default $XDG_CACHE_HOME/fadg/metadata.sqlite)
+        Path to the SQLite database file. Use ":memory:" for a
+        non-persistent cache.
+    ttl : float (default None)
+        Time to live in seconds for available datasets. None means
+        that the entries never expire.
+    failure_ttl : float (default 3600)
+        Time to live in seconds for unavailable datasets.
+    max_entries : int (default 100000)
+        Maximum number of entries. The least recently used entries
+        are evicted when the limit is exceeded.
+    """
+
+    FIELDS = [
+        "url", "available", "time_coverage_start", "time_coverage_end",
+        "geospatial_lon_min", "geospatial_lat_min", "geospatial_lon_max",
+        "geospatial_lat_max", "geospatial_bounds", "fetched", "accessed",
+    ]
+    TIME_FIELDS = ["time_coverage_start", "time_coverage_end"]
+
+    def __init__(self, path=None, ttl=None, failure_ttl=3600, max_entries=100000):
+
+        if path is None:
+            path = os.path.join(xdg_cache_home(), "fadg", "metadata.sqlite")
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self.path = path
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS metadata ("
+            "url TEXT PRIMARY KEY, available INTEGER, "
+            "time_coverage_start TEXT, time_coverage_end TEXT, "
+            "geospatial_lon_min REAL, geospatial_lat_min REAL, "
+            "geospatial_lon_max REAL, geospatial_lat_max REAL, "
+            "geospatial_bounds TEXT, fetched REAL, accessed REAL)")
+        # Databases created by earlier versions lack geospatial_bounds
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(metadata)")]
+        if "geospatial_bounds" not in columns:
+            self._conn.execute("ALTER TABLE metadata ADD COLUMN geospatial_bounds TEXT")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS metadata_accessed ON metadata (accessed)")
+        self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM metadata").fetchone()[0]
+
+    def get(self, url):
+        """ Return the cached metadata dict of the given url, or None
+        if the url is not cached or the entry has expired.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT %s FROM metadata WHERE url = ?" % ", ".join(self.FIELDS),
+                (url,)).fetchone()
+            if row is None:
+                return None
+            metadata = dict(zip(self.FIELDS, row))
+            ttl = self.ttl if metadata["available"] else self.failure_ttl
+            now = time.time()
+            if ttl is not None and now - metadata["fetched"] > ttl:
+                self._conn.execute("DELETE FROM metadata WHERE url = ?", (url,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE metadata SET accessed = ? WHERE url = ?", (now, url))
+            self._conn.commit()
+
+        metadata["available"] = bool(metadata["available"])
+        for field in self.TIME_FIELDS:
+            if metadata[field] is not None:
+                metadata[field] = parse(metadata[field])
+        metadata.pop("accessed")
+        return metadata
+
+    def put(self, metadata):
+        """ Store a metadata dict as returned by Collocate.probe. The
+        fetch time is set to now unless given in the dict.
+        """
+        now = time.time()
+        values = []
+        for field in self.FIELDS:
+            value = metadata.get(field)
+            if field in self.TIME_FIELDS and value is not None:
+                value = value.isoformat()
+            if field == "available":
+                value = int(bool(value))
+            if field == "fetched" and value is None:
+                value = now
+            if field == "accessed":
+                value = now
+            values.append(value)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO metadata (%s) VALUES (%s)" % (
+                    ", ".join(self.FIELDS), ", ".join(["?"]*len(self.FIELDS))),
+                values)
+            self._evict()
+            self._conn.commit()
+
+    def clear(self):
+        """ Remove all entries from the cache.
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM metadata")
+            self._conn.commit()
+
+    def close(self):
+        """ Close the database connection.
+        """
+        with self._lock:
+            self._conn.close()
+
+    def _evict(self):
+        """ Delete the least recently used entries exceeding
+        max_entries. Must be called with the lock held.
+        """
+        count = self._conn.execute("SELECT COUNT(*) FROM metadata").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            logger.debug("Evicting %d entries from the metadata cache", excess)
+            self._conn.execute(
+                "DELETE FROM metadata WHERE url IN "
+                "(SELECT url FROM metadata ORDER BY accessed ASC LIMIT ?)", (excess,))
+
+# END Class MetadataCache
+
+
+class AvailabilityCache:
+    """Cache of dataset availability, keyed by the dataset url, so
+    that known missing files are not opened again and again.
+
+    Available datasets are remembered for ttl seconds. Unavailable
+    datasets are remembered with exponential backoff, i.e., for
+    backoff*factor**(n - 1) seconds after the n-th consecutive
+    failure, up to max_backoff seconds. The failure count is kept when
+    an entry expires, so that a dataset that is still missing when it
+    is checked again is remembered for longer. A success resets the
+    count.
+
+    The cache returned by get_availability_cache is shared by all
+    Collocate instances. It is kept in memory unless a path is given.
+
+    Input
+    =====
+    path : string (default ":memory:")
+        Path to the SQLite database file, to persist the cache
+    ttl : float (default 86400)
+        Time to live in seconds for available datasets. None means
+        that the entries never expire.
+    backoff : float (default 60)
+        Time to live in seconds after the first failure
+    factor : float (default 2)
+        Growth of the time to live for each consecutive failure
+    max_backoff : float (default 86400)
+        Maximum time to live in seconds for unavailable datasets
+    """
+
+    FIELDS = ["url", "available", "failures", "checked", "expires", "error"]
+
+    def __init__(self, path=":memory:", ttl=86400, backoff=60, factor=2, max_backoff=86400):
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self.path = path
+        self.ttl = ttl
+        self.backoff = backoff
+        self.factor = factor
+        self.max_backoff = max_backoff
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS availability ("
+            "url TEXT PRIMARY KEY, available INTEGER, failures INTEGER, "
+            "checked REAL, expires REAL, error TEXT)")
+        self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM availability").fetchone()[0]
+
+    def get(self, url):
+        """ Return True if the dataset is known to be available, False
+        if it is known to be unavailable, and None if it is not cached
+        or the entry has expired.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT available, expires FROM availability WHERE url = ?",
+                (url,)).fetchone()
+        if row is None or (row[1] is not None and time.time() > row[1]):
+            return None
+        return bool(row[0])
+
+    def put(self, url, available, error=None):
+        """ Store the result of an availability check of the given url.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT failures FROM availability WHERE url = ?", (url,)).fetchone()
+            if available:
+                failures = 0
+                expires = None if self.ttl is None else now + self.ttl
+            else:
+                failures = (row[0] if row is not None else 0) + 1
+                expires = now + min(self.backoff*self.factor**(failures - 1),
+                                    self.max_backoff)
+                logger.debug("%s is not available (%d failures), retrying after %s",
+                             url, failures, time.strftime("%Y-%m-%dT%H:%M:%SZ",
+                                                          time.gmtime(expires)))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO availability (%s) VALUES (?, ?, ?, ?, ?, ?)" % (
+                    ", ".join(self.FIELDS)),
+                (url, int(bool(available)), failures, now, expires,
+                 None if error is None else str(error)))
+            self._conn.commit()
+
+    def failures(self, url):
+        """ Return the number of consecutive failures of the given url.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT failures FROM availability WHERE url = ?", (url,)).fetchone()
+        return 0 if row is None else row[0]
+
+    def clear(self):
+        """ Remove all entries from the cache.
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM availability")
+            self._conn.commit()
+
+    def close(self):
+        """ Close the database connection.
+        """
+        with self._lock:
+            self._conn.close()
+
+# END Class AvailabilityCache
+
+
+_availability_cache = None
+_availability_lock = threading.Lock()
+
+
+def get_availability_cache():
+    """ Return the availability cache shared by all Collocate
+    instances, or None if it has been disabled. An in-memory
+    AvailabilityCache is created on first use.
+    """
+    global _availability_cache
+    with _availability_lock:
+        if _availability_cache is None:
+            _availability_cache = AvailabilityCache()
+        if _availability_cache is False:
+            return None
+        return _availability_cache
+
+
+def set_availability_cache(cache):
+    """ Replace the shared availability cache, e.g., with a persisted
+    AvailabilityCache(path=...). Use False to disable the cache, and
+    None to go back to a new in-memory cache.
+    """
+    global _availability_cache
+    with _availability_lock:
+        _availability_cache = cache
+
+
+class QueryCache:
+    """Cache of CSW search results, keyed by the endpoint, the output
+    schema, the maximum number of records and the canonical XML of the
+    filter list, so that repeated searches are not sent again.
+
+    The most recently used entries are kept in memory, up to
+    max_entries. If a path is given, the entries are also stored in an
+    SQLite database, and entries that are not in memory are read from
+    it. The records are stored with pickle, so only use databases
+    written by fadg.
+
+    Each entry expires after ttl seconds, except searches of closed
+    time periods, i.e., whose temporal filter ends more than
+    closed_after seconds ago, which expire after closed_ttl seconds.
+
+    Input
+    =====
+    path : string (default None)
+        Path to the SQLite database file. The cache is only kept in
+        memory if not given.
+    ttl : float (default 3600)
+        Time to live in seconds. None means that the entries never
+        expire.
+    closed_ttl : float (default None)
+        Time to live in seconds of searches of closed time periods.
+        None means that the entries never expire.
+    closed_after : float (default 604800)
+        Age in seconds of the end of the temporal filter after which
+        the time period is closed, i.e., no new records are expected
+    max_entries : int (default 256)
+        Maximum number of entries in memory
+    """
+
+    def __init__(self, path=None, ttl=3600, closed_ttl=None, closed_after=7*86400,
+                 max_entries=256):
+
+        self.path = path
+        self.ttl = ttl
+        self.closed_ttl = closed_ttl
+        self.closed_after = closed_after
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._conn = None
+        if path is not None:
+            if path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS queries ("
+                "key TEXT PRIMARY KEY, endpoint TEXT, records BLOB, stored REAL, "
+                "expires REAL)")
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            if self._conn is not None:
+                return self._conn.execute("SELECT COUNT(*) FROM queries").fetchone()[0]
+            return len(self._entries)
+
+    @staticmethod
+    def key(endpoint, filter_list, outputschema=None, max_records=None, elements=None):
+        """ Return the cache key of a search, i.e., a hash of the
+        endpoint, the output schema, the maximum number of records,
+        the requested element names if given, and the canonical (C14N)
+        XML of the filter list.
+        """
+        xml = etree.tostring(fes.FilterRequest().setConstraintList(filter_list), method="c14n")
+        digest = hashlib.sha256()
+        for part in [endpoint, outputschema, max_records]:
+            digest.update(("%s\n" % part).encode("utf-8"))
+        if elements is not None:
+            digest.update(("%s\n" % " ".join(elements)).encode("utf-8"))
+        digest.update(xml)
+        return digest.hexdigest()
+
+    def get(self, key):
+        """ Return a copy of the cached records dict of the given key,
+        or None if it is not cached or the entry has expired.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._conn is not None:
+                row = self._conn.execute("SELECT records, expires FROM queries WHERE key = ?",
+                                         (key,)).fetchone()
+                if row is not None:
+                    entry = (row[1], pickle.loads(row[0]))
+                    self._remember(key, entry)
+            if entry is None:
+                return None
+            if entry[0] is not None and now > entry[0]:
+                self._entries.pop(key, None)
+                if self._conn is not None:
+                    self._conn.execute("DELETE FROM queries WHERE key = ?", (key,))
+                    self._conn.commit()
+                return None
+            self._entries.move_to_end(key)
+            return dict(entry[1])
+
+    def put(self, key, records, endpoint=None, filter_list=None, ttl=None):
+        """ Store the records dict of a search. The time to live is
+        ttl if given, and otherwise chosen from the temporal filter of
+        filter_list (see QueryCache.get_ttl).
+        """
+        if ttl is None:
+            ttl = self.get_ttl(filter_list)
+        now = time.time()
+        expires = None if ttl is None else now + ttl
+        entry = (expires, dict(records))
+        with self._lock:
+            self._remember(key, entry)
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM queries WHERE expires < ?", (now,))
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO queries (key, endpoint, records, stored, expires) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, endpoint, pickle.dumps(entry[1]), now, expires))
+                self._conn.commit()
+
+    def get_ttl(self, filter_list=None):
+        """ Return the time to live of a search with the given filter
+        list: closed_ttl if it only selects records that begin more
+        than closed_after seconds ago, and ttl otherwise.
+        """
+        stop = QueryCache._get_temporal_stop(filter_list or [])
+        if stop is not None and stop < time.time() - self.closed_after:
+            return self.closed_ttl
+        return self.ttl
+
+    def clear(self):
+        """ Remove all entries from the cache.
+        """
+        with self._lock:
+            self._entries.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM queries")
+                self._conn.commit()
+
+    def close(self):
+        """ Close the database connection.
+        """
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+
+    def _remember(self, key, entry):
+        """ Keep the entry in memory, and evict the least recently
+        used entries exceeding max_entries. Must be called with the
+        lock held.
+        """
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    @staticmethod
+    def _get_temporal_stop(filter_list):
+        """ Return the end of the temporal filter in the top-level
+        conjunction of filter_list, i.e., the earliest upper bound on
+        apiso:TempExtent_begin, in seconds since the epoch, or None.
+        """
+        stops = []
+        stack = list(filter_list)
+        while stack:
+            operation = stack.pop()
+            if isinstance(operation, fes.And):
+                stack.extend(operation.operations)
+            elif isinstance(operation, fes.BinaryComparisonOpType) and \
+                    operation.propertyname == "apiso:TempExtent_begin" and \
+                    operation.propertyoperator in ["ogc:PropertyIsLessThan",
+                                                   "ogc:PropertyIsLessThanOrEqualTo"]:
+                try:
+                    stop = parse(operation.literal)
+                except (ValueError, OverflowError):
+                    continue
+                if stop.tzinfo is None:
+                    stop = stop.replace(tzinfo=datetime.timezone.utc)
+                stops.append(stop.timestamp())
+        return min(stops, default=None)
+
+# END Class QueryCache
@@ -0,0 +1,718 @@
+"""
+fadg : catalogue.py
+===================
+
+Copyright 2024 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Local mirror of CSW records in an SQLite database, with an R-tree
+index over longitude, latitude and time. SearchCSW and
+Collocate.get_collocations answer queries from the mirror when given
+catalogue=Catalogue(...), and fall back to the live CSW service when
+the mirror cannot answer, e.g., when the query reaches beyond the last
+full or incremental harvest.
+"""
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+from types import SimpleNamespace
+
+from xdg import xdg_cache_home
+from pytz import timezone
+from dateutil.parser import parse
+
+from owslib import fes
+from owslib.etree import etree
+from owslib.catalogue.csw2 import CswRecord
+
+from fadg import csw
+from fadg.geometry import Footprint
+from fadg.find_and_collocate import SearchCSW
+
+logger = logging.getLogger(__name__)
+
+# Columns of the queryable CSW properties
+PROPERTIES = {
+    "apiso:TempExtent_begin": "time_start",
+    "apiso:TempExtent_end": "time_end",
+    "apiso:Modified": "modified",
+    "apiso:Identifier": "identifier",
+    "dc:identifier": "identifier",
+    "apiso:Title": "title",
+    "dc:title": "title",
+    "csw:AnyText": "anytext",
+}
+TIME_COLUMNS = ["time_start", "time_end", "modified"]
+OPERATORS = {
+    "ogc:PropertyIsEqualTo": "=",
+    "ogc:PropertyIsNotEqualTo": "!=",
+    "ogc:PropertyIsLessThan": "<",
+    "ogc:PropertyIsLessThanOrEqualTo": "<=",
+    "ogc:PropertyIsGreaterThan": ">",
+    "ogc:PropertyIsGreaterThanOrEqualTo": ">=",
+}
+BBOX_CRS = [None, "urn:ogc:def:crs:OGC:1.3:CRS84"]
+
+# Bounds of records without temporal extent in the R-tree
+UNBOUNDED = 1e30
+# The R-tree stores 32 bit floats, i.e., times are rounded to ~2 minutes
+RTREE_SLACK = 3600.
+
+
+class Catalogue:
+    """Local copy of CSW records, stored in an SQLite database with an
+    R-tree index over the bounding box and the temporal extent. Each
+    record holds the identifier, title, OPeNDAP url, temporal extent,
+    bounding box, modification time and the record XML. Records are
+    added with Catalogue.upsert, usually by a Harvester.
+
+    Queries are given as lists of owslib.fes filters, like for
+    SearchCSW._execute. Comparisons on TempExtent_begin/end, Modified,
+    identifier and title, PropertyIsLike on title and AnyText (as
+    case-insensitive substring match), BBox in CRS84, and And, Or and
+    Not are supported.
+
+    The catalogue only answers queries whose time window ended at
+    least lag seconds before the start of the last full or incremental
+    harvest (see Catalogue.get_coverage), since later records may be
+    missing from the mirror.
+
+    Input
+    =====
+    path : string (default $XDG_CACHE_HOME/fadg/catalogue.sqlite)
+        Path to the SQLite database file. Use ":memory:" for a
+        non-persistent catalogue.
+    lag : float (default 3600)
+        Seconds from the end of the temporal extent of a dataset
+        until its record is expected in the CSW service
+    """
+
+    FIELDS = [
+        "identifier", "title", "anytext", "odap_url", "time_start", "time_end",
+        "lon_min", "lat_min", "lon_max", "lat_max", "modified", "xml", "harvested",
+    ]
+    HARVEST_FIELDS = [
+        "endpoint", "mode", "started", "duration", "requests", "records", "inserted",
+        "updated", "watermark",
+    ]
+
+    def __init__(self, path=None, lag=3600.):
+
+        if path is None:
+            path = os.path.join(xdg_cache_home(), "fadg", "catalogue.sqlite")
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self.path = path
+        self.lag = lag
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS records ("
+            "id INTEGER PRIMARY KEY, identifier TEXT UNIQUE NOT NULL, title TEXT, "
+            "anytext TEXT, odap_url TEXT, time_start REAL, time_end REAL, "
+            "lon_min REAL, lat_min REAL, lon_max REAL, lat_max REAL, "
+            "modified REAL, xml BLOB, harvested REAL)")
+        self._conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS records_rtree USING rtree("
+            "id, lon_min, lon_max, lat_min, lat_max, t_min, t_max)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS harvests ("
+            "id INTEGER PRIMARY KEY, endpoint TEXT, mode TEXT, started REAL, duration REAL, "
+            "requests INTEGER, records INTEGER, inserted INTEGER, updated INTEGER, "
+            "watermark REAL)")
+        self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    def upsert(self, records):
+        """ Insert or update the given CSW records, a dict keyed by
+        identifier or an iterable of records. Return a dict with the
+        number of inserted and updated records, and the latest
+        modification time of the records (seconds since the epoch, or
+        None).
+        """
+        if isinstance(records, dict):
+            records = records.values()
+        rows = [Catalogue._record_row(record) for record in records]
+        rows = [row for row in rows if row["identifier"] is not None]
+        modified = [row["modified"] for row in rows if row["modified"] is not None]
+        result = {"inserted": 0, "updated": 0, "modified": max(modified, default=None)}
+        now = time.time()
+        with self._lock:
+            for row in rows:
+                row["harvested"] = now
+                exists = self._conn.execute("SELECT 1 FROM records WHERE identifier = ?",
+                                            (row["identifier"],)).fetchone()
+                result["updated" if exists else "inserted"] += 1
+                values = [row[field] for field in self.FIELDS]
+                self._conn.execute(
+                    "INSERT INTO records (%s) VALUES (%s) ON CONFLICT(identifier) DO UPDATE "
+                    "SET %s" % (", ".join(self.FIELDS), ", ".join(["?"]*len(self.FIELDS)),
+                                ", ".join("%s = excluded.%s" % (field, field)
+                                          for field in self.FIELDS[1:])),
+                    values)
+                rowid = self._conn.execute("SELECT id FROM records WHERE identifier = ?",
+                                           (row["identifier"],)).fetchone()[0]
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO records_rtree VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    Catalogue._rtree_row(rowid, row))
+            self._conn.commit()
+
+        return result
+
+    def get_watermark(self, endpoint):
+        """ Return the latest record modification time (seconds since
+        the epoch) seen in full or incremental harvests of the given
+        endpoint, or None if there is none.
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT MAX(watermark) FROM harvests WHERE endpoint = ? "
+                "AND mode IN ('full', 'incremental')", (endpoint,)).fetchone()[0]
+
+    def get_coverage(self, endpoint=None):
+        """ Return the start time (seconds since the epoch) of the
+        latest full or incremental harvest, of the given endpoint if
+        given, or None if there is none. The catalogue holds all
+        records published before this time. Partial harvests do not
+        count, since they are limited by a filter or a number of
+        records.
+        """
+        sql = "SELECT MAX(started) FROM harvests WHERE mode IN ('full', 'incremental')"
+        params = []
+        if endpoint is not None:
+            sql += " AND endpoint = ?"
+            params.append(endpoint)
+        with self._lock:
+            return self._conn.execute(sql, params).fetchone()[0]
+
+    def add_harvest(self, stats):
+        """ Store the statistics dict of a harvest (see
+        Harvester.harvest).
+        """
+        fields = Catalogue.HARVEST_FIELDS
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO harvests (%s) VALUES (%s)" % (
+                    ", ".join(fields), ", ".join(["?"]*len(fields))),
+                [stats[field] for field in fields])
+            self._conn.commit()
+
+    def get_harvests(self, endpoint=None, limit=None):
+        """ Return a list of harvest statistics dicts, newest first,
+        optionally for the given endpoint only.
+        """
+        fields = Catalogue.HARVEST_FIELDS
+        sql = "SELECT %s FROM harvests" % ", ".join(fields)
+        params = []
+        if endpoint is not None:
+            sql += " WHERE endpoint = ?"
+            params.append(endpoint)
+        sql += " ORDER BY id DESC"
+        if limit is not None:
+            sql += " LIMIT %d" % int(limit)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [dict(zip(fields, row)) for row in rows]
+
+    def search(self, filter_list, max_records=1000, outputschema=csw.CSW_SCHEMA,
+               endpoint=None):
+        """ Return a dict of the records matching the given filter
+        list, keyed by identifier, or None if the catalogue cannot
+        answer the query, i.e., if it is empty, the filter is not
+        supported, ISO 19139 records are requested, or the time window
+        of the query is not covered by the harvests (of the given
+        endpoint). Queries without an upper time bound are never
+        covered.
+        """
+        if outputschema != csw.CSW_SCHEMA:
+            return None
+        coverage = self.get_coverage(endpoint=endpoint)
+        stop = Catalogue._get_time_bound(filter_list)
+        if coverage is None or stop is None or stop > coverage - self.lag:
+            logger.debug("The query is not covered by the harvests of the catalogue")
+            return None
+        try:
+            where, params = Catalogue._translate_list(filter_list, top=True)
+        except NotImplementedError as ee:
+            logger.debug("The catalogue cannot answer the query: %s", ee)
+            return None
+        rtree, rtree_params = Catalogue._rtree_condition(filter_list)
+        # Intersects filters are translated to bounding box conditions,
+        # and the rows are then tested against the polygons
+        footprints = Catalogue._footprints(filter_list)
+
+        sql = "SELECT identifier, title, odap_url, time_start, time_end, lon_min, lat_min, " \
+              "lon_max, lat_max, xml FROM records"
+        conditions = []
+        if rtree:
+            conditions.append("id IN (SELECT id FROM records_rtree WHERE %s)" % rtree)
+        if where:
+            conditions.append(where)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY id"
+        limited = max_records is not None and max_records != float("inf")
+        if limited and not footprints:
+            sql += " LIMIT %d" % int(max_records)
+
+        with self._lock:
+            if self._conn.execute("SELECT COUNT(*) FROM records").fetchone()[0] == 0:
+                return None
+            rows = self._conn.execute(sql, rtree_params + params).fetchall()
+
+        for footprint in footprints:
+            if len(rows) == 0:
+                break
+            hits = footprint.intersects_bboxes([row[5:9] for row in rows])
+            rows = [row for row, hit in zip(rows, hits) if hit]
+        if limited:
+            rows = rows[:int(max_records)]
+
+        records = {}
+        for row in rows:
+            records[row[0]] = Catalogue._row_record(row)
+        return records
+
+    def clear(self):
+        """ Remove all records and harvest statistics from the
+        catalogue.
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM records")
+            self._conn.execute("DELETE FROM records_rtree")
+            self._conn.execute("DELETE FROM harvests")
+            self._conn.commit()
+
+    def close(self):
+        """ Close the database connection.
+        """
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _to_epoch(value):
+        """ Return the given time string as seconds since the epoch,
+        or None if it is missing or open ended. Times without time
+        zone are UTC, and dates are read as midnight.
+        """
+        if value is None:
+            return None
+        value = str(value).strip()
+        if value in ["", "..", "now"]:
+            return None
+        try:
+            tt = parse(value)
+        except (ValueError, OverflowError):
+            return None
+        return tt.replace(tzinfo=tt.tzinfo or timezone("utc")).timestamp()
+
+    @staticmethod
+    def _record_row(record):
+        """ Return a dict of the catalogue columns of given CSW record.
+        """
+        start, end = SearchCSW._get_record_extent(record)
+        bbox = SearchCSW.get_record_bbox(record) or [None]*4
+        words = [getattr(record, "identifier", None), getattr(record, "title", None),
+                 getattr(record, "abstract", None)]
+        words.extend(getattr(record, "subjects", None) or [])
+        return {
+            "identifier": getattr(record, "identifier", None),
+            "title": getattr(record, "title", None),
+            "anytext": " ".join(str(word) for word in words if word),
+            "odap_url": SearchCSW.get_odap_url(record),
+            "time_start": Catalogue._to_epoch(start),
+            "time_end": Catalogue._to_epoch(end),
+            "lon_min": bbox[0],
+            "lat_min": bbox[1],
+            "lon_max": bbox[2],
+            "lat_max": bbox[3],
+            "modified": Catalogue._to_epoch(getattr(record, "modified", None)),
+            "xml": getattr(record, "xml", None),
+        }
+
+    @staticmethod
+    def _rtree_row(rowid, row):
+        """ Return the R-tree entry of a catalogue row. Records without
+        bounding box cover the globe, and records without temporal
+        extent are unbounded in time. The R-tree is only a prefilter,
+        so the exact conditions are evaluated on the records table.
+        """
+        bbox = [row["lon_min"], row["lat_min"], row["lon_max"], row["lat_max"]]
+        if None in bbox:
+            bbox = [-180., -90., 180., 90.]
+        t_min = row["time_start"]
+        t_max = row["time_end"]
+        if t_min is None:
+            t_min = -UNBOUNDED
+        if t_max is None or t_max < t_min:
+            t_max = UNBOUNDED
+        return [rowid, bbox[0], bbox[2], bbox[1], bbox[3], t_min, t_max]
+
+    @staticmethod
+    def _row_record(row):
+        """ Return a CSW record of a catalogue row, parsed from the
+        stored XML if available.
+        """
+        identifier, title, odap_url, start, end, lon_min, lat_min, lon_max, lat_max, xml = row
+        if xml is not None:
+            return CswRecord(etree.fromstring(xml))
+
+        def isoformat(value):
+            if value is None:
+                return ".."
+            return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(value))
+
+        references = []
+        if odap_url is not None:
+            references.append({"scheme": "OPENDAP:OPENDAP", "url": odap_url})
+        bbox = None
+        if lon_min is not None:
+            bbox = SimpleNamespace(minx=lon_min, miny=lat_min, maxx=lon_max, maxy=lat_max)
+        temporal = None
+        if start is not None or end is not None:
+            temporal = "%s/%s" % (isoformat(start), isoformat(end))
+        return SimpleNamespace(identifier=identifier, title=title, references=references,
+                               temporal=temporal, bbox=bbox)
+
+    @staticmethod
+    def _translate_list(filter_list, top=False):
+        """ Return an SQL condition and its parameters for a list of
+        fes filters, which are combined with AND.
+        """
+        conditions = []
+        params = []
+        for operation in filter_list:
+            sql, values = Catalogue._translate(operation, top=top)
+            conditions.append(sql)
+            params.extend(values)
+        return " AND ".join(conditions), params
+
+    @staticmethod
+    def _translate(operation, top=False):
+        """ Return an SQL condition and its parameters for a fes
+        filter. Raise NotImplementedError for unsupported filters.
+
+        Intersects filters, or an Or of Intersects filters, are only
+        supported in the top level conjunction (top=True), where they
+        are translated to the bounding box of the polygons, and the
+        rows are tested exactly by Catalogue.search.
+        """
+        footprint = Catalogue._footprint(operation)
+        if footprint is not None:
+            if not top:
+                raise NotImplementedError("Intersects is only supported in the top level "
+                                          "conjunction")
+            return Catalogue._translate(fes.BBox(footprint.bbox))
+        if isinstance(operation, (fes.And, fes.Or)):
+            if len(operation.operations) == 0:
+                raise NotImplementedError("Empty logical operator")
+            joiner = " AND " if isinstance(operation, fes.And) else " OR "
+            top = top and isinstance(operation, fes.And)
+            parts = [Catalogue._translate(op, top=top) for op in operation.operations]
+            return ("(%s)" % joiner.join(sql for sql, values in parts),
+                    [value for sql, values in parts for value in values])
+        if isinstance(operation, fes.Not):
+            sql, values = Catalogue._translate_list(operation.operations)
+            return "NOT (%s)" % sql, values
+        if isinstance(operation, fes.BBox):
+            if operation.crs not in BBOX_CRS:
+                raise NotImplementedError("Unsupported bbox crs %s" % operation.crs)
+            bbox = [float(value) for value in operation.bbox]
+            return ("(lon_min <= ? AND lon_max >= ? AND lat_min <= ? AND lat_max >= ?)",
+                    [bbox[2], bbox[0], bbox[3], bbox[1]])
+        if isinstance(operation, fes.PropertyIsLike):
+            column = Catalogue._column(operation.propertyname)
+            literal = Catalogue._like_pattern(operation)
+            if column == "anytext":
+                literal = "%" + literal + "%"
+            return "%s LIKE ? ESCAPE '\\'" % column, [literal]
+        if isinstance(operation, fes.BinaryComparisonOpType) and \
+                operation.propertyoperator in OPERATORS:
+            column = Catalogue._column(operation.propertyname)
+            literal = operation.literal
+            if column in TIME_COLUMNS:
+                literal = Catalogue._to_epoch(literal)
+                if literal is None:
+                    raise NotImplementedError("Invalid time %s" % operation.literal)
+            return "%s %s ?" % (column, OPERATORS[operation.propertyoperator]), [literal]
+        raise NotImplementedError("Unsupported filter %s" % type(operation).__name__)
+
+    @staticmethod
+    def _footprint(operation):
+        """ Return the fadg.geometry.Footprint of an Intersects filter,
+        or of an Or of Intersects filters, and None for other
+        filters.
+        """
+        if isinstance(operation, csw.Intersects):
+            parts = [operation]
+        elif isinstance(operation, fes.Or) and len(operation.operations) > 0 and \
+                all(isinstance(op, csw.Intersects) for op in operation.operations):
+            parts = operation.operations
+        else:
+            return None
+        crs = set(part.crs for part in parts)
+        if len(crs) != 1 or list(crs)[0] not in BBOX_CRS:
+            raise NotImplementedError("Unsupported polygon crs %s" % ", ".join(map(str, crs)))
+        try:
+            return Footprint([[part.exterior] for part in parts])
+        except ValueError as ee:
+            raise NotImplementedError("Invalid polygon: %s" % ee)
+
+    @staticmethod
+    def _footprints(filter_list):
+        """ Return the footprints of the Intersects filters of the top
+        level conjunction.
+        """
+        footprints = []
+        stack = list(filter_list)
+        while stack:
+            operation = stack.pop()
+            if isinstance(operation, fes.And):
+                stack.extend(operation.operations)
+                continue
+            footprint = Catalogue._footprint(operation)
+            if footprint is not None:
+                footprints.append(footprint)
+        return footprints
+
+    @staticmethod
+    def _column(propertyname):
+        """ Return the column of a CSW queryable property.
+        """
+        if propertyname not in PROPERTIES:
+            raise NotImplementedError("Unsupported property %s" % propertyname)
+        return PROPERTIES[propertyname]
+
+    @staticmethod
+    def _like_pattern(operation):
+        """ Return the SQL LIKE pattern, with backslash as escape
+        character, of a fes.PropertyIsLike filter.
+        """
+        pattern = []
+        escaped = False
+        for char in operation.literal:
+            if escaped:
+                pattern.append("\\" + char if char in "%_\\" else char)
+                escaped = False
+            elif char == operation.escapeChar:
+                escaped = True
+            elif char == operation.wildCard:
+                pattern.append("%")
+            elif char == operation.singleChar:
+                pattern.append("_")
+            elif char in "%_\\":
+                pattern.append("\\" + char)
+            else:
+                pattern.append(char)
+        return "".join(pattern)
+
+    @staticmethod
+    def _get_time_bound(filter_list):
+        """ Return the upper bound (seconds since the epoch) of the
+        temporal extent of the records matching the filter list, i.e.,
+        the smallest upper bound on TempExtent_begin or TempExtent_end
+        in the top level conjunction, or None if there is none.
+        """
+        bounds = []
+        stack = list(filter_list)
+        while stack:
+            operation = stack.pop()
+            if isinstance(operation, fes.And):
+                stack.extend(operation.operations)
+            elif isinstance(operation, fes.BinaryComparisonOpType) and \
+                    operation.propertyname in ["apiso:TempExtent_begin",
+                                               "apiso:TempExtent_end"] and \
+                    operation.propertyoperator in ["ogc:PropertyIsLessThan",
+                                                   "ogc:PropertyIsLessThanOrEqualTo"]:
+                value = Catalogue._to_epoch(operation.literal)
+                if value is not None:
+                    bounds.append(value)
+        return min(bounds, default=None)
+
+    @staticmethod
+    def _rtree_condition(filter_list):
+        """ Return an R-tree condition and its parameters implied by
+        the BBox, Intersects and temporal extent comparisons that all
+        results must fulfil, i.e., those of the top level conjunction.
+        """
+        conditions = []
+        params = []
+        stack = list(filter_list)
+        while stack:
+            operation = stack.pop()
+            if isinstance(operation, fes.And):
+                stack.extend(operation.operations)
+            elif isinstance(operation, fes.BBox) and operation.crs in BBOX_CRS or \
+                    Catalogue._footprint(operation) is not None:
+                if isinstance(operation, fes.BBox):
+                    bbox = [float(value) for value in operation.bbox]
+                else:
+                    bbox = Catalogue._footprint(operation).bbox
+                conditions.append("lon_min <= ? AND lon_max >= ? AND lat_min <= ? "
+                                  "AND lat_max >= ?")
+                params.extend([bbox[2], bbox[0], bbox[3], bbox[1]])
+            elif isinstance(operation, fes.BinaryComparisonOpType) and \
+                    operation.propertyname in ["apiso:TempExtent_begin", "apiso:TempExtent_end"]:
+                value = Catalogue._to_epoch(operation.literal)
+                column = "t_min" if operation.propertyname.endswith("begin") else "t_max"
+                if value is None:
+                    continue
+                if operation.propertyoperator in ["ogc:PropertyIsLessThan",
+                                                  "ogc:PropertyIsLessThanOrEqualTo"]:
+                    conditions.append("%s <= ?" % column)
+                    params.append(value + RTREE_SLACK)
+                elif operation.propertyoperator in ["ogc:PropertyIsGreaterThan",
+                                                    "ogc:PropertyIsGreaterThanOrEqualTo"]:
+                    conditions.append("%s >= ?" % column)
+                    params.append(value - RTREE_SLACK)
+        return " AND ".join(conditions), params
+
+# END Class Catalogue
+
+
+class Harvester(SearchCSW):
+    """Mirror records of a CSW service into a Catalogue, and keep the
+    mirror current. The records are retrieved as Dublin Core records
+    (see SearchCSW._iter_pages).
+
+    Harvester.harvest copies all records, or those matching a filter,
+    page by page. Harvester.sync only requests the records modified
+    since the last harvest, i.e., apiso:Modified at or after the
+    watermark, which is the latest modification time seen in previous
+    harvests of the endpoint. The statistics of each harvest are
+    stored in the catalogue (see Catalogue.get_harvests).
+
+    Input
+    =====
+    catalogue : fadg.catalogue.Catalogue
+        The local catalogue
+    endpoint : string (default https://data.csw.met.no)
+        CSW service url
+    pagesize : int (default 100)
+        Number of records of the first GetRecords request
+    workers : int (default 1)
+        Number of concurrent GetRecords requests
+    pooled : bool (default False)
+        Use the shared keep-alive session (see SearchCSW._set_csw_connection)
+    """
+
+    def __init__(self, catalogue, endpoint="https://data.csw.met.no", pagesize=100, workers=1,
+                 pooled=False):
+        self.catalogue = catalogue
+        self.endpoint = endpoint
+        self.pagesize = pagesize
+        self.workers = workers
+        self.pooled = pooled
+        self.conn_csw = None
+        self.request_count = 0
+
+    def harvest(self, filter_list=None, max_records=None):
+        """ Copy the records matching the given list of fes filters,
+        or all records, into the catalogue, and return the harvest
+        statistics: endpoint, mode, started, duration (seconds),
+        requests, records, inserted, updated and watermark. Harvests
+        limited by filter_list or max_records have mode "partial", and
+        do not set the watermark used by Harvester.sync.
+
+        Input
+        =====
+        filter_list : list (default None)
+            List of owslib.fes filter objects
+        max_records : int (default None)
+            Maximum number of records. None means no limit.
+        """
+        partial = bool(filter_list) or max_records is not None
+        stats = self._new_stats("partial" if partial else "full")
+        for page in self._iter_pages(filter_list or [], **self._page_kwargs(max_records)):
+            self._update_stats(stats, self.catalogue.upsert(page))
+
+        return self._finish_stats(stats)
+
+    def sync(self, overlap=300):
+        """ Copy the records modified since the last harvest of the
+        endpoint into the catalogue, and return the harvest statistics
+        (see Harvester.harvest). A full harvest is made if the
+        endpoint has not been harvested before.
+
+        Input
+        =====
+        overlap : float (default 300)
+            Seconds before the watermark to include, so that records
+            with the same modification time as the watermark are not
+            missed. Records that are requested again are updated.
+        """
+        watermark = self.catalogue.get_watermark(self.endpoint)
+        if watermark is None:
+            logger.debug("No watermark for %s, harvesting all records", self.endpoint)
+            return self.harvest()
+
+        since = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(watermark - overlap))
+        filter_list = [fes.PropertyIsGreaterThanOrEqualTo(propertyname="apiso:Modified",
+                                                          literal=since)]
+        stats = self._new_stats("incremental", watermark=watermark)
+        records = self._execute(filter_list, **self._page_kwargs())
+        self._update_stats(stats, self.catalogue.upsert(records))
+
+        return self._finish_stats(stats)
+
+    def _page_kwargs(self, max_records=None):
+        """ Return the paging keywords of SearchCSW._iter_pages.
+        """
+        return {
+            "pagesize": self.pagesize,
+            "max_records": float("inf") if max_records is None else max_records,
+            "endpoint": self.endpoint,
+            "outputschema": csw.CSW_SCHEMA,
+            "workers": self.workers,
+            "max_pagesize": max(self.pagesize, 100),
+            "pooled": self.pooled,
+        }
+
+    def _new_stats(self, mode, watermark=None):
+        """ Return the initial statistics dict of a harvest.
+        """
+        return {"endpoint": self.endpoint, "mode": mode, "started": time.time(),
+                "duration": None, "requests": 0, "records": 0, "inserted": 0, "updated": 0,
+                "watermark": watermark}
+
+    @staticmethod
+    def _update_stats(stats, result):
+        """ Add the result of Catalogue.upsert to the statistics.
+        """
+        stats["inserted"] += result["inserted"]
+        stats["updated"] += result["updated"]
+        stats["records"] += result["inserted"] + result["updated"]
+        if result["modified"] is not None:
+            stats["watermark"] = max(result["modified"], stats["watermark"] or result["modified"])
+
+    def _finish_stats(self, stats):
+        """ Complete the statistics, and store them in the catalogue.
+        """
+        stats["duration"] = time.time() - stats["started"]
+        stats["requests"] = self.request_count
+        self.catalogue.add_harvest(stats)
+        logger.debug("Harvested %d records (%d new) from %s with %d requests",
+                     stats["records"], stats["inserted"], self.endpoint, stats["requests"])
+
+        return stats
+
+# END Class Harvester
@@ -0,0 +1,290 @@
+"""
+fadg : csw.py
+=============
+
+Copyright 2024 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import time
+import logging
+import threading
+
+from owslib import fes
+from owslib import util
+from owslib.etree import etree
+from owslib.iso import MD_Metadata
+from owslib.catalogue.csw2 import CswRecord
+from owslib.catalogue.csw2 import namespaces
+from owslib.csw import CatalogueServiceWeb
+
+from fadg.session import get_session
+
+logger = logging.getLogger(__name__)
+
+CSW_SCHEMA = "http://www.opengis.net/cat/csw/2.0.2"
+ISO_SCHEMA = "http://www.isotc211.org/2005/gmd"
+DC_RECORD_TAGS = ["csw:Record", "csw:SummaryRecord", "csw:BriefRecord"]
+# Dublin Core elements read by fadg, i.e., identifier, OPeNDAP url,
+# temporal extent and bounding box
+SLIM_ELEMENTS = ["dc:identifier", "dct:references", "dct:temporal", "ows:BoundingBox"]
+
+
+class Intersects(fes.OgcExpression):
+    """OGC Filter Encoding 1.1 Intersects operator with a GML polygon,
+    which owslib.fes only provides as bounding box (fes.BBox).
+
+    Input
+    =====
+    exterior : list or array
+        Exterior ring of the polygon as [x, y] points in the axis
+        order of crs
+    crs : string (default None)
+        srsName of the polygon
+    propertyname : string (default ows:BoundingBox)
+        Geometry property of the records
+    """
+
+    def __init__(self, exterior, crs=None, propertyname="ows:BoundingBox"):
+        self.exterior = [[float(x), float(y)] for x, y in exterior]
+        self.crs = crs
+        self.propertyname = propertyname
+
+    def toXML(self):
+        node = etree.Element(util.nspath_eval("ogc:Intersects", namespaces))
+        etree.SubElement(node, util.nspath_eval("ogc:PropertyName", namespaces)).text = \
+            self.propertyname
+        polygon = etree.SubElement(node, util.nspath_eval("gml:Polygon", namespaces))
+        if self.crs is not None:
+            polygon.set("srsName", self.crs)
+        exterior = etree.SubElement(polygon, util.nspath_eval("gml:exterior", namespaces))
+        ring = etree.SubElement(exterior, util.nspath_eval("gml:LinearRing", namespaces))
+        etree.SubElement(ring, util.nspath_eval("gml:posList", namespaces)).text = \
+            " ".join("%r %r" % (x, y) for x, y in self.exterior)
+        return node
+
+
+def getrecords_xml(filter_list, startposition=1, maxrecords=10, outputschema=CSW_SCHEMA,
+                   esn="full", elements=None):
+    """ Return a CSW 2.0.2 GetRecords POST request as bytes.
+
+    Input
+    =====
+    filter_list : list
+        List of owslib.fes filter objects
+    startposition : int (default 1)
+        1-based position of the first record
+    maxrecords : int (default 10)
+        Maximum number of records in the response
+    outputschema : string
+        Dublin Core (CSW_SCHEMA) or ISO 19139 (ISO_SCHEMA)
+    esn : string (default full)
+        Element set name, i.e., brief, summary or full
+    elements : list (default None)
+        Names of the elements to return (csw:ElementName), e.g.,
+        SLIM_ELEMENTS, used instead of the element set name
+    """
+    nsmap = {
+        "csw": namespaces["csw"],
+        "ogc": namespaces["ogc"],
+        "gml": namespaces["gml"],
+        "xsi": namespaces["xsi"],
+        "dc": namespaces["dc"],
+        "dct": namespaces["dct"],
+        "ows": namespaces["ows"],
+    }
+    root = etree.Element(util.nspath_eval("csw:GetRecords", namespaces), nsmap=nsmap)
+    root.set("service", "CSW")
+    root.set("version", "2.0.2")
+    root.set("resultType", "results")
+    root.set("startPosition", str(startposition))
+    root.set("maxRecords", str(maxrecords))
+    root.set("outputFormat", "application/xml")
+    root.set("outputSchema", outputschema)
+    root.set(util.nspath_eval("xsi:schemaLocation", namespaces),
+             "http://www.opengis.net/cat/csw/2.0.2 "
+             "http://schemas.opengis.net/csw/2.0.2/CSW-discovery.xsd")
+
+    query = etree.SubElement(root, util.nspath_eval("csw:Query", namespaces))
+    query.set("typeNames", "csw:Record")
+    if elements:
+        for name in elements:
+            etree.SubElement(query, util.nspath_eval("csw:ElementName", namespaces)).text = name
+    else:
+        etree.SubElement(query, util.nspath_eval("csw:ElementSetName", namespaces)).text = esn
+    if len(filter_list) > 0:
+        constraint = etree.SubElement(query, util.nspath_eval("csw:Constraint", namespaces))
+        constraint.set("version", "1.1.0")
+        constraint.append(fes.FilterRequest().setConstraintList(filter_list))
+
+    return etree.tostring(root, xml_declaration=True, encoding="UTF-8")
+
+
+def parse_getrecords_response(content, outputschema=CSW_SCHEMA):
+    """ Parse a CSW 2.0.2 GetRecords response, and return a tuple of
+    the records dict, keyed by identifier, and a results dict with
+    matches, returned and nextrecord (like
+    owslib.csw.CatalogueServiceWeb.results).
+    """
+    root = etree.fromstring(content)
+    if root.tag == util.nspath_eval("ows:ExceptionReport", namespaces):
+        text = " ".join(root.itertext()).strip()
+        raise ValueError("CSW exception: %s" % text)
+
+    search = root.find(util.nspath_eval("csw:SearchResults", namespaces))
+    if search is None:
+        raise ValueError("Invalid GetRecords response: missing SearchResults.")
+
+    results = {
+        "matches": int(search.get("numberOfRecordsMatched", 0)),
+        "returned": int(search.get("numberOfRecordsReturned", 0)),
+        "nextrecord": int(search.get("nextRecord", 0)),
+    }
+
+    records = {}
+    if outputschema == ISO_SCHEMA:
+        for elem in search.findall(util.nspath_eval("gmd:MD_Metadata", namespaces)):
+            record = MD_Metadata(elem)
+            records[record.identifier] = record
+    else:
+        for tag in DC_RECORD_TAGS:
+            for elem in search.findall(util.nspath_eval(tag, namespaces)):
+                record = CswRecord(elem)
+                records[record.identifier] = record
+
+    return records, results
+
+
+def get_queryables(capabilities):
+    """ Return the set of queryables (e.g., apiso:TempExtent_end) that
+    the GetRecords operation advertises in the given capabilities
+    (owslib.csw.CatalogueServiceWeb), or None if they are unknown.
+    """
+    try:
+        operation = capabilities.get_operation_by_name("GetRecords")
+    except (AttributeError, KeyError):
+        return None
+    queryables = set()
+    for constraint in getattr(operation, "constraints", []):
+        if constraint.name.endswith("Queryables"):
+            queryables.update(constraint.values)
+    return queryables or None
+
+
+class CapabilitiesCache:
+    """Cache of parsed CSW GetCapabilities responses, keyed by
+    endpoint. Entries expire after ttl seconds. The cache is shared
+    between threads.
+
+    Input
+    =====
+    ttl : float (default 3600)
+        Time to live in seconds
+    """
+
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, endpoint, timeout=60):
+        """ Return the owslib.csw.CatalogueServiceWeb capabilities
+        object of the given endpoint. GetCapabilities is only
+        requested if the endpoint is not cached or has expired.
+        """
+        with self._lock:
+            entry = self._entries.get(endpoint)
+            if entry is not None and time.time() - entry[0] <= self.ttl:
+                return entry[1]
+        logger.debug("Requesting capabilities of %s", endpoint)
+        capabilities = CatalogueServiceWeb(endpoint, timeout=timeout)
+        with self._lock:
+            self._entries[endpoint] = (time.time(), capabilities)
+        return capabilities
+
+    def peek(self, endpoint):
+        """ Return the cached capabilities of the given endpoint, or
+        None if they are not cached or have expired. Nothing is
+        requested.
+        """
+        with self._lock:
+            entry = self._entries.get(endpoint)
+        if entry is not None and time.time() - entry[0] <= self.ttl:
+            return entry[1]
+        return None
+
+    def clear(self):
+        """ Remove all cached capabilities.
+        """
+        with self._lock:
+            self._entries = {}
+
+
+CAPABILITIES = CapabilitiesCache()
+
+
+class CSWConnection:
+    """Minimal CSW 2.0.2 client that sends GetRecords POST requests
+    through a pooled requests.Session. It implements the subset of
+    owslib.csw.CatalogueServiceWeb used by SearchCSW, i.e.,
+    getrecords2, records, results and constraints.
+
+    Input
+    =====
+    endpoint : string
+        CSW service url
+    session : requests.Session (default None)
+        Session to use. The shared fadg session is used if not given.
+    capabilities : owslib.csw.CatalogueServiceWeb (default None)
+        Parsed capabilities of the service, e.g., from
+        CAPABILITIES.get(endpoint)
+    timeout : float (default 60)
+        Request timeout in seconds
+    """
+
+    def __init__(self, endpoint, session=None, capabilities=None, timeout=60):
+        self.url = endpoint
+        self.session = get_session() if session is None else session
+        self.timeout = timeout
+        self.capabilities = capabilities
+        self.constraints = getattr(capabilities, "constraints", {})
+        self.records = {}
+        self.results = {}
+        self.request_url = self._get_request_url()
+
+    def _get_request_url(self):
+        """ Return the GetRecords POST url advertised in the
+        capabilities, or the endpoint.
+        """
+        try:
+            operation = self.capabilities.get_operation_by_name("GetRecords")
+        except (AttributeError, KeyError):
+            return self.url
+        for method in operation.methods:
+            if method.get("type", "").lower() == "post" and method.get("url"):
+                return method["url"]
+        return self.url
+
+    def getrecords2(self, constraints=None, startposition=1, maxrecords=10,
+                    outputschema=CSW_SCHEMA, esn="full", elements=None):
+        """ Send a GetRecords request, and set self.records and
+        self.results. See getrecords_xml for the keywords.
+        """
+        data = getrecords_xml(constraints or [], startposition=startposition,
+                              maxrecords=maxrecords, outputschema=outputschema, esn=esn,
+                              elements=elements)
+        response = self.session.post(self.request_url, data=data, timeout=self.timeout,
+                                     headers={"Content-Type": "application/xml"})
+        response.raise_for_status()
+        self.records, self.results = parse_getrecords_response(response.content,
+                                                               outputschema=outputschema)
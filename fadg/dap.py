@@ -0,0 +1,147 @@
+"""
+fadg : dap.py
+=============
+
+Copyright 2024 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import re
+import logging
+import requests
+
+logger = logging.getLogger(__name__)
+
+DAS_TOKENS = re.compile(r'"(?:[^"\\]|\\.)*"|[{};,]|[^\s{};,"]+')
+INTEGER_TYPES = ["byte", "int16", "uint16", "int32", "uint32", "int64", "uint64"]
+FLOAT_TYPES = ["float32", "float64"]
+GLOBAL_CONTAINERS = ["NC_GLOBAL", "GLOBAL"]
+# HTTP status codes of datasets that are not available. Other errors,
+# e.g., 5xx or 429, say nothing about the dataset.
+UNAVAILABLE_STATUSES = [404, 410]
+
+
+def das_url(url):
+    """ Return the url of the DAS response of the given OPeNDAP url.
+    Fragments, e.g., #fillmismatch, and constraint expressions are
+    removed.
+    """
+    return url.split("#")[0].split("?")[0] + ".das"
+
+
+def fetch_global_attributes(url, timeout=60, session=None):
+    """ Fetch only the DAS response of the given OPeNDAP url, and
+    return its global attributes as a dict.
+
+    Raises FileNotFoundError if the server responds with HTTP 404 or
+    410, requests.RequestException for other request errors, and
+    ValueError if the response cannot be parsed.
+
+    Input
+    =====
+    url : string
+        Dataset OPeNDAP url
+    timeout : float (default 60)
+        Request timeout in seconds
+    session : requests.Session (default None)
+        Optional session for connection reuse
+    """
+    http = requests if session is None else session
+    response = http.get(das_url(url), timeout=timeout)
+    if response.status_code in UNAVAILABLE_STATUSES:
+        raise FileNotFoundError("The archive file %s is not available." % url)
+    response.raise_for_status()
+    return global_attributes(response.text)
+
+
+def is_available(url, timeout=60, session=None):
+    """ Return True if the DAS response of the given OPeNDAP url is
+    available, using an HTTP HEAD request, and False if the server
+    responds with HTTP 404 or 410. Other request errors, including
+    other HTTP error codes, e.g., 503, 429 or 405 if HEAD is not
+    allowed, are raised as requests.RequestException.
+    """
+    http = requests if session is None else session
+    response = http.head(das_url(url), timeout=timeout, allow_redirects=True)
+    if response.status_code in UNAVAILABLE_STATUSES:
+        return False
+    response.raise_for_status()
+    return True
+
+
+def parse_das(text):
+    """ Parse an OPeNDAP Dataset Attribute Structure (DAS) response,
+    and return a dict of attribute containers. Each container is a
+    dict of attribute names and values, and nested containers are
+    stored as dicts. Numeric values are converted to int or float, and
+    attributes with several values are returned as lists.
+    """
+    tokens = DAS_TOKENS.findall(text)
+    if len(tokens) < 2 or tokens[0] != "Attributes" or tokens[1] != "{":
+        raise ValueError("Invalid DAS response.")
+    containers, pos = _parse_container(tokens, 2)
+    return containers
+
+
+def global_attributes(text):
+    """ Return the global attributes of the given DAS response as a
+    dict. An empty dict is returned if there are no global attributes.
+    """
+    containers = parse_das(text)
+    for name in GLOBAL_CONTAINERS:
+        if name in containers:
+            return containers[name]
+    return {}
+
+
+def _parse_container(tokens, pos):
+    """ Parse the attributes and nested containers starting at
+    position pos, until the closing brace. Return the container dict
+    and the position after the closing brace.
+    """
+    container = {}
+    while pos < len(tokens):
+        token = tokens[pos]
+        if token == "}":
+            return container, pos + 1
+        if pos + 1 < len(tokens) and tokens[pos + 1] == "{":
+            container[token], pos = _parse_container(tokens, pos + 2)
+            continue
+        if pos + 2 >= len(tokens):
+            break
+        dtype = token.lower()
+        name = tokens[pos + 1]
+        values = []
+        pos += 2
+        while pos < len(tokens) and tokens[pos] != ";":
+            if tokens[pos] != ",":
+                values.append(_convert(tokens[pos], dtype))
+            pos += 1
+        pos += 1
+        container[name] = values[0] if len(values) == 1 else values
+    raise ValueError("Invalid DAS response: unbalanced braces.")
+
+
+def _convert(value, dtype):
+    """ Convert a DAS attribute value of the given type.
+    """
+    if value.startswith('"') and value.endswith('"') and len(value) > 1:
+        return re.sub(r"\\(.)", r"\1", value[1:-1])
+    try:
+        if dtype in INTEGER_TYPES:
+            return int(value)
+        if dtype in FLOAT_TYPES:
+            return float(value)
+    except ValueError:
+        logger.debug("Could not convert DAS value %s of type %s", value, dtype)
+    return value
@@ -16,30 +16,47 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
-import os
+import copy
+import time
+import inspect
 import netCDF4
 import logging
 import datetime
 
+import requests
 import numpy as np
 
+from types import SimpleNamespace
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from pytz import timezone
 from dateutil.parser import parse
 
 from owslib import fes
 from owslib.csw import CatalogueServiceWeb
 
+from fadg import csw
+from fadg import dap
+from fadg.cache import get_availability_cache
+from fadg.geometry import Footprint
+from fadg.geometry import split_bbox
+from fadg.index import TimeIndex
+from fadg.index import IntervalIndex
+from fadg.policy import DeadlineExceeded
+from fadg.policy import get_policy
+from fadg.session import get_session
+from fadg.thredds import PatternProduct
+
 
 class SearchCSW:
     """Find data in a given time interval and location.
 
     Note: owslib only handles bounding box search by maximum and
-    minimum longitude and latitude. This is very limited and
-    impractical for searches near the poles, so we should avoid owslib
-    and rather use jinja to fill out a template xml.
-
-    TODO: implement search for polygon intersection using an xml
-    template and jinja.
+    minimum longitude and latitude. Polygon search is done with an OGC
+    Intersects filter (fadg.csw.Intersects), and the records are then
+    filtered locally by the polygon.
 
     Input
     =====
@@ -50,9 +67,26 @@ class SearchCSW:
     bbox : float list (default [-180, -90, 180, 90])
        A bounding box for the search area specified by latitude and
        longitude, i.e., bbox = [lon_min, lat_min, lon_max, lat_max]
+    lazy : bool (default False)
+        Do not execute the search on initialisation. The records are
+        then retrieved page by page with SearchCSW.iter_records or
+        SearchCSW.iter_odap_urls, and self.records and self.urls are
+        None.
+    polygon : str or fadg.geometry.Footprint (default None)
+        Search area given as a WKT POLYGON or MULTIPOLYGON in lon/lat
+        order, used instead of bbox. The bbox is then set to the
+        bounding box of the polygon.
+
+    The endpoint keyword may be a list of CSW endpoints, which are
+    then searched concurrently (see SearchCSW._execute_federated).
     """
+
+    CSW_SCHEMA = csw.CSW_SCHEMA
+    ISO_SCHEMA = csw.ISO_SCHEMA
+
     def __init__(self, time=None, dt=24, bbox=None, text=None,
-                 crs="urn:ogc:def:crs:OGC:1.3:CRS84", *args, **kwargs):
+                 crs="urn:ogc:def:crs:OGC:1.3:CRS84", *args, lazy=False, polygon=None,
+                 **kwargs):
 
         self.time = time
         if self.time is None:
@@ -65,41 +99,251 @@ class SearchCSW:
             raise NotImplementedError("SearchCSW does not yet support more complex "
                                       "geographic search.")
 
+        self.polygon = polygon
+        if isinstance(self.polygon, str):
+            self.polygon = Footprint.from_wkt(self.polygon)
+        if self.polygon is not None:
+            self.bbox = self.polygon.bbox
+        self._set_bboxes()
+
         constraints = []
 
         # Create temporal search objects
-        temporal_search_start, temporal_search_end = self._temporal_filter(dt=dt)
+        temporal_search_start, temporal_search_end = self._temporal_filter(dt=dt, overlap=True)
 
         # Add temporal search objects to the list of constraints
         constraints.append(temporal_search_start)
         constraints.append(temporal_search_end)
 
-        bbox_search = fes.BBox(self.bbox, crs=crs)
-        constraints.append(bbox_search)
+        constraints.append(self._spatial_filter(crs=crs))
 
         if text is not None:
             constraints.append(self._get_free_text_search(text))
 
-        self.records = self._execute([fes.And(constraints)], *args, **kwargs)
+        self.filter_list = [fes.And(constraints)]
+        self._search_args = args
+        self._search_kwargs = kwargs
+
+        self.records = None
+        self.urls = None
+        if lazy:
+            return
+
+        self.records = self._filter_footprint(
+            self._execute(self.filter_list, *args, **kwargs))
 
         self.urls = []
 
         for key, record in self.records.items():
             self.urls.append(SearchCSW.get_odap_url(record))
 
+    def _set_bboxes(self):
+        """ Set self.bboxes, the tight bounding boxes of the search
+        area, from self.polygon or self.bbox. Boxes that cross the
+        antimeridian are split, and footprints that enclose a pole
+        get a polar cap (see fadg.geometry). Footprints that cross
+        the antimeridian or a pole are then only searched by their
+        bounding boxes, so self.polygon is set to None.
+        """
+        if self.polygon is None:
+            self.bboxes = split_bbox(self.bbox)
+            return
+        self.bboxes = self.polygon.bboxes()
+        if self.polygon.wraps:
+            self.polygon = None
+
+    def _spatial_filter(self, crs="urn:ogc:def:crs:OGC:1.3:CRS84", bboxes=None):
+        """ Return an Intersects filter for the polygon footprint, or a
+        BBox filter for each of self.bboxes, or the given bboxes,
+        combined with Or.
+        """
+        if self.polygon is None or bboxes is not None:
+            bboxes = self.bboxes if bboxes is None else bboxes
+            parts = [fes.BBox(bbox, crs=crs) for bbox in bboxes]
+        else:
+            parts = [csw.Intersects(polygon[0], crs=crs) for polygon in self.polygon.polygons]
+        return parts[0] if len(parts) == 1 else fes.Or(parts)
+
+    def _filter_footprint(self, records):
+        """ Return the records whose bounding box intersects the
+        polygon footprint, i.e., the exact test of the Intersects
+        filter. Records without bounding box are kept.
+        """
+        if self.polygon is None or len(records) == 0:
+            return records
+        keys = []
+        bboxes = []
+        for key, record in records.items():
+            bbox = SearchCSW.get_record_bbox(record)
+            if bbox is not None:
+                keys.append(key)
+                bboxes.append(bbox)
+        if len(bboxes) == 0:
+            return records
+        outside = set(key for key, hit in zip(keys, self.polygon.intersects_bboxes(bboxes))
+                      if not hit)
+        return {key: record for key, record in records.items() if key not in outside}
+
+    def iter_records(self):
+        """ Yield (key, record) tuples of the search results, page by
+        page as they are retrieved from the CSW service. Records that
+        have already been yielded are skipped.
+        """
+        seen = set()
+        for page in self._iter_endpoint_pages(self.filter_list, *self._search_args,
+                                              **self._search_kwargs):
+            for key, record in self._filter_footprint(page).items():
+                if key in seen:
+                    continue
+                seen.add(key)
+                yield key, record
+
+    def _iter_endpoint_pages(self, filter_list, *args, endpoint_timeout=None, **kwargs):
+        """ Yield the pages of SearchCSW._iter_pages, from each
+        endpoint in turn if a list of endpoints is given. Records with
+        the identifier or OPeNDAP url of a record from an earlier
+        endpoint are left out. The query_cache keyword is handled as
+        in SearchCSW._execute, per endpoint.
+        """
+        endpoints = kwargs.pop("endpoint", "https://data.csw.met.no")
+        if isinstance(endpoints, str):
+            yield from self._iter_cached_pages(filter_list, *args, endpoint=endpoints, **kwargs)
+            return
+        keys, urls = set(), set()
+        for endpoint in endpoints:
+            page_keys, page_urls = set(), set()
+            for page in self._iter_cached_pages(filter_list, *args, endpoint=endpoint,
+                                                **kwargs):
+                page = SearchCSW._drop_duplicates(page, keys, urls)
+                page_keys.update(page.keys())
+                page_urls.update(SearchCSW.get_odap_url(record) for record in page.values())
+                yield page
+            keys.update(page_keys)
+            urls.update(page_urls - {None})
+
+    @staticmethod
+    def _drop_duplicates(records, keys, urls):
+        """ Return the records whose identifier is not in keys and
+        whose OPeNDAP url is not in urls.
+        """
+        return {key: record for key, record in records.items()
+                if key not in keys and SearchCSW.get_odap_url(record) not in urls}
+
+    def iter_odap_urls(self):
+        """ Yield the OPeNDAP urls of the search results, page by page
+        as they are retrieved from the CSW service.
+        """
+        for key, record in self.iter_records():
+            yield SearchCSW.get_odap_url(record)
+
     @staticmethod
     def get_odap_url(record):
-        """ Return OPeNDAP url of given CSW record.
+        """ Return OPeNDAP url of given CSW record. Both Dublin Core
+        records and ISO 19139 records (owslib.iso.MD_Metadata) are
+        supported.
         """
+        if not hasattr(record, "references"):
+            return SearchCSW._get_iso_odap_url(record)
+
         if len(record.references) == 0:
             return None
 
+        url = None
         for scheme in record.references:
             if "opendap" in scheme["scheme"].lower():
                 url = scheme["url"]
                 break
         return url
 
+    @staticmethod
+    def _get_iso_odap_url(record):
+        """ Return OPeNDAP url of given ISO 19139 record.
+        """
+        distribution = getattr(record, "distribution", None)
+        if distribution is None:
+            return None
+        for resource in distribution.online:
+            if resource.protocol is not None and "opendap" in resource.protocol.lower():
+                return resource.url
+        return None
+
+    @staticmethod
+    def get_record_time_coverage(record):
+        """ Return the temporal extent of given CSW record as a tuple
+        of datetime.datetime objects (start, end).
+
+        The extent is read from dct:temporal ("start/end") of Dublin
+        Core records, or from the temporal extent of the
+        identification section of ISO 19139 records. Values that are
+        missing, open ended, or only given with date precision are
+        returned as None since they are too coarse for collocation.
+        """
+        start, end = SearchCSW._get_record_extent(record)
+
+        return SearchCSW._parse_extent_time(start), SearchCSW._parse_extent_time(end)
+
+    @staticmethod
+    def get_record_bbox(record):
+        """ Return the bounding box of given CSW record as a float
+        list [lon_min, lat_min, lon_max, lat_max], or None if the
+        record has no bounding box.
+        """
+        bbox = getattr(record, "bbox", None)
+        if bbox is None:
+            identification = SearchCSW._get_record_identification(record)
+            bbox = getattr(identification, "bbox", None)
+        if bbox is None:
+            return None
+        try:
+            return [float(bbox.minx), float(bbox.miny), float(bbox.maxx), float(bbox.maxy)]
+        except (AttributeError, TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def _get_record_identification(record):
+        """ Return the identification section of an ISO 19139 record,
+        or None.
+        """
+        identification = getattr(record, "identification", None)
+        if isinstance(identification, list):
+            identification = identification[0] if identification else None
+        return identification
+
+    @staticmethod
+    def _get_record_extent(record):
+        """ Return the temporal extent of given CSW record as a tuple
+        of unparsed strings (start, end), which may be None.
+        """
+        start = None
+        end = None
+        temporal = getattr(record, "temporal", None)
+        if temporal:
+            parts = temporal.split("/")
+            start = parts[0]
+            end = parts[1] if len(parts) > 1 else None
+        else:
+            identification = SearchCSW._get_record_identification(record)
+            if identification is not None:
+                start = getattr(identification, "temporalextent_start", None)
+                end = getattr(identification, "temporalextent_end", None)
+        return start, end
+
+    @staticmethod
+    def _parse_extent_time(value):
+        """ Parse a temporal extent value, and return None if it is
+        missing, open ended or lacks a time of day.
+        """
+        if value is None:
+            return None
+        value = value.strip()
+        if value in ["", "..", "now"] or len(value) <= 10:
+            return None
+        try:
+            time = parse(value)
+        except (ValueError, OverflowError):
+            return None
+        return time.replace(tzinfo=time.tzinfo or timezone("utc"))
+
     def _get_free_text_search(self, text):
         """ Return CSW search object based on any match with the input
         string.
@@ -119,61 +363,456 @@ class SearchCSW:
         return fes.PropertyIsLike(property_name, literal=text, escapeChar="\\", singleChar="_",
                                   wildCard="%", matchCase=True)
 
-    def _set_csw_connection(self, endpoint="https://data.csw.met.no"):
+    def _set_csw_connection(self, endpoint="https://data.csw.met.no", pooled=False):
         """ Sets connection to OGC CSW service.
+
+        With pooled=True, the connection uses the shared keep-alive
+        session of fadg (see fadg.session.get_session), and the
+        capabilities of the endpoint are read from a shared cache
+        (fadg.csw.CAPABILITIES), so that back-to-back searches skip
+        the GetCapabilities request.
+
+        The connection is made within the deadline of the shared call
+        policy (see fadg.policy.get_policy), with retries.
         """
-        self.conn_csw = CatalogueServiceWeb(endpoint, timeout=60)
+        policy = get_policy()
+        if pooled:
+            capabilities = csw.CAPABILITIES.get(endpoint)
+            self.conn_csw = policy.call("csw", csw.CSWConnection, endpoint,
+                                        capabilities=capabilities, timeout=policy.timeout)
+        else:
+            self.conn_csw = policy.call("csw", CatalogueServiceWeb, endpoint,
+                                        timeout=policy.timeout)
+
+    def _get_max_pagesize(self, max_pagesize=100):
+        """ Return the largest page size to request, i.e., the
+        configured max_pagesize limited by the MaxRecordDefault
+        constraint if the CSW service advertises it.
+        """
+        return SearchCSW._advertised_pagesize(self.conn_csw, max_pagesize=max_pagesize)
 
-    def _execute(self, filter_list, pagesize=10, max_records=1000,
-                 endpoint="https://data.csw.met.no"):
+    @staticmethod
+    def _advertised_pagesize(capabilities, max_pagesize=100):
+        """ Return max_pagesize limited by the MaxRecordDefault
+        constraint of the given CSW connection or capabilities, if
+        advertised.
+        """
+        constraints = getattr(capabilities, "constraints", None) or {}
+        advertised = constraints.get("MaxRecordDefault")
+        if advertised is not None and len(advertised.values) > 0:
+            try:
+                max_pagesize = min(max_pagesize, int(advertised.values[0]))
+            except (TypeError, ValueError):
+                logging.debug("Invalid MaxRecordDefault: %s" % advertised.values[0])
+        return max_pagesize
+
+    def _execute(self, filter_list, *args, endpoint_timeout=None, query_cache=None, **kwargs):
         """ Execute CSW search using the provided filter list, and
-        return a dictionary of all the resulting records. Limit the
-        number of retrieved records using the keyword max_records.
+        return a dictionary of all the resulting records. See
+        SearchCSW._iter_pages for the keywords, and
+        SearchCSW._execute_federated if endpoint is a list.
+
+        If a query cache (fadg.cache.QueryCache) is given, the records
+        of a search that has been executed before are returned without
+        requests, and the records of new searches are stored in it.
         """
+        if not isinstance(kwargs.get("endpoint", ""), str):
+            return self._execute_federated(filter_list, *args, endpoint_timeout=endpoint_timeout,
+                                           query_cache=query_cache, **kwargs)
         csw_records = {}
-        start_position = 0
+        for page in self._iter_cached_pages(filter_list, *args, query_cache=query_cache,
+                                            **kwargs):
+            csw_records.update(page)
 
-        # Connect to the CSW service
-        self._set_csw_connection(endpoint=endpoint)
-
-        next_record = 1
-        while next_record != 0:
-            # Iterate pages until the requested max_records is reached
-            self.conn_csw.getrecords2(
-                constraints=filter_list,
-                startposition=start_position,
-                maxrecords=pagesize,
-                outputschema="http://www.opengis.net/cat/csw/2.0.2",
-                esn="full")
-            csw_records.update(self.conn_csw.records)
-            next_record = self.conn_csw.results["nextrecord"]
-            start_position += pagesize + 1  # Last one is included.
-            if start_position >= max_records:
-                next_record = 0
+        return csw_records
+
+    def _iter_cached_pages(self, filter_list, *args, query_cache=None, **kwargs):
+        """ Yield the pages of SearchCSW._iter_pages. If a query cache
+        (fadg.cache.QueryCache) is given, the records of a search that
+        has been executed before are yielded in one page without
+        requests, and the records of new searches are stored in it
+        once all pages have been retrieved.
+        """
+        if query_cache is None:
+            yield from self._iter_pages(filter_list, *args, **kwargs)
+            return
+        params = inspect.signature(self._iter_pages).bind(filter_list, *args, **kwargs)
+        params.apply_defaults()
+        endpoint = params.arguments["endpoint"]
+        key = query_cache.key(endpoint, filter_list,
+                              outputschema=params.arguments["outputschema"],
+                              max_records=params.arguments["max_records"],
+                              elements=params.arguments["elements"])
+        csw_records = query_cache.get(key)
+        if csw_records is not None:
+            logging.debug("Using cached results of the search of %s" % endpoint)
+            self.request_count = 0
+            yield csw_records
+            return
+
+        csw_records = {}
+        for page in self._iter_pages(filter_list, *args, **kwargs):
+            csw_records.update(page)
+            yield page
+
+        query_cache.put(key, csw_records, endpoint=endpoint, filter_list=filter_list)
+
+    def _execute_many(self, filter_lists, *args, **kwargs):
+        """ Execute several CSW searches concurrently, each with its
+        own connection, and return a dictionary of the merged records.
+        self.request_count is the total number of requests. See
+        SearchCSW._iter_pages for the keywords.
+        """
+        def execute(filter_list):
+            search = copy.copy(self)
+            search.conn_csw = None
+            records = search._execute(filter_list, *args, **kwargs)
+            return records, getattr(search, "request_count", 0)
+
+        with ThreadPoolExecutor(max_workers=max(len(filter_lists), 1)) as executor:
+            results = list(executor.map(execute, filter_lists))
+
+        csw_records = {}
+        for records, count in results:
+            csw_records.update(records)
+        self.request_count = sum(count for records, count in results)
 
         return csw_records
 
-    def _temporal_filter(self, dt=24):
+    def _execute_federated(self, filter_list, *args, endpoint=None, endpoint_timeout=None,
+                           **kwargs):
+        """ Execute CSW search against several endpoints concurrently,
+        each with its own connection, and return a dictionary of the
+        merged records. Records are deduplicated by identifier and
+        OPeNDAP url, and the earlier endpoints take precedence.
+
+        Endpoints that fail, or do not respond within their timeout,
+        are left out, so that the result is partial rather than late.
+        The outcome per endpoint ("ok", "timeout" or the error) is
+        stored in self.endpoint_status, and self.request_count is the
+        total number of requests of the endpoints that responded. If
+        none responded, the error of the first endpoint is raised.
+
+        Input
+        =====
+        endpoint : list
+            CSW endpoints, in order of precedence
+        endpoint_timeout : float or dict (default None)
+            Seconds to wait for each endpoint, counted from the start
+            of the search, or a dict of seconds by endpoint. Endpoints
+            without timeout are waited for.
+        """
+        endpoints = list(endpoint)
+        if not isinstance(endpoint_timeout, dict):
+            endpoint_timeout = dict.fromkeys(endpoints, endpoint_timeout)
+
+        def execute(url):
+            search = copy.copy(self)
+            search.conn_csw = None
+            records = search._execute(filter_list, *args, endpoint=url, **kwargs)
+            return records, getattr(search, "request_count", 0)
+
+        start = time.monotonic()
+        executor = ThreadPoolExecutor(max_workers=max(len(endpoints), 1))
+        futures = [executor.submit(execute, url) for url in endpoints]
+        # Slow endpoints are not waited for
+        executor.shutdown(wait=False)
+
+        self.endpoint_status = {}
+        results = []
+        errors = []
+        for url, future in zip(endpoints, futures):
+            timeout = endpoint_timeout.get(url)
+            if timeout is not None:
+                timeout = max(timeout - (time.monotonic() - start), 0)
+            try:
+                results.append(future.result(timeout=timeout))
+            except FutureTimeoutError:
+                logging.debug("No response from %s within %s seconds"
+                              % (url, endpoint_timeout.get(url)))
+                self.endpoint_status[url] = "timeout"
+                errors.append(DeadlineExceeded("No response from %s within %s seconds"
+                                               % (url, endpoint_timeout.get(url))))
+            except Exception as ee:
+                logging.debug("Search of %s failed: %s" % (url, ee))
+                self.endpoint_status[url] = ee
+                errors.append(ee)
+            else:
+                self.endpoint_status[url] = "ok"
+        if len(results) == 0 and len(errors) > 0:
+            raise errors[0]
+
+        csw_records = {}
+        urls = set()
+        for records, count in results:
+            records = SearchCSW._drop_duplicates(records, csw_records, urls)
+            csw_records.update(records)
+            urls.update(SearchCSW.get_odap_url(record) for record in records.values())
+            urls.discard(None)
+        self.request_count = sum(count for records, count in results)
+
+        return csw_records
+
+    def _iter_pages(self, filter_list, pagesize=10, max_records=1000,
+                    endpoint="https://data.csw.met.no", outputschema=CSW_SCHEMA, workers=1,
+                    max_pagesize=100, pooled=False, catalogue=None, elements=None):
+        """ Execute CSW search using the provided filter list, and
+        yield a dictionary of the resulting records for each page.
+        Limit the number of retrieved records using the keyword
+        max_records. Use outputschema=SearchCSW.ISO_SCHEMA to retrieve
+        ISO 19139 records instead of Dublin Core records.
+
+        The first page has pagesize records, and the page size is
+        doubled for every following page up to max_pagesize, or the
+        MaxRecordDefault advertised by the service. If the service
+        returns fewer records than requested before the end of the
+        result set, the page size is reduced to what the service
+        returns. Paging stops when the service reports nextrecord 0,
+        when numberOfRecordsMatched is exhausted, or when max_records
+        is reached. The number of GetRecords requests is stored in
+        self.request_count.
+
+        With workers > 1, the first page is used to read the number
+        of matching records, and the remaining pages are fetched
+        concurrently (see SearchCSW._iter_pages_parallel).
+
+        With pooled=True, the requests are sent through the shared
+        keep-alive session, and the capabilities are cached (see
+        SearchCSW._set_csw_connection).
+
+        With elements, e.g., fadg.csw.SLIM_ELEMENTS, only the given
+        Dublin Core elements of the records are requested instead of
+        the full records (see SearchCSW._getrecords).
+
+        If a local catalogue (fadg.catalogue.Catalogue) is given, the
+        query is answered from the catalogue in a single page, without
+        requests to the CSW service. The CSW service is used if the
+        catalogue cannot answer the query.
+        """
+        if catalogue is not None:
+            records = catalogue.search(filter_list, max_records=max_records,
+                                       outputschema=outputschema, endpoint=endpoint)
+            if records is not None:
+                self.request_count = 0
+                yield records
+                return
+            logging.debug("Falling back to the CSW service %s" % endpoint)
+        if elements is not None and outputschema != csw.CSW_SCHEMA:
+            raise ValueError("Element names are only supported for Dublin Core records.")
+        if workers > 1:
+
+            yield from self._iter_pages_parallel(filter_list, pagesize=pagesize,
+                                                 max_records=max_records, endpoint=endpoint,
+                                                 outputschema=outputschema, workers=workers,
+                                                 pooled=pooled, elements=elements,
+                                                 max_pagesize=max_pagesize)
+            return
+        self.request_count = 0
+
+        # Connect to the CSW service
+        self._set_csw_connection(endpoint=endpoint, pooled=pooled)
+        filter_list = self._adapt_temporal_filter(
+            filter_list, getattr(self.conn_csw, "capabilities", self.conn_csw))
+
+        max_pagesize = max(self._get_max_pagesize(max_pagesize), 1)
+        pagesize = min(pagesize, max_pagesize)
+
+        # CSW startposition is 1-based
+        start_position = 1
+        retrieved = 0
+        while retrieved < max_records:
+            maxrecords = min(pagesize, max_records - retrieved)
+            SearchCSW._getrecords(self.conn_csw, filter_list, startposition=start_position,
+                                  maxrecords=maxrecords, outputschema=outputschema,
+                                  elements=elements)
+            self.request_count += 1
+            returned = len(self.conn_csw.records)
+            retrieved += returned
+            yield self.conn_csw.records
+
+            matches = self.conn_csw.results.get("matches")
+            next_record = self.conn_csw.results.get("nextrecord")
+            if returned == 0 or next_record == 0:
+                break
+            if matches is not None and start_position + returned > int(matches):
+                break
+            if returned < maxrecords:
+                # The service caps the page size
+                max_pagesize = pagesize = returned
+            else:
+                pagesize = min(2*pagesize, max_pagesize)
+            if next_record is None:
+                next_record = start_position + returned
+            if next_record <= start_position:
+                logging.debug("CSW paging does not advance (nextrecord=%s)" % next_record)
+                break
+            start_position = next_record
+
+    def _iter_pages_parallel(self, filter_list, pagesize=10, max_records=1000,
+                             endpoint="https://data.csw.met.no", outputschema=CSW_SCHEMA,
+                             workers=4, pooled=False, elements=None, max_pagesize=100):
+        """ Execute CSW search using the provided filter list, and
+        yield a dictionary of the resulting records for each page.
+
+        The first page is fetched with the main connection. The
+        remaining startposition windows, up to the smaller of
+        numberOfRecordsMatched and max_records, are then fetched
+        concurrently in a bounded thread pool, each with its own
+        connection. The pages are yielded in order. With pooled=True,
+        all connections share one keep-alive session.
+
+        The windows are no larger than the first page, since the
+        service may cap the page size below pagesize (or the
+        advertised MaxRecordDefault) without notice. Windows that are
+        not returned in full are completed with further requests.
+        """
+        # Connect to the CSW service
+        self._set_csw_connection(endpoint=endpoint, pooled=pooled)
+        filter_list = self._adapt_temporal_filter(
+            filter_list, getattr(self.conn_csw, "capabilities", self.conn_csw))
+        pagesize = min(pagesize, max(self._get_max_pagesize(max_pagesize), 1))
+
+        self.request_count = 1
+        SearchCSW._getrecords(self.conn_csw, filter_list, startposition=1,
+                              maxrecords=min(pagesize, max_records), outputschema=outputschema,
+                              elements=elements)
+        returned = len(self.conn_csw.records)
+        yield self.conn_csw.records
+
+        matches = min(int(self.conn_csw.results["matches"]), max_records)
+        if returned == 0:
+            return
+        pagesize = min(pagesize, returned)
+        starts = list(range(1 + returned, matches + 1, pagesize))
+        if len(starts) == 0:
+            return
+
+        policy = get_policy()
+
+        def get_page(start):
+            if pooled:
+                conn = csw.CSWConnection(endpoint, capabilities=self.conn_csw.capabilities,
+                                         timeout=policy.timeout)
+            else:
+                conn = CatalogueServiceWeb(endpoint, timeout=policy.timeout, skip_caps=True)
+            stop = min(start + pagesize, matches + 1)
+            records, count = {}, 0
+            while start < stop:
+                SearchCSW._getrecords(conn, filter_list, startposition=start,
+                                      maxrecords=stop - start, outputschema=outputschema,
+                                      elements=elements)
+                count += 1
+                records.update(conn.records)
+                if len(conn.records) == 0:
+                    logging.debug("CSW records %d to %d were not returned" % (start, stop - 1))
+                    break
+                start += len(conn.records)
+            return records, count
+
+        with ThreadPoolExecutor(max_workers=min(workers, len(starts))) as executor:
+            for records, count in executor.map(get_page, starts):
+                self.request_count += count
+                yield records
+
+    @staticmethod
+    def _getrecords(conn, filter_list, startposition=1, maxrecords=10, outputschema=CSW_SCHEMA,
+                    elements=None):
+        """ Send a GetRecords request with the given connection, within
+        the deadline of the shared call policy, and set conn.records
+        and conn.results.
+
+        With elements, the records only contain the given elements
+        (csw:ElementName). owslib connections then send the request
+        of fadg.csw.getrecords_xml, since owslib can only request
+        element sets.
+        """
+        kwargs = {}
+        if elements is not None and isinstance(conn, csw.CSWConnection):
+            kwargs["elements"] = elements
+        elif elements is not None:
+            kwargs["xml"] = csw.getrecords_xml(filter_list, startposition=startposition,
+                                               maxrecords=maxrecords, outputschema=outputschema,
+                                               elements=elements)
+        get_policy().call("csw", conn.getrecords2, constraints=filter_list,
+                          startposition=startposition, maxrecords=maxrecords,
+                          outputschema=outputschema, esn="full", **kwargs)
+
+    @staticmethod
+    def _adapt_temporal_filter(filter_list, capabilities):
+        """ Return the filter list for the CSW service with the given
+        capabilities. If the service does not advertise
+        apiso:TempExtent_end as a queryable, or the capabilities are
+        unknown, comparisons on TempExtent_end are made on
+        TempExtent_begin instead, i.e., the overlap filter falls back
+        to searching the record begin dates (see
+        SearchCSW._temporal_filter).
+        """
+        queryables = csw.get_queryables(capabilities)
+        if queryables is not None and "apiso:TempExtent_end" in queryables:
+            return filter_list
+        logging.debug("apiso:TempExtent_end is not a known queryable, searching "
+                      "apiso:TempExtent_begin instead")
+        return [SearchCSW._replace_property(operation, "apiso:TempExtent_end",
+                                            "apiso:TempExtent_begin")
+                for operation in filter_list]
+
+    @staticmethod
+    def _replace_property(operation, old, new):
+        """ Return a copy of the fes filter operation, where
+        comparisons on the property old are made on the property new.
+        """
+        if isinstance(operation, fes.BinaryComparisonOpType) and operation.propertyname == old:
+            operation = copy.copy(operation)
+            operation.propertyname = new
+        elif hasattr(operation, "operations"):
+            operation = copy.copy(operation)
+            operation.operations = [SearchCSW._replace_property(op, old, new)
+                                    for op in operation.operations]
+        return operation
+
+    def _temporal_filter(self, dt=24, overlap=False, window=None):
         """ Take datetime-like objects and return a fes filter for
         date range.
 
-        NOTE: the "begin" search seems to be performed on the date of
-        each record (the dataset publication_date), not the actual
-        time_coverage_start or time_coverage_end. This appear to be a
-        bug in pycsw. The "end" search seems to correctly represent
-        time_coverage_end. Also, it seems that the "OrEqual"
-        requirement doesn not come into effect. We need to search +/-
-        1 day in order to get anything. The time delta can be
-        increased through the keyword dt but should not be less than
-        24 hours.
-
-        TODO: check and fix issues with temporal search!
+        With overlap=True, the filter selects the records whose
+        temporal extent overlaps self.time +/- dt hours, i.e.,
+        TempExtent_begin <= stop and TempExtent_end >= start, with
+        times in UTC to the second. Searches fall back to the begin
+        date filter below if the CSW service does not support
+        TempExtent_end (see SearchCSW._adapt_temporal_filter).
+
+        NOTE: in the begin date filter, the "begin" search seems to be
+        performed on the date of each record (the dataset
+        publication_date), not the actual time_coverage_start or
+        time_coverage_end. This appear to be a bug in pycsw. The "end"
+        search seems to correctly represent time_coverage_end. Also,
+        it seems that the "OrEqual" requirement doesn not come into
+        effect. We need to search +/- 1 day in order to get anything.
+        The time delta can be increased through the keyword dt but
+        should not be less than 24 hours.
 
         Input
         =====
-        dt : int
+        dt : float
             Search interval in hours (+/-)
+        overlap : bool (default False)
+            Return the overlap filter
+        window : tuple (default None)
+            Start and stop (datetime.datetime) of the overlap filter
+            used instead of self.time +/- dt hours
         """
+        if overlap:
+            if window is None:
+                window = (self.time - datetime.timedelta(hours=dt),
+                          self.time + datetime.timedelta(hours=dt))
+            start, stop = [(time if time.tzinfo is None else time.astimezone(timezone("utc")))
+                           .strftime("%Y-%m-%dT%H:%M:%SZ") for time in window]
+            begin = fes.PropertyIsLessThanOrEqualTo(propertyname="apiso:TempExtent_begin",
+                                                    literal=stop)
+            end = fes.PropertyIsGreaterThanOrEqualTo(propertyname="apiso:TempExtent_end",
+                                                     literal=start)
+            return begin, end
+
         start = (self.time - datetime.timedelta(hours=dt)).strftime("%Y-%m-%d %H:%M:%S")
         stop = (self.time + datetime.timedelta(hours=dt)).strftime("%Y-%m-%d %H:%M:%S")
 
@@ -197,45 +836,186 @@ class Collocate(SearchCSW):
     =====
     url : string
         Dataset OPeNDAP url or filename.
+    cache : fadg.cache.MetadataCache (default None)
+        Optional persistent cache of dataset metadata. If given, the
+        metadata of the input dataset and of the candidate datasets
+        is read from the cache whenever possible.
+    reader : string (default netcdf)
+        How dataset metadata is read. With "netcdf" the datasets are
+        opened with netCDF4. With "das" only the OPeNDAP DAS response
+        is fetched, and availability is checked with an HTTP HEAD
+        request. The netCDF4 open is used as fallback if the DAS
+        response cannot be used, e.g., for local files.
+    time : datetime.datetime (default None)
+        Central time of the collocation. If given together with bbox,
+        the dataset is not opened.
+    bbox : list (default None)
+        Search area [lon_min, lat_min, lon_max, lat_max]. If given,
+        the footprint of the dataset is not used.
+    metadata : dict (default None)
+        Metadata of the input dataset (see Collocate.probe). If given,
+        the dataset is not opened.
+
+    The metadata is read on first access to time, bbox, polygon or
+    bboxes, and the dataset is closed right after.
     """
 
-    def __init__(self, url, time=None, bbox=None):
+    GEOSPATIAL_FIELDS = ["geospatial_lon_min", "geospatial_lat_min",
+                         "geospatial_lon_max", "geospatial_lat_max"]
+    READERS = ["netcdf", "das"]
 
-        self.url = url
+    def __init__(self, url, time=None, bbox=None, cache=None, reader="netcdf", metadata=None):
 
-        self.time = None
-        self.polygon = None
+        Collocate._check_reader(reader)
+        self.url = url
+        self.cache = cache
+        self.reader = reader
         self.conn_csw = None
 
-        try:
-            ds = netCDF4.Dataset(self.url)
-        except OSError:
-            ds = netCDF4.Dataset(self.url + "#fillmismatch")
-        # Read time of dataset
-        try:
-            date_string = ds.time_coverage_start
-        except AttributeError:
-            # Special exception for Sentinel 1 data..
-            date_string = ds.ACQUISITION_START_TIME
+        self._metadata = metadata
+        self._time = None if time is None else time.replace(tzinfo=time.tzinfo or timezone("utc"))
+        self._bbox = None if bbox is None else [float(value) for value in bbox]
+        self._polygon = None
+        self._bboxes = None
 
-        # Set central time of collocation
-        time = parse(date_string)
-        self.time = time.replace(tzinfo=time.tzinfo or timezone("utc"))
+    @property
+    def time(self):
+        """ Central time of the collocation, i.e., the
+        time_coverage_start of the dataset unless given.
+        """
+        if self._time is None:
+            self._load()
+        return self._time
+
+    @time.setter
+    def time(self, time):
+        self._time = time
+
+    @property
+    def bbox(self):
+        """ Bounding box of the dataset unless given.
+        """
+        if self._bbox is None:
+            self._load()
+        return self._bbox
 
-        # Set bounding box
-        self.bbox = [float(ds.geospatial_lon_min), float(ds.geospatial_lat_min),
-                     float(ds.geospatial_lon_max), float(ds.geospatial_lat_max)]
+    @bbox.setter
+    def bbox(self, bbox):
+        self._bbox = bbox
+
+    @property
+    def polygon(self):
+        """ Footprint of the dataset (ACDD geospatial_bounds), or None.
+        """
+        if self._bbox is None:
+            self._load()
+        return self._polygon
+
+    @polygon.setter
+    def polygon(self, polygon):
+        self._polygon = polygon
+
+    @property
+    def bboxes(self):
+        """ Bounding boxes of the search area, see
+        SearchCSW._set_bboxes.
+        """
+        if self._bboxes is None:
+            self._set_bboxes()
+        return self._bboxes
+
+    @bboxes.setter
+    def bboxes(self, bboxes):
+        self._bboxes = bboxes
+
+    def _load(self):
+        """ Read the metadata of the dataset, and set the time, bbox
+        and polygon that were not given.
+        """
+        metadata = self._get_metadata()
+        if metadata["time_coverage_start"] is None:
+            raise AttributeError("Could not read the time coverage of %s" % self.url)
+        self._set_metadata(metadata)
+
+    def _set_metadata(self, metadata):
+        """ Set the time, bbox and polygon that were not given from
+        the given metadata dict.
+        """
+        if self._time is None:
+            # Set central time of collocation
+            time = metadata["time_coverage_start"]
+            self._time = time.replace(tzinfo=time.tzinfo or timezone("utc"))
+        if self._bbox is None:
+            # Set bounding box and polygon footprint
+            self._bbox = [float(metadata[field]) for field in Collocate.GEOSPATIAL_FIELDS]
+            self._polygon = Collocate._read_footprint(metadata)
+
+    def _get_metadata(self):
+        """ Return the metadata dict of the dataset, from the given
+        metadata, the cache, the DAS response or the dataset itself,
+        which is closed after reading.
+        """
+        metadata = self._metadata
+        if metadata is None and self.cache is not None:
+            metadata = self.cache.get(self.url)
+        if metadata is None or not metadata["available"]:
+            metadata = None
+            if self.reader == "das":
+                metadata = Collocate._read_das_metadata(self.url)
+            if metadata is None or not metadata["available"]:
+                try:
+                    ds = Collocate._open_dataset(self.url)
+                except DeadlineExceeded:
+                    raise
+                except OSError:
+                    ds = Collocate._open_dataset(self.url + "#fillmismatch")
+                try:
+                    metadata = Collocate._read_metadata(ds, self.url)
+                finally:
+                    ds.close()
+            if self.cache is not None:
+                self.cache.put(metadata)
+        self._metadata = metadata
+        return metadata
+
+    @staticmethod
+    def _read_footprint(metadata):
+        """ Return the fadg.geometry.Footprint of the ACDD
+        geospatial_bounds of the given metadata dict, or None. WKT in
+        lat/lon order is detected by comparison with the geospatial
+        bounding box.
+        """
+        wkt = metadata.get("geospatial_bounds")
+        if not wkt:
+            return None
+        try:
+            footprint = Footprint.from_wkt(wkt)
+        except ValueError as ee:
+            logging.debug("Could not read geospatial_bounds of %s: %s" % (metadata["url"], ee))
+            return None
+        bbox = [metadata.get(field) for field in Collocate.GEOSPATIAL_FIELDS]
+        if None not in bbox:
+            def mismatch(footprint):
+                return max(abs(aa - bb) for aa, bb in zip(footprint.bbox, bbox))
+            swapped = footprint.swapped()
+            if mismatch(swapped) < mismatch(footprint):
+                footprint = swapped
+        return footprint
 
     def get_collocations(self, constraints=None, dt=24, endpoint="https://data.csw.met.no",
-                         crs="urn:ogc:def:crs:OGC:1.3:CRS84"):
+                         crs="urn:ogc:def:crs:OGC:1.3:CRS84", split_queries=False, snap=None,
+                         grid=5., **kwargs):
         """ Uses SAR time, plus other provided constraints (optional)
         to find collocated dataset(s).
 
-        Note: owslib seems to be limited to bbox search based on
-        squares in lat/lon... Spatial search should be based on border
-        polygon, and is therefore omitted but should be added.
-
-        TODO: ADD SPATIAL SEARCH
+        If the dataset has a polygon footprint (ACDD
+        geospatial_bounds), an OGC Intersects filter is sent instead
+        of the bounding box, and the records are filtered locally by
+        the footprint. Search areas that cross the antimeridian are
+        split into several bounding boxes (see self.bboxes), which are
+        combined with Or. The number of records returned by the CSW
+        search, before they are filtered locally, is stored in
+        self.record_count.
 
         Input
         =====
@@ -243,50 +1023,626 @@ class Collocate(SearchCSW):
             List of CSW search objects defining other constraints.
         dt : int
             Search interval in hours (+/-)
+        endpoint : string or list (default https://data.csw.met.no)
+            CSW endpoint, or a list of endpoints to search
+            concurrently (see SearchCSW._execute_federated)
+        split_queries : bool (default False)
+            Send one query per bounding box concurrently, and merge
+            the results, instead of combining the boxes with Or.
+        snap : float or datetime.timedelta (default None)
+            Widen the search window to whole multiples of snap hours
+            (since 1970-01-01 UTC), e.g., 24 for whole days, and
+            select the records of the exact window locally (see
+            Collocate._select_collocations). Searches of nearby times
+            then send the same query, which can be answered by a
+            fadg.cache.QueryCache given as query_cache.
+        grid : float (default 5)
+            With snap, the search area is also widened to bounding
+            boxes on a grid of the given size in degrees (see
+            Collocate._snap_bboxes), so that nearby areas send the
+            same query. None keeps the exact search area.
+        kwargs
+            Passed on to SearchCSW._execute, e.g., outputschema.
+        """
+        window = None if snap is None else self._snap_window(dt=dt, snap=snap)
+        bboxes = None if snap is None or grid is None else self._snap_bboxes(grid=grid)
+        if split_queries and self.polygon is None and len(self.bboxes) > 1:
+            filter_lists = [self._get_collocation_filter(constraints, dt=dt, crs=crs,
+                                                         bboxes=[bbox], window=window)
+                            for bbox in bboxes or self.bboxes]
+            records = self._execute_many(filter_lists, endpoint=endpoint, **kwargs)
+            self.record_count = len(records)
+            return records if snap is None else self._select_collocations(records, dt=dt)
+
+        filter_list = self._get_collocation_filter(constraints, dt=dt, crs=crs, bboxes=bboxes,
+                                                   window=window)
+
+        # Search and return dict
+        records = self._execute(filter_list, endpoint=endpoint, **kwargs)
+        self.record_count = len(records)
+        if snap is not None:
+            return self._select_collocations(records, dt=dt)
+        return self._filter_footprint(records)
+
+    def _snap_window(self, dt=24, snap=24):
+        """ Return the start and stop of self.time +/- dt hours,
+        widened to whole multiples of snap hours since 1970-01-01 UTC.
+        """
+        if not isinstance(snap, datetime.timedelta):
+            snap = datetime.timedelta(hours=snap)
+        if snap <= datetime.timedelta(0):
+            raise ValueError("snap must be positive.")
+        epoch = datetime.datetime(1970, 1, 1)
+        if self.time.tzinfo is not None:
+            epoch = timezone("utc").localize(epoch)
+        start = self.time - datetime.timedelta(hours=dt)
+        stop = self.time + datetime.timedelta(hours=dt)
+        return (epoch + ((start - epoch) // snap)*snap,
+                epoch - ((epoch - stop) // snap)*snap)
+
+    def _snap_bboxes(self, grid=5.):
+        """ Return self.bboxes widened to whole multiples of grid
+        degrees, within [-180, -90, 180, 90]. Overlapping boxes are
+        not merged.
         """
-        if constraints is None:
-            constraints = []
+        if grid <= 0:
+            raise ValueError("grid must be positive.")
+        bboxes = []
+        for bbox in self.bboxes:
+            bbox = [np.floor(bbox[0]/grid)*grid, np.floor(bbox[1]/grid)*grid,
+                    np.ceil(bbox[2]/grid)*grid, np.ceil(bbox[3]/grid)*grid]
+            bboxes.append([float(max(bbox[0], -180.)), float(max(bbox[1], -90.)),
+                           float(min(bbox[2], 180.)), float(min(bbox[3], 90.))])
+        return bboxes
+
+    def _get_collocation_filter(self, constraints=None, dt=24,
+                                crs="urn:ogc:def:crs:OGC:1.3:CRS84", bboxes=None, window=None):
+        """ Return the CSW filter list used by get_collocations, with
+        the given bounding boxes instead of the search area, and the
+        given time window instead of self.time +/- dt hours, if given.
+        """
+        # Copy, so that the same constraints can be reused
+        constraints = [] if constraints is None else list(constraints)
 
         # Create temporal search objects
-        temporal_search_start, temporal_search_end = self._temporal_filter(dt=dt)
+        temporal_search_start, temporal_search_end = self._temporal_filter(dt=dt, overlap=True,
+                                                                           window=window)
 
         # Add temporal search objects to the list of constraints
         constraints.append(temporal_search_start)
         constraints.append(temporal_search_end)
 
         # Location search
-        bbox_search = fes.BBox(self.bbox, crs=crs)
-        constraints.append(bbox_search)
+        constraints.append(self._spatial_filter(crs=crs, bboxes=bboxes))
 
-        # Search and return dict
-        return self._execute([fes.And(constraints)], endpoint=endpoint)
+        return [fes.And(constraints)]
 
     @staticmethod
-    def get_time_coverage(odap):
+    def get_time_coverage(odap, cache=None, reader="netcdf"):
         """ Return time_coverage_start and time_coverage_end of the
         given record converted to datetime.datetime objects.
 
-        Note: the record does not contain proper times (except the
-        date), so we need to read it from OPeNDAP - or don't we?
+        Note: the record does not always contain proper times (except
+        the date), so we need to read it from OPeNDAP. See
+        SearchCSW.get_record_time_coverage for reading the times from
+        the record when they are precise enough.
+
+        If a fadg.cache.MetadataCache is given, the times are read
+        from the cache if the dataset has been probed before, and the
+        metadata of other datasets is added to the cache. With
+        reader="das", the times are read from the DAS response (see
+        Collocate.probe).
         """
-        ds = netCDF4.Dataset(odap)
-        start = parse(ds.time_coverage_start)
-        end = parse(ds.time_coverage_end)
-        ds.close()
+        if cache is not None:
+            metadata = cache.get(odap)
+            if metadata is not None and metadata["time_coverage_end"] is not None:
+                return metadata["time_coverage_start"], metadata["time_coverage_end"]
+        if reader == "das":
+            metadata = Collocate.probe(odap, reader=reader)
+            if metadata["available"] is None:
+                raise DeadlineExceeded("The archive file %s did not respond in time." % odap)
+            if not metadata["available"]:
+                raise OSError("The archive file %s is not available." % odap)
+        else:
+            ds = Collocate._open_dataset(odap)
+            try:
+                metadata = Collocate._read_metadata(ds, odap)
+            finally:
+                ds.close()
+        if cache is not None:
+            cache.put(metadata)
 
-        return start, end
+        return metadata["time_coverage_start"], metadata["time_coverage_end"]
 
     @staticmethod
-    def assert_available(url):
-        """ Assert that the dataset is available.
+    def assert_available(url, reader="netcdf"):
+        """ Assert that the dataset is available. With reader="das",
+        availability is checked with an HTTP HEAD request for the DAS
+        response, falling back to netCDF4 if the request fails.
+
+        The result is stored in the shared availability cache (see
+        fadg.cache.get_availability_cache), and datasets known to be
+        available or unavailable are not checked again until the
+        entry expires.
         """
+        Collocate._check_reader(reader)
+        availability = get_availability_cache()
+        known = None if availability is None else availability.get(url)
+        if known is False:
+            raise ValueError("The archive file %s is not available. Try another dataset." % url)
+        if known:
+            return None
+        try:
+            Collocate._assert_available(url, reader=reader)
+        except ValueError as ee:
+            if availability is not None:
+                availability.put(url, False, error=ee)
+            raise
+        if availability is not None:
+            availability.put(url, True)
+        return None
+
+    @staticmethod
+    def _assert_available(url, reader="netcdf"):
+        """ Assert that the dataset is available, without the
+        availability cache. See Collocate.assert_available.
+        """
+        if reader == "das" and Collocate._is_remote(url):
+            try:
+                available = get_policy().call_url(
+                    "dap", partial(dap.is_available, session=get_session()), url)
+            except requests.RequestException as ee:
+                logging.debug("Could not check %s with HEAD, falling back to netCDF4: %s"
+                              % (url, ee))
+            else:
+                if not available:
+                    raise ValueError("The archive file %s is not available. "
+                                     "Try another dataset." % url)
+                return None
         try:
-            netCDF4.Dataset(url)
+            ds = Collocate._open_dataset(url)
+        except DeadlineExceeded:
+            raise
         except OSError:
             raise ValueError("The archive file %s is not available. Try another dataset." % url)
+        ds.close()
         return None
 
-    def _get_nearest_by_time(self, records, index, rel=0):
+    @staticmethod
+    def _open_dataset(url):
+        """ Return netCDF4.Dataset(url), opened within the deadline of
+        the shared call policy (see fadg.policy.get_policy), one open
+        at a time (see CallPolicy.call_serial).
+        """
+        return get_policy().call_serial("netcdf", lambda url: netCDF4.Dataset(url), url)
+
+    @staticmethod
+    def _check_reader(reader):
+        """ Raise ValueError if reader is not supported.
+        """
+        if reader not in Collocate.READERS:
+            raise ValueError("reader must be one of %s" % ", ".join(Collocate.READERS))
+
+    @staticmethod
+    def _is_remote(url):
+        """ Return True if url is an http(s) url.
+        """
+        return url.startswith("http://") or url.startswith("https://")
+
+    @staticmethod
+    def _read_das_metadata(url):
+        """ Return a metadata dict read from the DAS response of the
+        given url. Return None if the DAS response cannot be used, so
+        that the caller can fall back to netCDF4.
+        """
+        if not Collocate._is_remote(url):
+            return None
+        try:
+            attributes = get_policy().call_url(
+                "dap", partial(dap.fetch_global_attributes, session=get_session()), url)
+        except FileNotFoundError:
+            logging.debug("The archive file %s is not available. Try another dataset." % url)
+            return Collocate._unavailable_metadata(url)
+        except (requests.RequestException, ValueError) as ee:
+            logging.debug("Could not read DAS of %s, falling back to netCDF4: %s" % (url, ee))
+            return None
+        return Collocate._read_metadata(SimpleNamespace(**attributes), url)
+
+    @staticmethod
+    def _read_metadata(ds, url):
+        """ Return a metadata dict with the ACDD time coverage and
+        geospatial bounds of the open dataset ds. Missing attributes
+        are set to None.
+        """
+        metadata = {"url": url, "available": True}
+        start = getattr(ds, "time_coverage_start", None)
+        if start is None:
+            # Special exception for Sentinel 1 data..
+            start = getattr(ds, "ACQUISITION_START_TIME", None)
+        end = getattr(ds, "time_coverage_end", None)
+        metadata["time_coverage_start"] = None if start is None else parse(start)
+        metadata["time_coverage_end"] = None if end is None else parse(end)
+        for field in Collocate.GEOSPATIAL_FIELDS:
+            value = getattr(ds, field, None)
+            metadata[field] = None if value is None else float(value)
+        bounds = getattr(ds, "geospatial_bounds", None)
+        metadata["geospatial_bounds"] = None if bounds is None else str(bounds)
+
+        return metadata
+
+    @staticmethod
+    def _unavailable_metadata(url, available=False):
+        """ Return a metadata dict for a dataset that is not
+        available, or whose availability is unknown (available=None).
+        """
+        metadata = {
+            "url": url,
+            "available": available,
+            "time_coverage_start": None,
+            "time_coverage_end": None,
+        }
+        for field in Collocate.GEOSPATIAL_FIELDS:
+            metadata[field] = None
+        metadata["geospatial_bounds"] = None
+        return metadata
+
+    @staticmethod
+    def probe(url, reader="netcdf"):
+        """ Open the dataset once and return a dict with its
+        availability, time coverage and geospatial bounds. The dataset
+        is considered unavailable if it cannot be opened, or if it is
+        known to be unavailable from the shared availability cache
+        (see fadg.cache.get_availability_cache). If the dataset does
+        not respond within the deadline of the call policy, the
+        availability is unknown (None), and is not cached.
+
+        Input
+        =====
+        url : string
+            Dataset OPeNDAP url or filename.
+        reader : string (default netcdf)
+            With "das", only the DAS response is fetched. The dataset
+            is opened with netCDF4 if the DAS response cannot be used.
+        """
+        Collocate._check_reader(reader)
+        availability = get_availability_cache()
+        if availability is not None and availability.get(url) is False:
+            logging.debug("The archive file %s is known to be unavailable." % url)
+            return Collocate._unavailable_metadata(url)
+        metadata = Collocate._probe(url, reader=reader)
+        if availability is not None and metadata["available"] is not None:
+            availability.put(url, metadata["available"])
+
+        return metadata
+
+    @staticmethod
+    def _probe(url, reader="netcdf"):
+        """ Return the metadata dict of the dataset, without the
+        availability cache. See Collocate.probe.
+        """
+        if reader == "das":
+            metadata = Collocate._probe_das(url)
+            if metadata is not None:
+                return metadata
+        try:
+            ds = Collocate._open_dataset(url)
+        except DeadlineExceeded as ee:
+            logging.debug("The archive file %s did not respond: %s" % (url, ee))
+            return Collocate._unavailable_metadata(url, available=None)
+        except OSError:
+            logging.debug("The archive file %s is not available. Try another dataset." % url)
+            return Collocate._unavailable_metadata(url)
+        try:
+            metadata = Collocate._read_metadata(ds, url)
+        finally:
+            ds.close()
+
+        return metadata
+
+    @staticmethod
+    def _probe_das(url):
+        """ Return the metadata dict of the dataset read from its DAS
+        response, or None if the DAS response cannot be used and the
+        dataset must be opened with netCDF4. No netCDF4 opens are made.
+        """
+        try:
+            return Collocate._read_das_metadata(url)
+        except DeadlineExceeded as ee:
+            logging.debug("The archive file %s did not respond: %s" % (url, ee))
+            return Collocate._unavailable_metadata(url, available=None)
+
+    @staticmethod
+    def probe_many(urls, workers=None, processes=False, cache=None, reader="netcdf"):
+        """ Probe the given datasets concurrently, and return a list
+        of metadata dicts (see Collocate.probe) in the same order as
+        the input urls. Datasets found in the cache, or known to be
+        unavailable from the shared availability cache, are not
+        probed, and new results are added to both caches.
+
+        Note: the netCDF-C library is not guaranteed to be thread
+        safe. Unless processes=True, the datasets are therefore opened
+        with netCDF4 one at a time in the calling thread, and only the
+        DAS requests of reader="das" are made in a thread pool.
+
+        Input
+        =====
+        urls : list
+            Dataset OPeNDAP urls or filenames.
+        workers : int (default 8 with reader="das" or processes, else 1)
+            Maximum number of concurrent probes. With workers=1, the
+            datasets are probed sequentially in the calling thread.
+        processes : bool (default False)
+            Use a process pool instead of a thread pool.
+        cache : fadg.cache.MetadataCache (default None)
+            Optional persistent cache of dataset metadata.
+        reader : string (default netcdf)
+            See Collocate.probe
+        """
+        if workers is None:
+            workers = 8 if reader == "das" or processes else 1
+        if workers < 1:
+            raise ValueError("workers must be a positive integer")
+        urls = list(urls)
+        probes = [None]*len(urls)
+        if cache is not None:
+            probes = [cache.get(url) for url in urls]
+        # Datasets known to be unavailable are not probed again
+        availability = get_availability_cache()
+        if availability is not None:
+            for ii, metadata in enumerate(probes):
+                if metadata is None and availability.get(urls[ii]) is False:
+                    probes[ii] = Collocate._unavailable_metadata(urls[ii])
+        missing = [ii for ii, metadata in enumerate(probes) if metadata is None]
+        missing_urls = [urls[ii] for ii in missing]
+
+        probe = partial(Collocate._probe, reader=reader)
+        max_workers = min(workers, len(missing_urls))
+        if max_workers > 1 and processes:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(probe, missing_urls))
+        elif max_workers > 1 and reader == "das":
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(Collocate._probe_das, missing_urls))
+            # Fall back to netCDF4 one at a time in the calling thread
+            results = [Collocate._probe(url) if metadata is None else metadata
+                       for url, metadata in zip(missing_urls, results)]
+        else:
+            results = [probe(url) for url in missing_urls]
+
+        for ii, metadata in zip(missing, results):
+            probes[ii] = metadata
+            if metadata["available"] is None:
+                # Timed out, so that the availability is unknown
+                continue
+            if cache is not None:
+                cache.put(metadata)
+            if availability is not None:
+                availability.put(urls[ii], metadata["available"])
+
+        return probes
+
+    @classmethod
+    def batch(cls, urls, product=None, dt=24, max_window=None, area_factor=2., workers=None,
+              processes=False, cache=None, reader="netcdf", **kwargs):
+        """ Find collocated datasets for many input datasets with few
+        CSW queries.
+
+        The metadata of the input datasets is read concurrently (see
+        Collocate.probe_many). The search windows of the inputs, i.e.,
+        time +/- dt and bbox, are taken in time order, and each is
+        merged into the first window it overlaps in time, if the
+        merged window is at most max_window hours long, and the
+        bounding boxes intersect or their union is not much larger
+        than the boxes themselves. One CSW query is
+        made per merged window, and the resulting records are assigned
+        back to each input by their temporal extent and bounding box.
+        Records that lack this information are assigned to all inputs
+        of the window. If a merged query reaches max_records, its
+        results may be incomplete, and the inputs of the window are
+        searched one by one instead.
+
+        Input datasets that are not available, or lack time coverage
+        or geospatial bounds, are skipped.
+
+        Input
+        =====
+        urls : list
+            Input dataset OPeNDAP urls or filenames.
+        product : Collocate subclass (default cls)
+            Type of the collocated datasets, e.g., Meps.
+        dt : float (default 24)
+            Search interval in hours (+/-) of each input
+        max_window : float (default 4*dt)
+            Maximum length in hours of a merged search window
+        area_factor : float (default 2)
+            Bounding boxes that do not intersect are merged if the
+            area of their union is at most area_factor times the sum
+            of their areas.
+        workers : int (default None)
+            Maximum number of concurrent probes (see
+            Collocate.probe_many) and CSW queries (default 8).
+        processes : bool (default False)
+            Probe the inputs in a process pool instead of a thread
+            pool.
+        cache : fadg.cache.MetadataCache (default None)
+            Optional persistent cache of dataset metadata.
+        reader : string (default netcdf)
+            See Collocate.probe
+        kwargs
+            Passed on to product.get_collocations, e.g., subset or
+            endpoint.
+
+        Returns
+        =======
+        A dict keyed by the input urls, with tuples of the product
+        instance of the input and its dict of collocated records.
+        """
+        if product is None:
+            product = cls
+        if max_window is None:
+            max_window = 4*dt
+        urls = list(urls)
+        probes = Collocate.probe_many(urls, workers=workers, processes=processes, cache=cache,
+                                      reader=reader)
+
+        colls = []
+        for url, metadata in zip(urls, probes):
+            if not metadata["available"] or metadata["time_coverage_start"] is None or \
+                    any(metadata[field] is None for field in Collocate.GEOSPATIAL_FIELDS):
+                logging.debug("Skipping %s: could not read its time coverage and bounds" % url)
+                continue
+            colls.append(product(url, cache=cache, reader=reader, metadata=metadata))
+        if len(colls) == 0:
+            return {}
+
+        groups = Collocate._merge_windows(colls, dt=dt, max_window=max_window,
+                                          area_factor=area_factor)
+        logging.debug("Collocating %d datasets with %d CSW queries" % (len(colls), len(groups)))
+
+        max_records = kwargs.get("max_records", 1000)
+
+        def search(group):
+            if len(group) == 1:
+                return [colls[group[0]].get_collocations(dt=dt, **kwargs)]
+            start = colls[group[0]].time - datetime.timedelta(hours=dt)
+            stop = colls[group[-1]].time + datetime.timedelta(hours=dt)
+            bbox = colls[group[0]].bboxes[0]
+            for ii in group[1:]:
+                bbox = Collocate._union_bbox(bbox, colls[ii].bboxes[0])
+            metadata = {"url": colls[group[0]].url, "available": True,
+                        "time_coverage_start": start + (stop - start)/2,
+                        "time_coverage_end": None}
+            metadata.update(zip(Collocate.GEOSPATIAL_FIELDS, bbox))
+            query = product(colls[group[0]].url, cache=cache, reader=reader, metadata=metadata)
+            records = query.get_collocations(dt=(stop - start).total_seconds()/7200., **kwargs)
+            # Records may have been filtered locally, e.g., by the footprint
+            if query.record_count < max_records:
+                return [records]*len(group)
+            logging.debug("The merged query of %d datasets reached max_records=%d, searching "
+                          "them one by one" % (len(group), max_records))
+            return [colls[ii].get_collocations(dt=dt, **kwargs) for ii in group]
+
+        if len(groups) == 1:
+            results = [search(groups[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=min(workers or 8, len(groups))) as executor:
+                results = list(executor.map(search, groups))
+
+        collocations = {}
+        for group, group_records in zip(groups, results):
+            for ii, records in zip(group, group_records):
+                coll = colls[ii]
+                collocations[coll.url] = (coll, coll._select_collocations(records, dt=dt))
+
+        return collocations
+
+    @staticmethod
+    def _merge_windows(colls, dt=24, max_window=96, area_factor=2.):
+        """ Group the search windows of the given Collocate objects,
+        see Collocate.batch. Return a list of groups, each a list of
+        indices into colls sorted by time.
+        """
+        order = sorted(range(len(colls)), key=lambda ii: colls[ii].time)
+        groups = []
+        bboxes = []
+        for ii in order:
+            coll = colls[ii]
+            area = coll.bboxes[0]
+            for group, bbox in zip(groups, bboxes):
+                # Search areas that are split are not merged
+                if bbox is None or len(coll.bboxes) > 1:
+                    continue
+                gap = (coll.time - colls[group[-1]].time).total_seconds()/3600.
+                span = (coll.time - colls[group[0]].time).total_seconds()/3600. + 2*dt
+                if gap > 2*dt or span > max_window:
+                    continue
+                union = Collocate._union_bbox(bbox, area)
+                if Collocate._bbox_intersects(bbox, area) or \
+                        Collocate._bbox_area(union) <= area_factor*(
+                            Collocate._bbox_area(bbox) + Collocate._bbox_area(area)):
+                    group.append(ii)
+                    bbox[:] = union
+                    break
+            else:
+                groups.append([ii])
+                bboxes.append(list(area) if len(coll.bboxes) == 1 else None)
+
+        return groups
+
+    def _select_collocations(self, records, dt=24, window=None):
+        """ Return the records whose temporal extent overlaps
+        self.time +/- dt hours, or the given window, and whose bounding
+        box intersects self.bboxes, or self.polygon if given, i.e., the
+        local equivalent of the filter used by
+        Collocate.get_collocations. Extents given with date precision
+        are matched by date, and extents without end by their start.
+        Records without temporal extent or bounding box are kept.
+
+        Input
+        =====
+        window : tuple (default None)
+            Start and stop (datetime.datetime) used instead of
+            self.time +/- dt hours
+        """
+        if window is None:
+            window = (self.time - datetime.timedelta(hours=dt),
+                      self.time + datetime.timedelta(hours=dt))
+        start, stop = window
+        selected = {}
+        for key, record in records.items():
+            begin, end = Collocate._get_record_extent(record)
+            first = Collocate._parse_extent_bound(begin)
+            last = Collocate._parse_extent_bound(end, end=True)
+            if end is None and first is not None:
+                last = Collocate._parse_extent_bound(begin, end=True)
+            if first is not None and first > stop or last is not None and last < start:
+                continue
+            bbox = Collocate.get_record_bbox(record)
+            if bbox is not None and not any(Collocate._bbox_intersects(bbox, area)
+                                            for area in self.bboxes):
+                continue
+            selected[key] = record
+
+        return self._filter_footprint(selected)
+
+    @staticmethod
+    def _parse_extent_bound(value, end=False):
+        """ Parse a temporal extent value, and return None if it is
+        missing, open ended or invalid. With end=True, values with
+        date precision are moved to the end of the day.
+        """
+        if value is None or value.strip() in ["", "..", "now"]:
+            return None
+        try:
+            time = parse(value)
+        except (ValueError, OverflowError):
+            return None
+        if end and len(value.strip()) <= 10:
+            time += datetime.timedelta(days=1)
+        return time.replace(tzinfo=time.tzinfo or timezone("utc"))
+
+    @staticmethod
+    def _union_bbox(bbox1, bbox2):
+        """ Return the bounding box of two bounding boxes.
+        """
+        return [min(bbox1[0], bbox2[0]), min(bbox1[1], bbox2[1]),
+                max(bbox1[2], bbox2[2]), max(bbox1[3], bbox2[3])]
+
+    @staticmethod
+    def _bbox_intersects(bbox1, bbox2):
+        """ Return True if two bounding boxes intersect.
+        """
+        return bbox1[0] <= bbox2[2] and bbox2[0] <= bbox1[2] and \
+            bbox1[1] <= bbox2[3] and bbox2[1] <= bbox1[3]
+
+    @staticmethod
+    def _bbox_area(bbox):
+        """ Return the area of a bounding box in square degrees.
+        """
+        return (bbox[2] - bbox[0])*(bbox[3] - bbox[1])
+
+    def _get_nearest_by_time(self, records, index, rel=0, workers=None, processes=False,
+                             record_times=False):
         """ Returns the record that is closest to self.time by given
         index. The index indicates either time_coverage_start (0) or
         time_coverage_end (1).
@@ -304,45 +1660,119 @@ class Collocate(SearchCSW):
             after Collocate.time. If rel=1, the search will cover
             times before Collocate.time. If rel=2, the search will
             cover times after Collocate.time.
+        workers : int (default None)
+            Maximum number of datasets probed concurrently, see
+            Collocate.probe_many.
+        processes : bool (default False)
+            Probe the datasets in a process pool instead of a thread
+            pool.
+        record_times : bool (default False)
+            Use the temporal extent of the CSW records when it is
+            given with sufficient precision, and only open the
+            datasets of the remaining records. Note that the
+            availability of datasets with a record extent is then not
+            checked.
         """
-        times = np.array([])
-        keys = []
         if not bool(records):
             raise ValueError("Input records dict is empty.")
-        for key, record in records.items():
-            odap = Collocate.get_odap_url(record)
-            try:
-                self.assert_available(odap)
-            except ValueError as ee:
-                logging.debug(ee)
-            else:
-                tt = Collocate.get_time_coverage(odap)
-                times = np.append(times, tt[index])
-                keys.append(key)
-
-        if len(keys) == 0:
+        fields = ["time_coverage_start", "time_coverage_end"]
+        probes = self._probe_records(records, [index], workers=workers, processes=processes,
+                                     record_times=record_times)
+
+        return self._select_nearest(records, probes, fields[index], rel=rel)
+
+    def _probe_records(self, records, indices=(0, 1), workers=None, processes=False,
+                       record_times=False):
+        """ Return a dict of metadata dicts (see Collocate.probe) with
+        the same keys as records. With record_times=True, the temporal
+        extent of the records is used when the given indices of
+        (time_coverage_start, time_coverage_end) are precise enough,
+        see Collocate._get_nearest_by_time.
+        """
+        fields = ["time_coverage_start", "time_coverage_end"]
+        probes = {}
+        if record_times:
+            for key, record in records.items():
+                tt = Collocate.get_record_time_coverage(record)
+                if all(tt[index] is not None for index in indices):
+                    probes[key] = {"available": True, fields[0]: tt[0], fields[1]: tt[1]}
+        missing = [key for key in records.keys() if key not in probes]
+        odaps = [Collocate.get_odap_url(records[key]) for key in missing]
+        probed = Collocate.probe_many(odaps, workers=workers, processes=processes,
+                                      cache=self.cache, reader=self.reader)
+        probes.update(zip(missing, probed))
+
+        return probes
+
+    def get_interval_index(self, records, **kwargs):
+        """ Return a fadg.index.IntervalIndex of the time coverage of
+        the available datasets of the given records, keyed like
+        records. Datasets without time_coverage_end cover only their
+        start time. The keywords workers, processes and record_times
+        are passed on as for Collocate._get_nearest_by_time.
+        """
+        probes = self._probe_records(records, **kwargs)
+        keys = [key for key in records.keys()
+                if probes[key]["available"] and probes[key]["time_coverage_start"] is not None]
+        starts = [probes[key]["time_coverage_start"] for key in keys]
+        ends = [probes[key]["time_coverage_end"] or probes[key]["time_coverage_start"]
+                for key in keys]
+        return IntervalIndex(starts, ends, keys)
+
+    def get_overlapping_collocations(self, records, dt=24, **kwargs):
+        """ Return a dict of the records whose time coverage overlaps
+        self.time +/- dt hours. See Collocate.get_interval_index for
+        the keywords.
+        """
+        index = self.get_interval_index(records, **kwargs)
+        delta = datetime.timedelta(hours=dt)
+        keys = index.overlapping(self.time - delta, self.time + delta)
+        return {key: records[key] for key in keys}
+
+    def get_nearest_collocation_by_time_coverage(self, records, **kwargs):
+        """ Return the record whose time coverage contains self.time,
+        or else the record with the smallest gap between its time
+        coverage and self.time (see fadg.index.IntervalIndex.nearest).
+        See Collocate.get_interval_index for the keywords.
+        """
+        if not bool(records):
+            raise ValueError("Input records dict is empty.")
+        key = self.get_interval_index(records, **kwargs).nearest(self.time)
+        if key is None:
             raise ValueError("No available datasets for the given search interval.")
+        return records[key]
 
-        index = None
-        delta = times - self.time
-        if rel == 0:
-            index = np.abs(delta).argmin()
-        if rel == 1:
-            if not (delta < datetime.timedelta(0)).any():
-                raise ValueError("No available datasets before %s." % self.time.isoformat())
-            dm = delta
-            dm[dm > datetime.timedelta(0)] = delta.min()
-            index = dm.argmax()
-        if rel == 2:
-            if not (delta > datetime.timedelta(0)).any():
-                raise ValueError("No available datasets after %s." % self.time.isoformat())
-            dm = delta
-            dm[dm < datetime.timedelta(0)] = delta.max()
-            index = dm.argmin()
+    def _select_nearest(self, records, probes, field, rel=0):
+        """ Return the record whose probed time field is nearest to
+        self.time, see Collocate._get_nearest_by_time.
+
+        Input
+        =====
+        records : dict
+            The candidate records
+        probes : dict
+            Metadata dicts (see Collocate.probe) with the same keys as
+            records
+        field : string
+            time_coverage_start or time_coverage_end
+        rel : int (0, 1, or 2)
+            Relative position in time
+        """
         if rel not in [0, 1, 2]:
             raise ValueError("rel must be 0, 1 or 2")
+        keys = [key for key in records.keys()
+                if probes[key]["available"] and probes[key][field] is not None]
+        if len(keys) == 0:
+            raise ValueError("No available datasets for the given search interval.")
+
+        index = TimeIndex([probes[key][field] for key in keys], keys)
+        key = index.nearest(self.time, rel=rel)
+        if key is None and rel == 1:
+            raise ValueError("No available datasets before %s." % self.time.isoformat())
+        if key is None and rel == 2:
+            raise ValueError("No available datasets after %s." % self.time.isoformat())
 
-        return records[keys[index]]
+        return records[key]
 
     def get_nearest_collocation_by_time_coverage_start(self, records, **kwargs):
         """ Returns the record that has time_coverage_start closest to
@@ -361,10 +1791,16 @@ class Collocate(SearchCSW):
         dataset.
         """
         url = None
-        rel = kwargs.pop("rel", 0)
+        nearest_kwargs = {
+            "rel": kwargs.pop("rel", 0),
+            "workers": kwargs.pop("workers", None),
+            "processes": kwargs.pop("processes", False),
+            "record_times": kwargs.pop("record_times", False),
+        }
         records = self.get_collocations(*args, **kwargs)
         if bool(records):
-            nearest = self.get_nearest_collocation_by_time_coverage_start(records, rel=rel)
+            nearest = self.get_nearest_collocation_by_time_coverage_start(records,
+                                                                          **nearest_kwargs)
             url = Collocate.get_odap_url(nearest)
         return url
 
@@ -374,6 +1810,13 @@ class AromeArctic(Collocate):
     another dataset.
     """
 
+    SUBSETS = {
+        "deterministic": "Arome-Arctic 2.5Km deterministic",
+        "lagged subset": "Arome-Arctic 2.5Km lagged subset",
+        "lagged vc": "Arome-Arctic 2.5Km lagged vc",
+        "lagged tracking": "Arome-Arctic 2.5Km lagged tracking",
+    }
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -381,15 +1824,9 @@ class AromeArctic(Collocate):
         """ Returns Arome-Arctic records collocated with the dataset
         given by url.
         """
-        subsets = {
-            "deterministic": "Arome-Arctic 2.5Km deterministic",
-            "lagged subset": "Arome-Arctic 2.5Km lagged subset",
-            "lagged vc": "Arome-Arctic 2.5Km lagged vc",
-            "lagged tracking": "Arome-Arctic 2.5Km lagged tracking",
-        }
         constraints = []
         # constraints.append(self._get_title_search("Arome-Arctic")) # this does not work
-        constraints.append(self._get_free_text_search(subsets[subset]))
+        constraints.append(self._get_free_text_search(AromeArctic.SUBSETS[subset]))
         return super().get_collocations(constraints, *args, **kwargs)
 
 
@@ -398,6 +1835,13 @@ class Meps(Collocate):
     dataset.
     """
 
+    SUBSETS = {
+        "model level": "Meps 2.5 km deterministic model level parameters",
+        "pressure level": "Meps 2.5 km deterministic pressure level parameters",
+        "surface": "Meps 2.5 km deterministic surface parameters",
+        "height level": "Meps 2.5 km deterministic height level parameters",
+    }
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -406,15 +1850,9 @@ class Meps(Collocate):
         given by url. The title search is limited to control
         members only.
         """
-        subsets = {
-            "model level": "Meps 2.5 km deterministic model level parameters",
-            "pressure level": "Meps 2.5 km deterministic pressure level parameters",
-            "surface": "Meps 2.5 km deterministic surface parameters",
-            "height level": "Meps 2.5 km deterministic height level parameters",
-        }
         constraints = []
-        # constraints.append(self._get_title_search(subsets[subset])) # this does not work
-        constraints.append(self._get_free_text_search(subsets[subset]))
+        # constraints.append(self._get_title_search(Meps.SUBSETS[subset])) # this does not work
+        constraints.append(self._get_free_text_search(Meps.SUBSETS[subset]))
         return super().get_collocations(constraints, *args, **kwargs)
 
 
@@ -423,6 +1861,10 @@ class METNordic(Collocate):
     forecasts with another dataset.
     """
 
+    PATTERN = PatternProduct(
+        "https://thredds.met.no/thredds/dodsC/metpparchivev3/%Y/%m/%d/"
+        "met_analysis_1_0km_nordic_%Y%m%dT%HZ.nc", step=datetime.timedelta(hours=1))
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -430,38 +1872,59 @@ class METNordic(Collocate):
         return super().get_collocations(*args, **kwargs)
 
     def get_odap_url_of_nearest(self):
-        """ Returns the OPeNDAP url to a MET Nordic dataset.
-
-        The function currently uses a hardcoded url pattern but this
-        should be replaced by a CSW search using get_collocations
-        function once the data is available through
-        https://data.met.no.
+        """ Returns the OPeNDAP url to the MET Nordic analysis nearest
+        in time, in either direction.
+
+        The url is resolved from the url pattern and the THREDDS
+        catalogs of the archive (see METNordic.PATTERN), without
+        opening any dataset. This should be replaced by a CSW search
+        using get_collocations function once the data is available
+        through https://data.met.no.
         """
-        url_path = "https://thredds.met.no/thredds/dodsC/metpparchivev3"
-        url_file = "met_analysis_1_0km_nordic"
-        datetimeStr = "%04d%02d%02dT%02d" % (self.time.year, self.time.month, self.time.day,
-                                             self.time.hour)
-        url = "%s/%04d/%02d/%02d/%s_%sZ.nc" % (url_path, self.time.year, self.time.month,
-                                               self.time.day, url_file, datetimeStr)
-        self.assert_available(url)
+        url = METNordic.PATTERN.nearest(self.time)
+        if url is None:
+            raise ValueError("No MET Nordic dataset is available near %s." % self.time)
 
         return url
 
 
 class WeatherForecast(Collocate):
-    """ Class for collocating weather forecasts with another dataset.
+    """ Class for collocating weather forecasts of any of the
+    products in WeatherForecast.PRODUCTS with another dataset.
 
-    TODO: we need to add a proper geographical search based on polygon
-    for this to work. In addition, the polygons must be added to the
-    metadata files at data.met.no
+    The forecast domains are not rectangular in lon/lat, so the search
+    uses the polygon footprint of the input dataset (ACDD
+    geospatial_bounds) when available, and the records are filtered
+    locally by the footprint (see Collocate.get_collocations).
     """
 
+    PRODUCTS = {
+        "arome arctic": AromeArctic.SUBSETS["deterministic"],
+        "meps": Meps.SUBSETS["surface"],
+    }
+
     def __init__(self, *args, **kwargs):
-        raise NotImplementedError(
-            "We need to add a proper geographical search based on "
-            "polygons for this to work. In addition, the polygons "
-            "must be added to the metadata files at data.met.no.")
-        # super().__init__(ds_url)
+        super().__init__(*args, **kwargs)
+
+    def get_collocations(self, products=None, *args, **kwargs):
+        """ Returns weather forecast records collocated with the
+        dataset given by url.
+
+        Input
+        =====
+        products : list (default all)
+            Keys of WeatherForecast.PRODUCTS to search for
+        args, kwargs
+            Passed on to Collocate.get_collocations
+        """
+        if products is None:
+            products = list(WeatherForecast.PRODUCTS.keys())
+        searches = [self._get_free_text_search(WeatherForecast.PRODUCTS[product])
+                    for product in products]
+        if len(searches) == 0:
+            raise ValueError("No weather forecast products given.")
+        constraints = [searches[0] if len(searches) == 1 else fes.Or(searches)]
+        return super().get_collocations(constraints, *args, **kwargs)
 
 
 class NorKyst800(Collocate):
@@ -469,6 +1932,11 @@ class NorKyst800(Collocate):
     dataset.
     """
 
+    PATTERN = PatternProduct(
+        "https://thredds.met.no/thredds/dodsC/fou-hi/norkyst800m-1h/"
+        "NorKyst-800m_ZDEPTHS_his.an.%Y%m%d00.nc", step=datetime.timedelta(days=1),
+        coverage=datetime.timedelta(days=1), max_steps=7)
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -476,19 +1944,17 @@ class NorKyst800(Collocate):
         return super().get_collocations(*args, **kwargs)
 
     def get_odap_url_of_nearest(self):
-        """ Returns the OPeNDAP url to a Norkyst800 dataset.
+        """ Returns the OPeNDAP url to the Norkyst800 dataset covering
+        the time, or else the nearest in either direction.
 
-        The function currently uses a hardcoded url pattern but this
-        should be replaced by a CSW search using get_collocations
+        The url is resolved from the url pattern and the THREDDS
+        catalog (see NorKyst800.PATTERN), without opening any dataset.
+        This should be replaced by a CSW search using get_collocations
         function once the data is available through
         https://data.met.no.
         """
-        # Construct url
-        url_path = "https://thredds.met.no/thredds/dodsC/fou-hi/norkyst800m-1h"
-        url_file = "NorKyst-800m_ZDEPTHS_his.an.%04d%02d%02d00.nc" % (self.time.year,
-                                                                      self.time.month,
-                                                                      self.time.day)
-        url = os.path.join(url_path, url_file)
-        self.assert_available(url)
+        url = NorKyst800.PATTERN.nearest(self.time)
+        if url is None:
+            raise ValueError("No NorKyst800 dataset is available near %s." % self.time)
 
         return url
@@ -0,0 +1,304 @@
+"""
+fadg : geometry.py
+==================
+
+Copyright 2024 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Polygon footprints in longitude and latitude, e.g., from the ACDD
+attribute geospatial_bounds, with vectorised intersection tests, and
+splitting of bounding boxes that cross the antimeridian.
+"""
+import re
+
+import numpy as np
+
+WKT_TYPES = re.compile(r"^\s*(?:SRID=\d+;\s*)?(MULTIPOLYGON|POLYGON)\s*(.*)$", re.IGNORECASE)
+
+
+def split_bbox(bbox):
+    """ Return a list of bounding boxes [lon_min, lat_min, lon_max,
+    lat_max] within [-180, 180] and [-90, 90] that cover the given
+    bounding box. Boxes that cross the antimeridian, i.e., with
+    lon_min > lon_max as in ACDD, or with longitudes outside [-180,
+    180], are split in two. Boxes that span all longitudes are
+    returned as one box from -180 to 180.
+    """
+    lon_min, lat_min, lon_max, lat_max = [float(value) for value in bbox]
+    lat_min, lat_max = max(lat_min, -90.), min(lat_max, 90.)
+    span = lon_max - lon_min
+    if span < 0:
+        span += 360.
+    if span >= 360.:
+        return [[-180., lat_min, 180., lat_max]]
+    west = (lon_min + 180.) % 360. - 180.
+    east = west + span
+    if east <= 180.:
+        return [[west, lat_min, east, lat_max]]
+    return [[west, lat_min, 180., lat_max], [-180., lat_min, east - 360., lat_max]]
+
+
+def _parse_nested(text):
+    """ Parse a WKT coordinate body, e.g., "((1 2, 3 4, 5 6, 1 2))",
+    into nested lists with coordinate strings at the innermost level.
+    """
+    stack = [[]]
+    token = ""
+    for char in text:
+        if char in "(),":
+            if token.strip():
+                stack[-1].append(token.strip())
+            token = ""
+            if char == "(":
+                stack.append([])
+            elif char == ")":
+                if len(stack) < 2:
+                    raise ValueError("Invalid WKT: unbalanced parentheses.")
+                item = stack.pop()
+                stack[-1].append(item)
+        else:
+            token += char
+    if len(stack) != 1 or token.strip():
+        raise ValueError("Invalid WKT: unbalanced parentheses.")
+    return stack[0]
+
+
+def _parse_ring(coordinates):
+    """ Return an array of shape (N, 2) from a list of WKT coordinate
+    strings.
+    """
+    try:
+        return np.array([[float(value) for value in point.split()[:2]]
+                         for point in coordinates])
+    except (AttributeError, ValueError):
+        raise ValueError("Invalid WKT coordinates.")
+
+
+def _close_ring(points):
+    """ Return a closed ring as a float array of shape (N, 2).
+    """
+    ring = np.asarray(points, dtype=float)
+    if ring.ndim != 2 or ring.shape[1] != 2:
+        raise ValueError("Ring coordinates must be [lon, lat] pairs.")
+    if len(ring) > 0 and not np.array_equal(ring[0], ring[-1]):
+        ring = np.vstack([ring, ring[:1]])
+    if len(ring) < 4:
+        raise ValueError("A polygon ring needs at least three distinct points.")
+    return ring
+
+
+def _orientation(ax, ay, bx, by, cx, cy):
+    """ Return the sign of the cross product (b - a) x (c - a).
+    """
+    return np.sign((bx - ax)*(cy - ay) - (by - ay)*(cx - ax))
+
+
+def _on_segment(ax, ay, bx, by, cx, cy):
+    """ Return True where the collinear point c lies on segment ab.
+    """
+    return (np.minimum(ax, bx) <= cx) & (cx <= np.maximum(ax, bx)) & \
+        (np.minimum(ay, by) <= cy) & (cy <= np.maximum(ay, by))
+
+
+def segments_intersect(p0, p1, q0, q1):
+    """ Return a boolean array of shape (M, N), True where segment
+    p0[i]-p1[i] intersects or touches segment q0[j]-q1[j]. The inputs
+    are arrays of shape (M, 2) and (N, 2).
+    """
+    ax, ay = p0[:, 0][:, None], p0[:, 1][:, None]
+    bx, by = p1[:, 0][:, None], p1[:, 1][:, None]
+    cx, cy = q0[:, 0][None, :], q0[:, 1][None, :]
+    dx, dy = q1[:, 0][None, :], q1[:, 1][None, :]
+    o1 = _orientation(ax, ay, bx, by, cx, cy)
+    o2 = _orientation(ax, ay, bx, by, dx, dy)
+    o3 = _orientation(cx, cy, dx, dy, ax, ay)
+    o4 = _orientation(cx, cy, dx, dy, bx, by)
+    crossing = (o1 != o2) & (o3 != o4)
+    touching = ((o1 == 0) & _on_segment(ax, ay, bx, by, cx, cy)) | \
+        ((o2 == 0) & _on_segment(ax, ay, bx, by, dx, dy)) | \
+        ((o3 == 0) & _on_segment(cx, cy, dx, dy, ax, ay)) | \
+        ((o4 == 0) & _on_segment(cx, cy, dx, dy, bx, by))
+    return crossing | touching
+
+
+class Footprint:
+    """Polygon footprint given by longitude and latitude, with holes
+    and several parts (multipolygon). Points are inside by the
+    even-odd rule, so parts must not overlap.
+
+    Input
+    =====
+    polygons : list
+        List of polygons, each a list of rings of [lon, lat] points.
+        The first ring of a polygon is its exterior, and the others
+        are holes.
+    """
+
+    def __init__(self, polygons):
+        self.polygons = [[_close_ring(ring) for ring in polygon] for polygon in polygons]
+        if len(self.polygons) == 0 or any(len(polygon) == 0 for polygon in self.polygons):
+            raise ValueError("A footprint needs at least one polygon.")
+        rings = [ring for polygon in self.polygons for ring in polygon]
+        self.vertices = np.vstack([ring[:-1] for ring in rings])
+        self._edge0 = np.vstack([ring[:-1] for ring in rings])
+        self._edge1 = np.vstack([ring[1:] for ring in rings])
+
+    @classmethod
+    def from_wkt(cls, text):
+        """ Return the footprint of a WKT POLYGON or MULTIPOLYGON in
+        lon/lat order. Raise ValueError if the WKT is not supported.
+        """
+        match = WKT_TYPES.match(text or "")
+        if match is None:
+            raise ValueError("Only WKT POLYGON and MULTIPOLYGON are supported.")
+        nested = _parse_nested(match.group(2))
+        if len(nested) != 1:
+            raise ValueError("Invalid WKT: %s" % text)
+        polygons = nested[0] if match.group(1).upper() == "MULTIPOLYGON" else nested
+        try:
+            return cls([[_parse_ring(ring) for ring in polygon] for polygon in polygons])
+        except TypeError:
+            raise ValueError("Invalid WKT: %s" % text)
+
+    @classmethod
+    def from_bbox(cls, bbox):
+        """ Return the footprint of a bounding box [lon_min, lat_min,
+        lon_max, lat_max].
+        """
+        x0, y0, x1, y1 = [float(value) for value in bbox]
+        return cls([[[[x0, y0], [x1, y0], [x1, y1], [x0, y1], [x0, y0]]]])
+
+    @property
+    def bbox(self):
+        """ The bounding box [lon_min, lat_min, lon_max, lat_max].
+        """
+        return [float(self.vertices[:, 0].min()), float(self.vertices[:, 1].min()),
+                float(self.vertices[:, 0].max()), float(self.vertices[:, 1].max())]
+
+    @property
+    def wkt(self):
+        """ The footprint as WKT.
+        """
+        def ring_wkt(ring):
+            return "(%s)" % ", ".join("%r %r" % (x, y) for x, y in ring.tolist())
+
+        polygons = ["(%s)" % ", ".join(ring_wkt(ring) for ring in polygon)
+                    for polygon in self.polygons]
+        if len(polygons) == 1:
+            return "POLYGON %s" % polygons[0]
+        return "MULTIPOLYGON (%s)" % ", ".join(polygons)
+
+    @property
+    def wraps(self):
+        """ True if an edge of the footprint crosses the antimeridian
+        or a pole, i.e., if consecutive vertices are more than 180
+        degrees apart in longitude. The intersection tests assume
+        planar lon/lat coordinates and do not apply to such
+        footprints.
+        """
+        return bool((np.abs(self._edge1[:, 0] - self._edge0[:, 0]) > 180.).any())
+
+    def bboxes(self):
+        """ Return a list of tight bounding boxes [lon_min, lat_min,
+        lon_max, lat_max] of the footprint, see split_bbox. The
+        longitudes of each exterior ring are unwrapped, so that
+        footprints that cross the antimeridian get two boxes, and
+        footprints that enclose a pole get a polar cap.
+        """
+        bboxes = []
+        for polygon in self.polygons:
+            ring = polygon[0]
+            steps = np.diff(ring[:, 0])
+            steps = (steps + 180.) % 360. - 180.
+            lon = ring[0, 0] + np.concatenate([[0.], np.cumsum(steps)])
+            lat_min, lat_max = float(ring[:, 1].min()), float(ring[:, 1].max())
+            if abs(lon[-1] - lon[0]) > 180.:
+                # The ring winds around a pole
+                if ring[:, 1].mean() >= 0:
+                    bboxes.append([-180., lat_min, 180., 90.])
+                else:
+                    bboxes.append([-180., -90., 180., lat_max])
+                continue
+            bboxes.extend(split_bbox([lon.min(), lat_min, lon.max(), lat_max]))
+        return bboxes
+
+    def swapped(self):
+        """ Return the footprint with longitude and latitude swapped,
+        for WKT given in lat/lon order.
+        """
+        return Footprint([[ring[:, ::-1] for ring in polygon] for polygon in self.polygons])
+
+    def contains_points(self, lon, lat):
+        """ Return a boolean array, True where the points are inside
+        the footprint.
+        """
+        x = np.atleast_1d(np.asarray(lon, dtype=float))[:, None]
+        y = np.atleast_1d(np.asarray(lat, dtype=float))[:, None]
+        x0, y0 = self._edge0[:, 0][None, :], self._edge0[:, 1][None, :]
+        x1, y1 = self._edge1[:, 0][None, :], self._edge1[:, 1][None, :]
+        straddles = (y0 > y) != (y1 > y)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            crossing = x < x0 + (y - y0)*(x1 - x0)/(y1 - y0)
+        return np.count_nonzero(straddles & crossing, axis=1) % 2 == 1
+
+    def intersects_bboxes(self, bboxes):
+        """ Return a boolean array, True where the bounding boxes
+        [lon_min, lat_min, lon_max, lat_max] intersect the footprint.
+        The boxes are first compared with the bounding box of the
+        footprint, and only the remaining boxes are tested exactly.
+        """
+        boxes = np.asarray(bboxes, dtype=float).reshape(-1, 4)
+        bbox = self.bbox
+        result = (boxes[:, 0] <= bbox[2]) & (boxes[:, 2] >= bbox[0]) & \
+            (boxes[:, 1] <= bbox[3]) & (boxes[:, 3] >= bbox[1])
+        candidates = np.nonzero(result)[0]
+        if len(candidates) == 0:
+            return result
+        boxes = boxes[candidates]
+
+        # Footprint vertices inside the boxes
+        vx, vy = self.vertices[:, 0][None, :], self.vertices[:, 1][None, :]
+        inside_x = (vx >= boxes[:, 0:1]) & (vx <= boxes[:, 2:3])
+        inside_y = (vy >= boxes[:, 1:2]) & (vy <= boxes[:, 3:4])
+        hit = (inside_x & inside_y).any(axis=1)
+
+        # Box corners inside the footprint
+        corners = np.stack([boxes[:, [0, 1]], boxes[:, [2, 1]], boxes[:, [2, 3]],
+                            boxes[:, [0, 3]]], axis=1)
+        inside = self.contains_points(corners[:, :, 0].ravel(), corners[:, :, 1].ravel())
+        hit |= inside.reshape(-1, 4).any(axis=1)
+
+        # Crossing edges
+        starts = corners.reshape(-1, 2)
+        ends = np.roll(corners, -1, axis=1).reshape(-1, 2)
+        crossing = segments_intersect(starts, ends, self._edge0, self._edge1)
+        hit |= crossing.any(axis=1).reshape(-1, 4).any(axis=1)
+
+        result[candidates] = hit
+        return result
+
+    def intersects(self, other):
+        """ Return True if the footprint intersects another footprint.
+        """
+        bbox = other.bbox
+        if not self.intersects_bboxes([bbox])[0]:
+            return False
+        if self.contains_points(other.vertices[:, 0], other.vertices[:, 1]).any():
+            return True
+        if other.contains_points(self.vertices[:, 0], self.vertices[:, 1]).any():
+            return True
+        return bool(segments_intersect(self._edge0, self._edge1, other._edge0,
+                                       other._edge1).any())
+
+# END Class Footprint
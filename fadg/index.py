@@ -0,0 +1,299 @@
+"""
+fadg : index.py
+===============
+
+Copyright 2024 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Sorted indexes for selecting candidate datasets by time.
+"""
+import datetime
+
+import numpy as np
+
+from pytz import timezone
+from dateutil.parser import parse
+
+# Distance of missing neighbours, in nanoseconds
+NO_DISTANCE = np.iinfo(np.int64).max
+
+
+def to_datetime64(times):
+    """ Return the given times as a datetime64[ns] array. The times
+    may be datetime.datetime objects, numpy.datetime64 values or
+    strings. Times with time zone are converted to UTC, and times
+    without time zone are assumed to be UTC.
+    """
+    if isinstance(times, (np.ndarray, np.datetime64)) and \
+            np.issubdtype(np.asarray(times).dtype, np.datetime64):
+        return np.atleast_1d(times).astype("datetime64[ns]")
+    values = []
+    for tt in np.atleast_1d(np.asarray(times, dtype=object)):
+        if isinstance(tt, str):
+            tt = parse(tt)
+        if isinstance(tt, datetime.datetime) and tt.tzinfo is not None:
+            tt = tt.astimezone(timezone("utc")).replace(tzinfo=None)
+        values.append(tt)
+    return np.array(values, dtype="datetime64[ns]")
+
+
+def _to_nanoseconds(delta):
+    """ Return a datetime.timedelta or numpy.timedelta64 in integer
+    nanoseconds.
+    """
+    return int(np.timedelta64(delta, "ns").astype(np.int64))
+
+
+class TimeIndex:
+    """Candidate keys sorted by time, for nearest, before and after
+    lookups in O(log N) with numpy.searchsorted.
+
+    Input
+    =====
+    times : list
+        Times of the candidates, see to_datetime64
+    keys : list (default None)
+        Keys of the candidates, e.g., record identifiers. The
+        positions in times are used if not given.
+    """
+
+    def __init__(self, times, keys=None):
+        times = to_datetime64(times)
+        if keys is None:
+            keys = list(range(len(times)))
+        if len(keys) != len(times):
+            raise ValueError("times and keys must have the same length")
+        order = np.argsort(times, kind="stable")
+        self.times = times[order]
+        self.keys = [keys[ii] for ii in order]
+        self._ns = self.times.astype(np.int64)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def positions(self, times, rel=0, tolerance=None):
+        """ Return the positions in the sorted index of the candidates
+        nearest to each of the given times, and -1 where there is no
+        candidate.
+
+        Input
+        =====
+        times : list or datetime-like
+            Target times, see to_datetime64
+        rel : int (0, 1, or 2)
+            0 for the nearest candidate, 1 for the nearest candidate
+            strictly before the target, and 2 for the nearest
+            candidate strictly after the target. Equidistant
+            candidates are resolved to the earlier one.
+        tolerance : datetime.timedelta (default None)
+            Maximum distance between the target and the candidate
+        """
+        if rel not in [0, 1, 2]:
+            raise ValueError("rel must be 0, 1 or 2")
+        target = to_datetime64(times).astype(np.int64)
+        size = len(self._ns)
+        if size == 0:
+            return np.full(target.shape, -1, dtype=np.int64)
+
+        after = np.searchsorted(self._ns, target, side="left")
+        before = after - 1
+        d_before = np.where(before >= 0, target - self._ns[np.clip(before, 0, size - 1)],
+                            NO_DISTANCE)
+        if rel == 2:
+            after = np.searchsorted(self._ns, target, side="right")
+        d_after = np.where(after < size, self._ns[np.clip(after, 0, size - 1)] - target,
+                           NO_DISTANCE)
+
+        if rel == 0:
+            pos = np.where(d_after < d_before, after, before)
+            distance = np.minimum(d_after, d_before)
+        elif rel == 1:
+            pos, distance = before, d_before
+        else:
+            pos, distance = after, d_after
+
+        missing = distance == NO_DISTANCE
+        if tolerance is not None:
+            missing |= distance > _to_nanoseconds(tolerance)
+        return np.where(missing, -1, pos)
+
+    def nearest(self, time, rel=0, tolerance=None):
+        """ Return the key of the candidate nearest to the given time,
+        or None if there is none. See TimeIndex.positions.
+        """
+        return self.nearest_many([time], rel=rel, tolerance=tolerance)[0]
+
+    def nearest_many(self, times, rel=0, tolerance=None):
+        """ Return a list of the keys of the candidates nearest to each
+        of the given times, with None where there is none. See
+        TimeIndex.positions.
+        """
+        return [None if pos < 0 else self.keys[pos]
+                for pos in self.positions(times, rel=rel, tolerance=tolerance)]
+
+    def k_nearest(self, time, k, tolerance=None):
+        """ Return a list of the keys of the k candidates nearest to
+        the given time, nearest first, optionally limited to those
+        within the tolerance.
+        """
+        target = int(to_datetime64(time).astype(np.int64)[0])
+        limit = NO_DISTANCE if tolerance is None else _to_nanoseconds(tolerance)
+        after = int(np.searchsorted(self._ns, target, side="left"))
+        before = after - 1
+        keys = []
+        while len(keys) < k:
+            d_before = target - self._ns[before] if before >= 0 else NO_DISTANCE
+            d_after = self._ns[after] - target if after < len(self._ns) else NO_DISTANCE
+            if min(d_before, d_after) > limit or min(d_before, d_after) == NO_DISTANCE:
+                break
+            if d_after < d_before:
+                keys.append(self.keys[after])
+                after += 1
+            else:
+                keys.append(self.keys[before])
+                before -= 1
+        return keys
+
+    def within(self, time, tolerance):
+        """ Return a list of the keys of the candidates within the
+        tolerance of the given time, sorted by time.
+        """
+        target = to_datetime64(time)[0]
+        delta = np.timedelta64(_to_nanoseconds(tolerance), "ns")
+        start = np.searchsorted(self.times, target - delta, side="left")
+        stop = np.searchsorted(self.times, target + delta, side="right")
+        return self.keys[start:stop]
+
+# END Class TimeIndex
+
+
+class IntervalIndex:
+    """Candidate keys with time intervals, e.g., the time coverage of
+    datasets, for overlap, containment and gap-minimising queries.
+
+    The intervals are kept as start times sorted in ascending order,
+    and end times sorted separately. Counting overlaps and finding the
+    nearest interval take O(log N). Listing the overlapping intervals
+    takes O(log N + K), where K is the number of intervals that start
+    within the longest interval length before the query, i.e., close
+    to the number of results when the intervals have similar lengths
+    as forecast files do.
+
+    Input
+    =====
+    starts : list
+        Start times of the intervals, see to_datetime64
+    ends : list
+        End times of the intervals
+    keys : list (default None)
+        Keys of the candidates, e.g., record identifiers. The
+        positions in starts are used if not given.
+    """
+
+    def __init__(self, starts, ends, keys=None):
+        starts = to_datetime64(starts)
+        ends = to_datetime64(ends)
+        if keys is None:
+            keys = list(range(len(starts)))
+        if len(starts) != len(ends) or len(keys) != len(starts):
+            raise ValueError("starts, ends and keys must have the same length")
+        if (ends < starts).any():
+            raise ValueError("Intervals must not end before they start")
+        order = np.argsort(starts, kind="stable")
+        self.starts = starts[order]
+        self.ends = ends[order]
+        self.keys = [keys[ii] for ii in order]
+        self._start_ns = self.starts.astype(np.int64)
+        self._end_ns = self.ends.astype(np.int64)
+        self._end_order = np.argsort(self._end_ns, kind="stable")
+        self._sorted_end_ns = self._end_ns[self._end_order]
+        self._max_length = int((self._end_ns - self._start_ns).max()) if len(self.keys) else 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def count_overlapping(self, start, stop=None):
+        """ Return the number of intervals that overlap [start, stop],
+        or contain start if stop is not given.
+        """
+        return self._count(*self._bounds(start, stop))
+
+    def overlapping(self, start, stop=None):
+        """ Return a list of the keys of the intervals that overlap
+        [start, stop], or contain start if stop is not given, sorted
+        by start time. Intervals that touch the query interval
+        overlap.
+        """
+        return [self.keys[pos] for pos in self._overlapping(*self._bounds(start, stop))]
+
+    def containing(self, time):
+        """ Return a list of the keys of the intervals that contain the
+        given time, sorted by start time.
+        """
+        return self.overlapping(time)
+
+    def nearest(self, start, stop=None):
+        """ Return the key of the interval with the smallest gap to
+        [start, stop], or to start if stop is not given, or None if
+        the index is empty. Among overlapping intervals, the one with
+        the longest overlap is returned, and then the one that starts
+        last. Equal gaps before and after the query are resolved to
+        the earlier interval.
+        """
+        first, last = self._bounds(start, stop)
+        if self._count(first, last) > 0:
+            pos = self._overlapping(first, last)
+            overlap = np.minimum(self._end_ns[pos], last) - np.maximum(self._start_ns[pos], first)
+            best = np.lexsort((self._start_ns[pos], overlap))[-1]
+            return self.keys[pos[best]]
+
+        size = len(self.keys)
+        after = int(np.searchsorted(self._start_ns, last, side="right"))
+        before = int(np.searchsorted(self._sorted_end_ns, first, side="left")) - 1
+        gap_after = self._start_ns[after] - last if after < size else NO_DISTANCE
+        gap_before = first - self._sorted_end_ns[before] if before >= 0 else NO_DISTANCE
+        if gap_after == NO_DISTANCE and gap_before == NO_DISTANCE:
+            return None
+        if gap_after < gap_before:
+            return self.keys[after]
+        return self.keys[self._end_order[before]]
+
+    def _bounds(self, start, stop=None):
+        """ Return the query interval in integer nanoseconds.
+        """
+        first = int(to_datetime64(start).astype(np.int64)[0])
+        last = first if stop is None else int(to_datetime64(stop).astype(np.int64)[0])
+        if last < first:
+            raise ValueError("The query interval must not end before it starts")
+        return first, last
+
+    def _count(self, first, last):
+        """ Return the number of intervals that overlap [first, last],
+        given in integer nanoseconds. Intervals that end before first
+        also start before last, so the count is a difference of two
+        binary searches.
+        """
+        started = np.searchsorted(self._start_ns, last, side="right")
+        ended = np.searchsorted(self._sorted_end_ns, first, side="left")
+        return int(started - ended)
+
+    def _overlapping(self, first, last):
+        """ Return the sorted positions of the intervals that overlap
+        [first, last], given in integer nanoseconds.
+        """
+        lo = np.searchsorted(self._start_ns, first - self._max_length, side="left")
+        hi = np.searchsorted(self._start_ns, last, side="right")
+        return lo + np.nonzero(self._end_ns[lo:hi] >= first)[0]
+
+# END Class IntervalIndex
@@ -0,0 +1,377 @@
+"""
+fadg : policy.py
+================
+
+Copyright 2024 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Deadlines, retries and hedged requests for the remote calls of fadg,
+i.e., CSW requests, OPeNDAP DAS requests and netCDF4 opens, with
+latency statistics per kind of call.
+"""
+import time
+import random
+import logging
+import requests
+import threading
+
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+
+logger = logging.getLogger(__name__)
+
+# Errors that are worth retrying. A missing file raises OSError or
+# FileNotFoundError, which is not retried.
+RETRY_ON = (TimeoutError, requests.ConnectionError, requests.Timeout)
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a remote call does not complete within its
+    deadline.
+    """
+
+
+class CallStats:
+    """Counters and latencies of one kind of remote call.
+    """
+
+    def __init__(self, max_samples=1000):
+        self.calls = 0
+        self.attempts = 0
+        self.retries = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.latencies = []
+        self.max_samples = max_samples
+
+    def add_latency(self, seconds):
+        self.latencies.append(seconds)
+        if len(self.latencies) > self.max_samples:
+            del self.latencies[0]
+
+    def percentile(self, q):
+        """ Return the q-th percentile (0-100) of the latencies of the
+        latest successful calls, or None if there are none.
+        """
+        if len(self.latencies) == 0:
+            return None
+        values = sorted(self.latencies)
+        return values[min(int(round(q/100.*(len(values) - 1))), len(values) - 1)]
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "attempts": self.attempts,
+            "retries": self.retries,
+            "timeouts": self.timeouts,
+            "failures": self.failures,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": max(self.latencies) if self.latencies else None,
+        }
+
+# END Class CallStats
+
+
+class CallPolicy:
+    """Policy for remote calls: each attempt gets a deadline, failed
+    attempts are retried with exponential backoff and full jitter, and
+    calls to urls with mirrors can be hedged, i.e., duplicated against
+    the next mirror if the first request is slow. The first successful
+    response wins.
+
+    Calls that block without a timeout of their own, e.g., netCDF4
+    opens, run in a worker thread and are abandoned when the deadline
+    passes. The abandoned thread finishes in the background, since
+    threads cannot be cancelled. Calls that must not run concurrently,
+    e.g., netCDF4 opens, are made with CallPolicy.call_serial.
+
+    Statistics per kind of call (e.g., "csw", "dap", "netcdf") are
+    available with CallPolicy.stats.
+
+    Input
+    =====
+    timeout : float (default 60)
+        Deadline in seconds of each attempt. None means no deadline.
+    retries : int (default 2)
+        Number of retries after the first attempt
+    backoff : float (default 1)
+        Base delay in seconds before the first retry. The delay is
+        drawn uniformly from [0, backoff*2**n] before retry n + 1.
+    max_backoff : float (default 30)
+        Maximum delay in seconds between attempts
+    retry_on : tuple (default RETRY_ON)
+        Exception types that are retried
+    hedge_after : float (default None)
+        Seconds to wait for a response before sending a duplicate
+        request to the next mirror. None disables hedging.
+    mirrors : dict (default None)
+        Url prefixes mapped to lists of mirror prefixes, e.g.,
+        {"https://thredds.met.no/thredds": ["https://mirror/thredds"]}
+    workers : int (default 32)
+        Maximum number of concurrent calls with deadline or hedging
+    """
+
+    def __init__(self, timeout=60, retries=2, backoff=1., max_backoff=30., retry_on=RETRY_ON,
+                 hedge_after=None, mirrors=None, workers=32):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_on = retry_on
+        self.hedge_after = hedge_after
+        self.mirrors = mirrors or {}
+        self.workers = workers
+
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._executor = None
+
+    def call(self, kind, func, *args, **kwargs):
+        """ Return func(*args, **kwargs) with deadline and retries.
+
+        Input
+        =====
+        kind : string
+            Kind of call for the statistics, e.g., "csw"
+        func : callable
+            The remote call
+        """
+        return self._retry(kind, lambda: self._with_deadline(func, *args, **kwargs))
+
+    def call_url(self, kind, func, url, *args, **kwargs):
+        """ Return func(url, *args, **kwargs) with deadline and
+        retries. If hedging is enabled and the url has mirrors (see
+        CallPolicy.alternatives), duplicate requests are sent to the
+        mirrors when no response has arrived after hedge_after
+        seconds, and the first successful response is returned.
+        """
+        urls = self.alternatives(url)
+        if self.hedge_after is None or len(urls) == 1:
+            return self.call(kind, func, url, *args, **kwargs)
+        return self._retry(kind, lambda: self._hedged(kind, func, urls, *args, **kwargs))
+
+    def call_serial(self, kind, func, *args, **kwargs):
+        """ Return func(*args, **kwargs) with deadline, one call of the
+        given kind at a time, e.g., for netCDF4 opens, since the
+        netCDF-C library is not guaranteed to be thread safe. The
+        calls are not hedged, and are not retried after the deadline,
+        since the abandoned call may still be running. Calls that get
+        their turn after their deadline are dropped.
+        """
+        lock = _get_serial_lock(kind)
+        abandoned = threading.Event()
+
+        def serial(*args, **kwargs):
+            with lock:
+                if abandoned.is_set():
+                    raise DeadlineExceeded("Dropped after the deadline")
+                return func(*args, **kwargs)
+
+        try:
+            return self._retry(kind, lambda: self._with_deadline(serial, *args, **kwargs),
+                               retry_deadline=False)
+        except DeadlineExceeded:
+            abandoned.set()
+            raise
+
+    def alternatives(self, url):
+        """ Return a list of the url and its mirrors.
+        """
+        urls = [url]
+        for prefix, mirrors in self.mirrors.items():
+            if url.startswith(prefix):
+                urls.extend(mirror + url[len(prefix):] for mirror in mirrors)
+        return urls
+
+    def stats(self, kind=None):
+        """ Return a dict of the statistics of the given kind of call,
+        or a dict of such dicts keyed by kind. The latencies (p50,
+        p95, p99 and max) are in seconds, and include retries.
+        """
+        with self._lock:
+            if kind is not None:
+                return self._get_stats(kind).as_dict()
+            return {key: value.as_dict() for key, value in self._stats.items()}
+
+    def reset_stats(self):
+        """ Remove all statistics.
+        """
+        with self._lock:
+            self._stats = {}
+
+    def _get_stats(self, kind):
+        """ Return the CallStats of the given kind. Must be called
+        with the lock held.
+        """
+        if kind not in self._stats:
+            self._stats[kind] = CallStats()
+        return self._stats[kind]
+
+    def _update(self, kind, **counts):
+        with self._lock:
+            stats = self._get_stats(kind)
+            for key, value in counts.items():
+                setattr(stats, key, getattr(stats, key) + value)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                    thread_name_prefix="fadg-policy")
+            return self._executor
+
+    def _retry(self, kind, attempt, retry_deadline=True):
+        """ Run attempt with retries, and record the statistics. With
+        retry_deadline=False, DeadlineExceeded is not retried.
+        """
+        self._update(kind, calls=1)
+        start = time.monotonic()
+        for nn in range(self.retries + 1):
+            self._update(kind, attempts=1)
+            try:
+                result = attempt()
+            except self.retry_on as ee:
+                if isinstance(ee, TimeoutError):
+                    self._update(kind, timeouts=1)
+                if nn == self.retries or \
+                        (not retry_deadline and isinstance(ee, DeadlineExceeded)):
+                    self._update(kind, failures=1)
+                    raise
+                delay = random.uniform(0, min(self.max_backoff, self.backoff*2**nn))
+                logger.debug("Retrying %s call in %.2f s after %s", kind, delay, ee)
+                self._update(kind, retries=1)
+                time.sleep(delay)
+            except Exception:
+                self._update(kind, failures=1)
+                raise
+            else:
+                with self._lock:
+                    self._get_stats(kind).add_latency(time.monotonic() - start)
+                return result
+
+    def _with_deadline(self, func, *args, **kwargs):
+        """ Return func(*args, **kwargs), or raise DeadlineExceeded if
+        it does not complete within self.timeout seconds.
+        """
+        if self.timeout is None:
+            return func(*args, **kwargs)
+        future = self._get_executor().submit(func, *args, **kwargs)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            if not future.done():
+                # Calls that have not started yet are dropped
+                future.cancel()
+                raise DeadlineExceeded("No response within %s seconds" % self.timeout)
+            raise
+
+    def _hedged(self, kind, func, urls, *args, **kwargs):
+        """ Return the first successful func(url, *args, **kwargs),
+        starting with the first url and adding the next url every
+        hedge_after seconds, within the deadline. Calls that have not
+        started when a response arrives, or the deadline passes, are
+        dropped.
+        """
+        executor = self._get_executor()
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        futures = {executor.submit(func, urls[0], *args, **kwargs): 0}
+        try:
+            return self._wait_hedged(kind, func, urls, futures, deadline, *args, **kwargs)
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def _wait_hedged(self, kind, func, urls, futures, deadline, *args, **kwargs):
+        """ Wait for the futures of CallPolicy._hedged, and add hedged
+        calls to futures.
+        """
+        executor = self._get_executor()
+        pending = set(futures)
+        error = None
+        while pending:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                break
+            wait_time = remaining
+            if len(futures) < len(urls):
+                wait_time = self.hedge_after if remaining is None else \
+                    min(self.hedge_after, remaining)
+            done, pending = wait(pending, timeout=wait_time, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as ee:
+                    error = ee
+                    continue
+                if futures[future] > 0:
+                    self._update(kind, hedge_wins=1)
+                return result
+            if len(futures) < len(urls):
+                # Slow or failed: hedge against the next mirror
+                url = urls[len(futures)]
+                logger.debug("Hedging %s call with %s", kind, url)
+                self._update(kind, hedges=1)
+                future = executor.submit(func, url, *args, **kwargs)
+                futures[future] = len(futures)
+                pending.add(future)
+        if error is not None and not pending:
+            raise error
+        raise DeadlineExceeded("No response within %s seconds" % self.timeout)
+
+# END Class CallPolicy
+
+
+_policy = None
+_policy_lock = threading.Lock()
+# Locks of CallPolicy.call_serial by kind of call, shared by all
+# policies, since abandoned calls may outlive their policy
+_serial_locks = {}
+
+
+def _get_serial_lock(kind):
+    """ Return the lock of the given kind of serial call.
+    """
+    with _policy_lock:
+        if kind not in _serial_locks:
+            _serial_locks[kind] = threading.Lock()
+        return _serial_locks[kind]
+
+
+def get_policy():
+    """ Return the call policy shared by all remote calls of fadg. A
+    CallPolicy with default settings is created on first use.
+    """
+    global _policy
+    with _policy_lock:
+        if _policy is None:
+            _policy = CallPolicy()
+        return _policy
+
+
+def set_policy(policy):
+    """ Replace the shared call policy, e.g., with
+    CallPolicy(timeout=20, hedge_after=2, mirrors={...}). Use None to go
+    back to the default policy.
+    """
+    global _policy
+    with _policy_lock:
+        _policy = policy
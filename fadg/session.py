@@ -0,0 +1,63 @@
+"""
+fadg : session.py
+=================
+
+Copyright 2024 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import logging
+import requests
+import threading
+
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session(pool_connections=10, pool_maxsize=20):
+    """ Return the shared requests.Session of fadg. The session keeps
+    connections alive, and is reused by all SearchCSW and Collocate
+    instances that use pooled connections. The pool sizes only apply
+    when the session is created.
+
+    Input
+    =====
+    pool_connections : int (default 10)
+        Number of hosts to keep connection pools for
+    pool_maxsize : int (default 20)
+        Maximum number of connections per host
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            logger.debug("Creating shared HTTP session")
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+
+def close_session():
+    """ Close the shared session and its connections. A new session is
+    created on the next call to get_session.
+    """
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
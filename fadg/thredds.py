@@ -0,0 +1,219 @@
+"""
+fadg : thredds.py
+=================
+
+Copyright 2024 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Resolve the OPeNDAP urls of products that are stored with a fixed url
+pattern on a THREDDS server, using the catalog of each directory
+instead of opening the datasets.
+"""
+import os
+import time
+import logging
+import datetime
+import threading
+
+from pytz import timezone
+from owslib.etree import etree
+
+from fadg.session import get_session
+
+logger = logging.getLogger(__name__)
+
+THREDDS_NS = "http://www.unidata.ucar.edu/namespaces/thredds/InvCatalog/v1.0"
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=timezone("utc"))
+
+
+def catalog_url(url):
+    """ Return the url of the THREDDS catalog (catalog.xml) of the
+    directory of the given OPeNDAP url.
+    """
+    base, sep, path = url.partition("/dodsC/")
+    if not sep:
+        raise ValueError("Not a THREDDS OPeNDAP url: %s" % url)
+    directory = os.path.dirname(path)
+    if directory:
+        return "%s/catalog/%s/catalog.xml" % (base, directory)
+    return "%s/catalog/catalog.xml" % base
+
+
+def parse_catalog(text):
+    """ Return the set of file names of the datasets in a THREDDS
+    catalog.xml response. Nested catalogs (catalogRef) are not
+    followed.
+    """
+    if isinstance(text, str):
+        text = text.encode()
+    try:
+        root = etree.fromstring(text)
+    except etree.ParseError as ee:
+        raise ValueError("Invalid THREDDS catalog: %s" % ee)
+    files = set()
+    for dataset in root.iter("{%s}dataset" % THREDDS_NS):
+        path = dataset.get("urlPath")
+        if path:
+            files.add(os.path.basename(path))
+    return files
+
+
+def fetch_catalog(url, timeout=60, session=None):
+    """ Fetch the THREDDS catalog of the directory of the given
+    OPeNDAP url, and return the set of file names. An empty set is
+    returned if the directory does not exist (HTTP 404). Other request
+    errors are raised as requests.RequestException.
+    """
+    http = get_session() if session is None else session
+    response = http.get(catalog_url(url), timeout=timeout)
+    if response.status_code == 404:
+        return set()
+    response.raise_for_status()
+    return parse_catalog(response.text)
+
+
+class PatternProduct:
+    """Resolve the url of the existing file nearest to a given time,
+    for products with one file per time step and a url pattern.
+
+    The files of each directory are listed once from its THREDDS
+    catalog (or with os.listdir for local paths), and the set of
+    existing files is cached, so no dataset is opened. The directory
+    listings are shared by all users of the instance, and are listed
+    again after ttl seconds, since the latest directories still grow.
+
+    Input
+    =====
+    templates : string or list
+        strftime url templates, e.g., ".../%Y/%m/%d/file_%Y%m%dT%HZ.nc".
+        If several templates are given, e.g., for renamed files, the
+        first existing one is used for each time step.
+    step : datetime.timedelta
+        Time between files
+    offset : datetime.timedelta (default 0)
+        Time of the first file of the day, i.e., the files are at
+        midnight UTC + offset + n*step
+    coverage : datetime.timedelta (default 0)
+        Time covered by each file from its nominal time. Times within
+        the coverage of a file have distance 0 to that file.
+    max_steps : int (default 48)
+        Maximum number of steps to search before and after the time
+    timeout : float (default 60)
+        Timeout in seconds of catalog requests
+    ttl : float (default 3600)
+        Time to live in seconds of the directory listings. None means
+        that the listings never expire.
+    """
+
+    def __init__(self, templates, step, offset=datetime.timedelta(0),
+                 coverage=datetime.timedelta(0), max_steps=48, timeout=60, ttl=3600):
+        if isinstance(templates, str):
+            templates = [templates]
+        if step <= datetime.timedelta(0):
+            raise ValueError("step must be positive")
+        self.templates = list(templates)
+        self.step = step
+        self.offset = offset
+        self.coverage = coverage
+        self.max_steps = max_steps
+        self.timeout = timeout
+        self.ttl = ttl
+        self.request_count = 0
+
+        self._lock = threading.Lock()
+        self._listings = {}
+
+    def url(self, time, template=None):
+        """ Return the url of the file at the given nominal time.
+        """
+        template = self.templates[0] if template is None else template
+        return self._to_utc(time).strftime(template)
+
+    def candidates(self, time, max_steps=None):
+        """ Return a list of the nominal times of the files within
+        max_steps of the given time, sorted by distance to the time.
+        Equidistant times are sorted with the earlier time first.
+        """
+        time = self._to_utc(time)
+        max_steps = self.max_steps if max_steps is None else max_steps
+        anchor = EPOCH + self.offset
+        first = anchor + ((time - anchor)//self.step)*self.step
+        times = [first + ii*self.step for ii in range(-max_steps, max_steps + 2)]
+        return sorted(times, key=lambda tt: (self._distance(tt, time), tt))
+
+    def nearest(self, time, max_steps=None, session=None):
+        """ Return the url of the existing file nearest to the given
+        time in either direction, or None if there is no file within
+        max_steps.
+        """
+        for tt in self.candidates(time, max_steps=max_steps):
+            for template in self.templates:
+                url = self.url(tt, template=template)
+                if self.exists(url, session=session):
+                    return url
+        return None
+
+    def exists(self, url, session=None):
+        """ Return True if the given url is in the listing of its
+        directory.
+        """
+        return os.path.basename(url) in self.files(url, session=session)
+
+    def files(self, url, session=None):
+        """ Return the set of file names in the directory of the given
+        url, listed once and cached.
+        """
+        directory = os.path.dirname(url)
+        now = time.time()
+        with self._lock:
+            listing = self._listings.get(directory)
+            if listing is not None and (self.ttl is None or now - listing[0] <= self.ttl):
+                return listing[1]
+        if "://" in url:
+            logger.debug("Listing THREDDS catalog of %s", directory)
+            files = fetch_catalog(url, timeout=self.timeout, session=session)
+            with self._lock:
+                self.request_count += 1
+        elif os.path.isdir(directory or "."):
+            files = set(os.listdir(directory or "."))
+        else:
+            files = set()
+        with self._lock:
+            self._listings[directory] = (now, files)
+        return files
+
+    def clear(self):
+        """ Remove the cached directory listings.
+        """
+        with self._lock:
+            self._listings = {}
+
+    def _distance(self, nominal, time):
+        """ Return the distance between time and the coverage of the
+        file at the given nominal time.
+        """
+        if time < nominal:
+            return nominal - time
+        return max(time - nominal - self.coverage, datetime.timedelta(0))
+
+    @staticmethod
+    def _to_utc(time):
+        """ Return the given time with UTC time zone. Times without
+        time zone are assumed to be UTC.
+        """
+        if time.tzinfo is None:
+            return time.replace(tzinfo=timezone("utc"))
+        return time.astimezone(timezone("utc"))
+
+# END Class PatternProduct
@@ -33,6 +33,29 @@ import pytest
 sys.path.insert(1, os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
 
 from fadg.config import Config  # noqa: E402
+from fadg.cache import set_availability_cache  # noqa: E402
+from fadg.policy import CallPolicy  # noqa: E402
+from fadg.policy import set_policy  # noqa: E402
+
+##
+#  Shared State
+##
+
+
+@pytest.fixture(autouse=True)
+def freshAvailabilityCache():
+    """Start each test with an empty shared availability cache."""
+    set_availability_cache(None)
+    yield
+    set_availability_cache(None)
+
+
+@pytest.fixture(autouse=True)
+def freshCallPolicy():
+    """Start each test with a call policy that retries without delay."""
+    set_policy(CallPolicy(backoff=0.))
+    yield
+    set_policy(None)
 
 ##
 #  Directory Fixtures
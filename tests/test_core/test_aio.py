@@ -0,0 +1,241 @@
+"""
+Collocation : Async module tests
+================================
+
+Copyright 2024 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import pytest
+import asyncio
+import datetime
+
+from pytz import timezone
+from dateutil.parser import parse
+from owslib.etree import etree
+
+from tools import getRecordsResponse
+
+aiohttp = pytest.importorskip("aiohttp")
+
+from fadg.aio import fetch_metadata  # noqa: E402
+from fadg.aio import AsyncSearchCSW  # noqa: E402
+from fadg.aio import AsyncCollocate  # noqa: E402
+from fadg.cache import MetadataCache  # noqa: E402
+from fadg.cache import get_availability_cache  # noqa: E402
+from fadg.csw import SLIM_ELEMENTS  # noqa: E402
+
+URL = "https://thredds.met.no/thredds/dodsC"
+
+DAS = """Attributes {
+    NC_GLOBAL {
+        String time_coverage_start "%s";
+        String time_coverage_end "%s";
+        Float64 geospatial_lon_min -3.0;
+        Float64 geospatial_lat_min 58.0;
+        Float64 geospatial_lon_max 5.0;
+        Float64 geospatial_lat_max 65.0;
+    }
+}
+"""
+
+
+class MockResponse:
+
+    def __init__(self, status, body):
+        self.status = status
+        self.body = body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return None
+
+    def raise_for_status(self):
+        if self.status != 200:
+            raise aiohttp.ClientResponseError(None, (), status=self.status)
+
+    async def read(self):
+        return self.body
+
+    async def text(self):
+        return self.body
+
+
+class MockSession:
+    """ Local stand-in for a CSW service with 25 matching records, and
+    for the DAS responses of an OPeNDAP server.
+    """
+
+    def __init__(self, das=None, matches=25, cap=None):
+        self.das = das or {}
+        self.matches = matches
+        self.cap = cap
+        self.posts = []
+        self.gets = []
+        self.elements = []
+
+    def post(self, url, data=None, headers=None):
+        xml = etree.fromstring(data)
+        start = int(xml.get("startPosition"))
+        maxrecords = int(xml.get("maxRecords"))
+        self.posts.append((start, maxrecords))
+        self.elements.append([elem.text for elem in xml.iter(
+            "{http://www.opengis.net/cat/csw/2.0.2}ElementName")])
+        if self.cap is not None:
+            maxrecords = min(maxrecords, self.cap)
+        return MockResponse(200, getRecordsResponse(start, maxrecords, self.matches))
+
+    def get(self, url):
+        self.gets.append(url)
+        if url not in self.das:
+            return MockResponse(404, "Not found")
+        if isinstance(self.das[url], Exception):
+            raise self.das[url]
+        if isinstance(self.das[url], int):
+            return MockResponse(self.das[url], "Error")
+        return MockResponse(200, self.das[url])
+
+
+def das(start, end):
+    return DAS % (start, end)
+
+
+@pytest.mark.core
+def testAsyncSearchCSW_execute():
+    """ Test that all pages are retrieved concurrently after the first
+    page, and merged.
+    """
+    session = MockSession()
+    ds = AsyncSearchCSW(time=datetime.datetime(2024, 4, 6, 10, tzinfo=timezone("utc")),
+                        text="Arome", pagesize=10, session=session)
+    assert ds.records is None
+    records = asyncio.run(ds.execute())
+    assert sorted(records.keys()) == sorted(["rec%d" % ii for ii in range(1, 26)])
+    assert len(ds.urls) == 25
+    assert sorted(session.posts) == [(1, 10), (11, 10), (21, 5)]
+    assert ds.request_count == 3
+
+    # Limited by max_records
+    session = MockSession()
+    ds = AsyncSearchCSW(pagesize=10, max_records=15, session=session)
+    records = asyncio.run(ds.execute())
+    assert len(records) == 15
+    assert sorted(session.posts) == [(1, 10), (11, 5)]
+    assert session.elements == [[], []]
+
+    # Only the given elements
+    session = MockSession()
+    ds = AsyncSearchCSW(max_records=15, session=session, elements=SLIM_ELEMENTS)
+    records = asyncio.run(ds.execute())
+    assert len(records) == 15
+    assert session.elements == [SLIM_ELEMENTS]*2
+
+    # The service caps the page size
+    session = MockSession(matches=50, cap=5)
+    ds = AsyncSearchCSW(pagesize=10, session=session)
+    records = asyncio.run(ds.execute())
+    assert len(records) == 50
+    assert sorted(session.posts) == [(1, 10)] + [(ii, 5) for ii in range(6, 51, 5)]
+    assert ds.request_count == 10
+
+
+@pytest.mark.core
+def testAsyncSearchCSW_iter_odap_urls():
+    """ Test that urls are yielded page by page.
+    """
+    async def first_url(ds):
+        async for url in ds.iter_odap_urls():
+            return url
+
+    session = MockSession()
+    ds = AsyncSearchCSW(pagesize=10, session=session)
+    assert asyncio.run(first_url(ds)) == "%s/rec1.nc" % URL
+
+
+@pytest.mark.core
+def testAsyncCollocate_fetch_metadata():
+    """ Test that metadata is read from the DAS response, that
+    missing datasets are reported as unavailable, and that failed
+    requests are reported as unknown and not cached.
+    """
+    session = MockSession(das={
+        "%s/rec1.nc.das" % URL: das("2024-04-06T10:00:00Z", "2024-04-06T10:02:00Z"),
+        "%s/rec2.nc.das" % URL: "<html>Error</html>",
+        "%s/rec3.nc.das" % URL: aiohttp.ClientConnectionError("Test"),
+        "%s/rec5.nc.das" % URL: 410,
+        "%s/rec6.nc.das" % URL: 503,
+        "%s/rec7.nc.das" % URL: 429,
+        "%s/rec8.nc.das" % URL: asyncio.TimeoutError(),
+    })
+    metadata = asyncio.run(fetch_metadata(session, "%s/rec1.nc" % URL))
+    assert metadata["available"] is True
+    assert metadata["time_coverage_start"] == parse("2024-04-06T10:00:00Z")
+    assert metadata["geospatial_lat_max"] == 65.
+    for name in ["rec4", "rec5"]:
+        metadata = asyncio.run(fetch_metadata(session, "%s/%s.nc" % (URL, name)))
+        assert metadata["available"] is False
+    for name in ["rec2", "rec3", "rec6", "rec7", "rec8"]:
+        metadata = asyncio.run(fetch_metadata(session, "%s/%s.nc" % (URL, name)))
+        assert metadata["available"] is None
+
+    cache = MetadataCache(path=":memory:")
+    coll = AsyncCollocate("%s/rec1.nc" % URL, asyncio.run(
+        fetch_metadata(session, "%s/rec1.nc" % URL)), session=session, cache=cache)
+    urls = ["%s/rec%d.nc" % (URL, ii) for ii in [4, 6, 8]]
+    probes = asyncio.run(coll.probe_many(urls))
+    assert [pp["available"] for pp in probes] == [False, None, None]
+    assert cache.get(urls[0])["available"] is False
+    assert cache.get(urls[1]) is None and cache.get(urls[2]) is None
+    assert get_availability_cache().get(urls[0]) is False
+    assert get_availability_cache().get(urls[1]) is None
+
+
+@pytest.mark.core
+def testAsyncCollocate():
+    """ Test creating an AsyncCollocate object, and finding the
+    nearest collocated dataset.
+    """
+    dasses = {"%s/input.nc.das" % URL: das("2024-04-06T03:10:00Z", "2024-04-06T03:20:00Z")}
+    for ii in range(1, 26):
+        if ii == 3:
+            # Nearest is not available
+            continue
+        dasses["%s/rec%d.nc.das" % (URL, ii)] = das(
+            "2024-04-06T%02d:00:00Z" % (ii % 24), "2024-04-06T%02d:59:59Z" % (ii % 24))
+    session = MockSession(das=dasses)
+    cache = MetadataCache(path=":memory:")
+
+    async def run():
+        coll = await AsyncCollocate.create("%s/input.nc" % URL, session=session, cache=cache)
+        assert coll.time == datetime.datetime(2024, 4, 6, 3, 10, tzinfo=timezone("utc"))
+        assert coll.bbox == [-3., 58., 5., 65.]
+        url = await coll.get_odap_url_of_nearest(pagesize=10)
+        assert url == "%s/rec4.nc" % URL
+        url = await coll.get_odap_url_of_nearest(pagesize=10, rel=1)
+        assert url == "%s/rec2.nc" % URL
+        records = await coll.get_collocations(pagesize=10)
+        rec = await coll.get_nearest_collocation_by_time_coverage_end(records)
+        assert rec.identifier == "rec2"
+        with pytest.raises(ValueError) as ee:
+            await coll.get_nearest_collocation_by_time_coverage_start({})
+        assert str(ee.value) == "Input records dict is empty."
+
+    asyncio.run(run())
+    # The candidate metadata was only fetched once thanks to the cache
+    assert len(session.gets) == 26
+
+    with pytest.raises(ValueError) as ee:
+        asyncio.run(AsyncCollocate.create("%s/missing.nc" % URL, session=session))
+    assert "Could not read the time coverage" in str(ee.value)
@@ -0,0 +1,276 @@
+"""
+Collocation : Cache module tests
+================================
+
+Copyright 2024 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import os
+import time
+import pytest
+import sqlite3
+
+from owslib import fes
+from dateutil.parser import parse
+
+from fadg.cache import MetadataCache
+from fadg.cache import AvailabilityCache
+from fadg.cache import QueryCache
+from fadg.cache import get_availability_cache
+from fadg.cache import set_availability_cache
+
+
+def metadata(url, available=True):
+    return {
+        "url": url,
+        "available": available,
+        "time_coverage_start": parse("2024-04-06T10:00:00Z"),
+        "time_coverage_end": parse("2024-04-06T10:02:00Z"),
+        "geospatial_lon_min": -3.,
+        "geospatial_lat_min": 58.,
+        "geospatial_lon_max": 5.,
+        "geospatial_lat_max": 65.,
+    }
+
+
+@pytest.mark.core
+def testMetadataCache_put_get(tmp_path):
+    """ Test that metadata is stored persistently and read back.
+    """
+    path = os.path.join(tmp_path, "cache", "metadata.sqlite")
+    cache = MetadataCache(path=path)
+    assert cache.get("url1") is None
+    cache.put(metadata("url1"))
+    assert len(cache) == 1
+    cache.close()
+
+    cache = MetadataCache(path=path)
+    md = cache.get("url1")
+    assert md["available"] is True
+    assert md["time_coverage_start"] == parse("2024-04-06T10:00:00Z")
+    assert md["time_coverage_end"] == parse("2024-04-06T10:02:00Z")
+    assert md["geospatial_lat_max"] == 65.
+    assert md["geospatial_bounds"] is None
+    assert md["fetched"] <= time.time()
+
+    cache.clear()
+    assert len(cache) == 0
+
+
+@pytest.mark.core
+def testMetadataCache_default_path(tmp_path, monkeypatch):
+    """ Test that the cache is placed in the XDG cache directory.
+    """
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    cache = MetadataCache()
+    assert cache.path == os.path.join(tmp_path, "fadg", "metadata.sqlite")
+    assert os.path.isfile(cache.path)
+
+
+@pytest.mark.core
+def testMetadataCache_ttl():
+    """ Test that expired entries are not returned.
+    """
+    cache = MetadataCache(path=":memory:", ttl=10, failure_ttl=1)
+    cache.put(metadata("url1"))
+    cache.put(metadata("url2", available=False))
+    assert cache.get("url1") is not None
+    assert cache.get("url2")["available"] is False
+
+    now = time.time()
+    cache.put(dict(metadata("url1"), fetched=now - 20))
+    cache.put(dict(metadata("url2", available=False), fetched=now - 2))
+    assert cache.get("url1") is None
+    assert cache.get("url2") is None
+    assert len(cache) == 0
+
+    # Available entries never expire by default
+    cache = MetadataCache(path=":memory:")
+    cache.put(dict(metadata("url1"), fetched=0))
+    assert cache.get("url1") is not None
+
+
+@pytest.mark.core
+def testMetadataCache_eviction(monkeypatch):
+    """ Test that the least recently used entries are evicted.
+    """
+    clock = iter(range(100))
+    monkeypatch.setattr("fadg.cache.time.time", lambda: next(clock))
+    cache = MetadataCache(path=":memory:", max_entries=2)
+    cache.put(metadata("url1"))
+    cache.put(metadata("url2"))
+    assert cache.get("url1") is not None
+    cache.put(metadata("url3"))
+    assert len(cache) == 2
+    assert cache.get("url2") is None
+    assert cache.get("url1") is not None
+    assert cache.get("url3") is not None
+
+
+@pytest.mark.core
+def testMetadataCache_geospatial_bounds(tmp_path):
+    """ Test that footprints are stored, also in databases created
+    without the geospatial_bounds column.
+    """
+    path = os.path.join(tmp_path, "metadata.sqlite")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE metadata (url TEXT PRIMARY KEY, available INTEGER, "
+        "time_coverage_start TEXT, time_coverage_end TEXT, geospatial_lon_min REAL, "
+        "geospatial_lat_min REAL, geospatial_lon_max REAL, geospatial_lat_max REAL, "
+        "fetched REAL, accessed REAL)")
+    conn.commit()
+    conn.close()
+
+    cache = MetadataCache(path=path)
+    wkt = "POLYGON ((-3 58, 5 58, 5 65, -3 58))"
+    cache.put(dict(metadata("url1"), geospatial_bounds=wkt))
+    assert cache.get("url1")["geospatial_bounds"] == wkt
+
+
+@pytest.mark.core
+def testAvailabilityCache_backoff(monkeypatch):
+    """ Test that failures are remembered with exponential backoff,
+    and successes with a time to live.
+    """
+    clock = [1000.]
+    monkeypatch.setattr("fadg.cache.time.time", lambda: clock[0])
+    cache = AvailabilityCache(ttl=100, backoff=10, factor=2, max_backoff=30)
+    assert cache.get("url1") is None
+
+    cache.put("url1", False, error="Not found")
+    assert cache.get("url1") is False
+    clock[0] += 11
+    assert cache.get("url1") is None
+    cache.put("url1", False)
+    assert cache.failures("url1") == 2
+    clock[0] += 19
+    assert cache.get("url1") is False
+    clock[0] += 2
+    assert cache.get("url1") is None
+    cache.put("url1", False)
+    cache.put("url1", False)
+    clock[0] += 29
+    assert cache.get("url1") is False
+    clock[0] += 2
+    assert cache.get("url1") is None
+
+    # A success resets the backoff
+    cache.put("url1", True)
+    assert cache.failures("url1") == 0
+    assert cache.get("url1") is True
+    clock[0] += 101
+    assert cache.get("url1") is None
+    assert len(cache) == 1
+    cache.clear()
+    assert len(cache) == 0
+
+
+@pytest.mark.core
+def testAvailabilityCache_shared(tmp_path):
+    """ Test the shared cache, and persistence.
+    """
+    assert get_availability_cache() is get_availability_cache()
+
+    path = os.path.join(tmp_path, "cache", "availability.sqlite")
+    cache = AvailabilityCache(path=path)
+    set_availability_cache(cache)
+    get_availability_cache().put("url1", False)
+    cache.close()
+    assert AvailabilityCache(path=path).get("url1") is False
+
+    set_availability_cache(False)
+    assert get_availability_cache() is None
+    set_availability_cache(None)
+    assert len(get_availability_cache()) == 0
+
+
+def temporal_filter(start, stop, text="Arome"):
+    return [fes.And([
+        fes.PropertyIsLessThanOrEqualTo("apiso:TempExtent_begin", stop),
+        fes.PropertyIsGreaterThanOrEqualTo("apiso:TempExtent_end", start),
+        fes.PropertyIsLike("csw:AnyText", text),
+    ])]
+
+
+@pytest.mark.core
+def testQueryCache_key():
+    """ Test that the key depends on the endpoint, the search
+    parameters and the filter.
+    """
+    filter_list = temporal_filter("2024-04-06T00:00:00Z", "2024-04-07T00:00:00Z")
+    key = QueryCache.key("https://csw", filter_list, max_records=10)
+    assert key == QueryCache.key("https://csw", temporal_filter(
+        "2024-04-06T00:00:00Z", "2024-04-07T00:00:00Z"), max_records=10)
+    assert key != QueryCache.key("https://csw2", filter_list, max_records=10)
+    assert key != QueryCache.key("https://csw", filter_list, max_records=20)
+    assert key != QueryCache.key("https://csw", temporal_filter(
+        "2024-04-06T00:00:00Z", "2024-04-07T00:00:00Z", text="Meps"), max_records=10)
+
+
+@pytest.mark.core
+def testQueryCache_lru_and_ttl(monkeypatch):
+    """ Test eviction of the least recently used entries, and expiry,
+    with a longer time to live for closed time periods.
+    """
+    clock = [parse("2024-04-20T00:00:00Z").timestamp()]
+    monkeypatch.setattr("fadg.cache.time.time", lambda: clock[0])
+    cache = QueryCache(ttl=60, closed_ttl=None, max_entries=2)
+    recent = temporal_filter("2024-04-18T00:00:00Z", "2024-04-19T00:00:00Z")
+    closed = temporal_filter("2024-04-06T00:00:00Z", "2024-04-07T00:00:00Z")
+    assert cache.get_ttl(recent) == 60
+    assert cache.get_ttl(closed) is None
+    assert cache.get_ttl([]) == 60
+
+    cache.put("a", {"rec1": 1}, filter_list=recent)
+    cache.put("b", {"rec2": 2}, filter_list=closed)
+    records = cache.get("a")
+    assert records == {"rec1": 1}
+    # Copies are returned
+    records["rec3"] = 3
+    assert cache.get("a") == {"rec1": 1}
+    cache.put("c", {}, ttl=10)
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    assert cache.get("c") == {}
+
+    clock[0] += 30
+    assert cache.get("c") is None
+    assert cache.get("a") == {"rec1": 1}
+    clock[0] += 31
+    assert cache.get("a") is None
+
+    cache.put("b", {"rec2": 2}, filter_list=closed)
+    clock[0] += 365*86400
+    assert cache.get("b") == {"rec2": 2}
+    cache.clear()
+    assert len(cache) == 0
+
+
+@pytest.mark.core
+def testQueryCache_persistence(tmp_path):
+    """ Test that entries are stored on disk, and read back when they
+    are not in memory.
+    """
+    path = os.path.join(tmp_path, "queries.sqlite")
+    cache = QueryCache(path=path, max_entries=1)
+    cache.put("a", {"rec1": {"url": "https://t/1.nc"}}, endpoint="https://csw")
+    cache.put("b", {"rec2": {"url": "https://t/2.nc"}}, endpoint="https://csw")
+    assert len(cache) == 2
+    assert cache.get("a") == {"rec1": {"url": "https://t/1.nc"}}
+    cache.close()
+
+    cache = QueryCache(path=path)
+    assert cache.get("b") == {"rec2": {"url": "https://t/2.nc"}}
+    assert cache.get("missing") is None
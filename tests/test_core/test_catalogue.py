@@ -0,0 +1,309 @@
+"""
+Collocation : Catalogue module tests
+====================================
+
+Copyright 2024 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import pytest
+import datetime
+
+from types import SimpleNamespace
+
+from pytz import timezone
+from owslib import fes
+
+from tools import getRecordsResponse
+
+from fadg.csw import ISO_SCHEMA
+from fadg.csw import parse_getrecords_response
+from fadg.catalogue import Catalogue
+from fadg.catalogue import Harvester
+from fadg.find_and_collocate import SearchCSW
+
+URL = "https://thredds.met.no/thredds/dodsC"
+
+
+class MockCSW:
+    """ Local stand-in for a CSW service with 25 matching records.
+    """
+
+    requests = []
+
+    def __init__(self, *args, **kwargs):
+        return None
+
+    def getrecords2(self, constraints=None, startposition=1, maxrecords=10, **kwargs):
+        MockCSW.requests.append((startposition, maxrecords))
+        self.records, self.results = parse_getrecords_response(
+            getRecordsResponse(startposition, maxrecords, 25))
+
+
+class NoCSW:
+
+    def __init__(self, *args, **kwargs):
+        raise AssertionError("The CSW service should not be used")
+
+
+def harvested(monkeypatch, pagesize=10):
+    catalogue = Catalogue(path=":memory:")
+    MockCSW.requests = []
+    with monkeypatch.context() as mp:
+        mp.setattr("fadg.find_and_collocate.CatalogueServiceWeb", MockCSW)
+        harvester = Harvester(catalogue, pagesize=pagesize)
+        assert harvester.harvest()["records"] == 25
+    return catalogue, harvester
+
+
+@pytest.mark.core
+def testCatalogue_harvest(monkeypatch):
+    """ Test that all records are mirrored page by page.
+    """
+    catalogue, harvester = harvested(monkeypatch)
+    assert len(catalogue) == 25
+    assert MockCSW.requests == [(1, 10), (11, 20)]
+    assert harvester.request_count == 2
+
+    # Harvesting again updates the records
+    with monkeypatch.context() as mp:
+        mp.setattr("fadg.find_and_collocate.CatalogueServiceWeb", MockCSW)
+        assert harvester.harvest(max_records=5)["updated"] == 5
+    assert len(catalogue) == 25
+
+    catalogue.clear()
+    assert len(catalogue) == 0
+
+
+@pytest.mark.core
+def testCatalogue_search(monkeypatch):
+    """ Test answering SearchCSW filters from the catalogue.
+    """
+    catalogue, harvester = harvested(monkeypatch)
+    time = datetime.datetime(2024, 4, 6, 5, tzinfo=timezone("utc"))
+
+    ds = SearchCSW(time=time, dt=2, lazy=True)
+    records = catalogue.search(ds.filter_list)
+    assert sorted(records.keys()) == ["rec3", "rec4", "rec5", "rec6", "rec7"]
+    assert SearchCSW.get_odap_url(records["rec3"]) == "%s/rec3.nc" % URL
+    assert SearchCSW.get_record_time_coverage(records["rec3"])[0] == \
+        datetime.datetime(2024, 4, 6, 3, tzinfo=timezone("utc"))
+
+    # Records are selected by overlap to the second
+    ds = SearchCSW(time=time + datetime.timedelta(minutes=30), dt=0.25, lazy=True)
+    assert list(catalogue.search(ds.filter_list).keys()) == ["rec5"]
+
+    ds = SearchCSW(time=time, dt=48, text="Record 2", lazy=True)
+    records = catalogue.search(ds.filter_list)
+    assert sorted(records.keys()) == ["rec2"] + ["rec%d" % ii for ii in range(20, 26)]
+    assert len(catalogue.search(ds.filter_list, max_records=3)) == 3
+
+    ds = SearchCSW(time=time, dt=48, bbox=[10, 10, 20, 20], lazy=True)
+    assert len(catalogue.search(ds.filter_list)) == 0
+
+    ds = SearchCSW(time=time, dt=48, lazy=True)
+    assert len(catalogue.search(ds.filter_list + [fes.Or([
+        fes.PropertyIsEqualTo("dc:identifier", "rec1"),
+        fes.Not([fes.PropertyIsLike("dc:title", "Record _%")]),
+    ])])) == 1
+
+    # Queries the catalogue cannot answer
+    assert catalogue.search([fes.PropertyIsEqualTo("dc:identifier", "rec1")]) is None
+    assert catalogue.search(ds.filter_list + [fes.PropertyIsNull("dc:title")]) is None
+    assert catalogue.search([fes.PropertyIsEqualTo("dc:format", "NetCDF")]) is None
+    assert catalogue.search(ds.filter_list, outputschema=ISO_SCHEMA) is None
+    assert Catalogue(path=":memory:").search(ds.filter_list) is None
+
+
+@pytest.mark.core
+def testCatalogue_records_without_xml():
+    """ Test records that are not parsed from XML, and bounding box
+    queries.
+    """
+    catalogue = Catalogue(path=":memory:")
+    records = {}
+    for ii, lon in enumerate([0., 30.]):
+        records["rec%d" % ii] = SimpleNamespace(
+            identifier="rec%d" % ii, title="Record %d" % ii,
+            references=[{"scheme": "OPENDAP:OPENDAP", "url": "%s/rec%d.nc" % (URL, ii)}],
+            temporal="2024-04-06T10:00:00Z/2024-04-06T11:00:00Z",
+            bbox=SimpleNamespace(minx=lon, miny=58., maxx=lon + 5, maxy=65.))
+    records["date"] = SimpleNamespace(identifier="date", title="Date", references=[],
+                                      temporal="2024-04-06", bbox=None)
+    assert catalogue.upsert(records)["inserted"] == 3
+    catalogue.add_harvest(dict(dict.fromkeys(Catalogue.HARVEST_FIELDS), endpoint=URL,
+                               mode="full", started=datetime.datetime.now().timestamp()))
+
+    time = datetime.datetime(2024, 4, 6, 10, tzinfo=timezone("utc"))
+    ds = SearchCSW(time=time, dt=1, bbox=[-3, 58, 5, 65], lazy=True)
+    result = catalogue.search(ds.filter_list)
+    assert list(result.keys()) == ["rec0"]
+    assert SearchCSW.get_odap_url(result["rec0"]) == "%s/rec0.nc" % URL
+    assert SearchCSW.get_record_bbox(result["rec0"]) == [0., 58., 5., 65.]
+
+    # Records without bounding box do not match bbox searches
+    ds = SearchCSW(time=time, dt=24, lazy=True)
+    assert sorted(catalogue.search(ds.filter_list).keys()) == ["rec0", "rec1"]
+    before = fes.PropertyIsLessThanOrEqualTo("apiso:TempExtent_begin", "2024-04-07T00:00:00Z")
+    assert list(catalogue.search([fes.PropertyIsEqualTo("dc:identifier", "date"),
+                                  before])) == ["date"]
+
+    # Polygon searches are answered with an exact test of the bounding boxes
+    polygon = "POLYGON ((6 58, 10 58, 6 62, 6 58))"
+    ds = SearchCSW(time=time, dt=24, polygon=polygon, lazy=True)
+    assert catalogue.search(ds.filter_list) == {}
+    ds = SearchCSW(time=time, dt=24, polygon="POLYGON ((4 58, 10 58, 4 62, 4 58))", lazy=True)
+    assert list(catalogue.search(ds.filter_list).keys()) == ["rec0"]
+    ds = SearchCSW(time=time, dt=24, polygon="MULTIPOLYGON (((4 58, 10 58, 4 62, 4 58)), "
+                   "((31 60, 32 60, 32 61, 31 60)))", lazy=True)
+    assert list(catalogue.search(ds.filter_list).keys()) == ["rec0", "rec1"]
+    assert list(catalogue.search(ds.filter_list, max_records=1).keys()) == ["rec0"]
+    assert catalogue.search([fes.Not([ds.filter_list[0]])]) is None
+
+
+@pytest.mark.core
+def testCatalogue_coverage(monkeypatch):
+    """ Test that queries beyond the last full or incremental harvest
+    are left to the CSW service.
+    """
+    harvest_time = datetime.datetime(2024, 4, 6, 12, tzinfo=timezone("utc"))
+    catalogue = Catalogue(path=":memory:")
+    with monkeypatch.context() as mp:
+        mp.setattr("fadg.find_and_collocate.CatalogueServiceWeb", MockCSW)
+        mp.setattr("fadg.catalogue.time.time", lambda: harvest_time.timestamp())
+        harvester = Harvester(catalogue)
+
+        # Partial harvests do not cover any query
+        harvester.harvest(max_records=25)
+        assert catalogue.get_coverage() is None
+        ds = SearchCSW(time=harvest_time - datetime.timedelta(hours=6), dt=1, lazy=True)
+        assert catalogue.search(ds.filter_list) is None
+
+        harvester.harvest()
+    assert catalogue.get_coverage() == harvest_time.timestamp()
+    assert catalogue.get_coverage(endpoint="https://example.com") is None
+    assert len(catalogue.search(ds.filter_list)) == 3
+    assert catalogue.search(ds.filter_list, endpoint="https://example.com") is None
+
+    # The window of a scene after the harvest, or within the lag
+    ds = SearchCSW(time=harvest_time + datetime.timedelta(hours=10), dt=1, lazy=True)
+    assert catalogue.search(ds.filter_list) is None
+    ds = SearchCSW(time=harvest_time - datetime.timedelta(hours=1), dt=0.5, lazy=True)
+    assert catalogue.search(ds.filter_list) is None
+    catalogue.lag = 0
+    assert len(catalogue.search(ds.filter_list)) == 2
+
+    # The stale mirror falls back to the CSW service
+    MockCSW.requests = []
+    with monkeypatch.context() as mp:
+        mp.setattr("fadg.find_and_collocate.CatalogueServiceWeb", MockCSW)
+        ds = SearchCSW(time=harvest_time + datetime.timedelta(days=1), dt=1,
+                       catalogue=catalogue)
+    assert len(MockCSW.requests) > 0
+
+
+@pytest.mark.core
+def testSearchCSW_catalogue(monkeypatch):
+    """ Test that SearchCSW answers from the catalogue, and falls back
+    to the CSW service.
+    """
+    catalogue, harvester = harvested(monkeypatch)
+    time = datetime.datetime(2024, 4, 6, 5, tzinfo=timezone("utc"))
+    with monkeypatch.context() as mp:
+        mp.setattr("fadg.find_and_collocate.CatalogueServiceWeb", NoCSW)
+        ds = SearchCSW(time=time, dt=2, catalogue=catalogue)
+    assert len(ds.records) == 5
+    assert ds.request_count == 0
+
+    MockCSW.requests = []
+    with monkeypatch.context() as mp:
+        mp.setattr("fadg.find_and_collocate.CatalogueServiceWeb", MockCSW)
+        ds = SearchCSW(time=time, dt=2, catalogue=catalogue, outputschema=ISO_SCHEMA)
+    assert len(MockCSW.requests) > 0
+
+
+@pytest.mark.core
+def testHarvester_sync(monkeypatch):
+    """ Test that sync only requests records modified since the last
+    harvest, and records the harvest statistics.
+    """
+    class MockModifiedCSW:
+        """ Local stand-in for a CSW service that supports apiso:Modified
+        filters.
+        """
+
+        records = {}
+        filters = []
+
+        def __init__(self, *args, **kwargs):
+            return None
+
+        def getrecords2(self, constraints=None, startposition=1, maxrecords=10, **kwargs):
+            since = None
+            for constraint in constraints or []:
+                if getattr(constraint, "propertyname", None) == "apiso:Modified":
+                    since = constraint.literal
+            MockModifiedCSW.filters.append(since)
+            matching = [rec for rec in MockModifiedCSW.records.values()
+                        if since is None or rec.modified >= since]
+            page = matching[startposition - 1:startposition - 1 + maxrecords]
+            self.records = {rec.identifier: rec for rec in page}
+            nextrecord = startposition + len(page)
+            self.results = {"matches": len(matching), "returned": len(page),
+                            "nextrecord": nextrecord if nextrecord <= len(matching) else 0}
+
+    def record(ii, modified):
+        return SimpleNamespace(identifier="rec%d" % ii, title="Record %d" % ii,
+                               modified=modified, references=[], temporal=None, bbox=None)
+
+    MockModifiedCSW.records = {"rec%d" % ii: record(ii, "2024-04-0%dT10:00:00Z" % ii)
+                               for ii in range(1, 6)}
+    catalogue = Catalogue(path=":memory:")
+    harvester = Harvester(catalogue, pagesize=2)
+    with monkeypatch.context() as mp:
+        mp.setattr("fadg.find_and_collocate.CatalogueServiceWeb", MockModifiedCSW)
+
+        # The first sync harvests all records
+        stats = harvester.sync()
+        assert stats["mode"] == "full"
+        assert stats["inserted"] == 5
+        assert stats["requests"] == 2
+        assert MockModifiedCSW.filters == [None]*2
+        watermark = catalogue.get_watermark(harvester.endpoint)
+        assert watermark == datetime.datetime(2024, 4, 5, 10, tzinfo=timezone("utc")).timestamp()
+
+        # Only records modified since the watermark are requested
+        MockModifiedCSW.filters = []
+        MockModifiedCSW.records["rec2"] = record(2, "2024-04-06T10:00:00Z")
+        MockModifiedCSW.records["rec6"] = record(6, "2024-04-06T11:00:00Z")
+        stats = harvester.sync()
+        assert stats["mode"] == "incremental"
+        assert MockModifiedCSW.filters == ["2024-04-05T09:55:00Z"]*2
+        assert (stats["inserted"], stats["updated"], stats["records"]) == (1, 2, 3)
+        assert stats["requests"] == 2
+        assert len(catalogue) == 6
+
+        # Nothing new
+        harvester.sync(overlap=0)
+        assert catalogue.get_harvests(limit=1)[0]["records"] == 1
+
+        # Partial harvests do not move the watermark
+        watermark = catalogue.get_watermark(harvester.endpoint)
+        MockModifiedCSW.records["rec7"] = record(7, "2024-04-08T10:00:00Z")
+        stats = harvester.harvest(max_records=10)
+        assert stats["mode"] == "partial"
+        assert catalogue.get_watermark(harvester.endpoint) == watermark
+
+    harvests = catalogue.get_harvests(endpoint=harvester.endpoint)
+    assert [hh["mode"] for hh in harvests] == ["partial", "incremental", "incremental", "full"]
+    assert catalogue.get_harvests(endpoint="https://example.com") == []
@@ -19,11 +19,18 @@ limitations under the License.
 import pytest
 import logging
 import datetime
+import requests
+import threading
 
+from types import SimpleNamespace
 from pytz import timezone
+from owslib.etree import etree
 from unittest.mock import Mock
 from dateutil.parser import parse
 
+from tools import getRecordsResponse
+from tools import MockCatalogSession
+
 from fadg.find_and_collocate import SearchCSW
 from fadg.find_and_collocate import Collocate
 from fadg.find_and_collocate import METNordic
@@ -31,6 +38,14 @@ from fadg.find_and_collocate import NorKyst800
 from fadg.find_and_collocate import AromeArctic
 from fadg.find_and_collocate import Meps
 from fadg.find_and_collocate import WeatherForecast
+from fadg.cache import MetadataCache
+from fadg.cache import QueryCache
+from fadg.cache import get_availability_cache
+from fadg.cache import set_availability_cache
+from fadg.csw import CapabilitiesCache
+from fadg.csw import SLIM_ELEMENTS
+from fadg.csw import parse_getrecords_response
+from fadg.policy import DeadlineExceeded
 
 
 refs = [
@@ -75,11 +90,40 @@ class MockCSW:
             "rec1": rec1,
             "rec2": rec2,
         }
-        # Force while loop to continue until
-        # start_position >= max_records:
+        # A nextrecord that does not advance stops the paging
         self.results = {"nextrecord": 1}
 
 
+class MockPagedCSW:
+    """ Local stand-in for a CSW service with 25 matching records,
+    which are served by 1-based startposition and maxrecords.
+    """
+
+    matches = 25
+    requests = []
+    cap = None
+
+    def __init__(self, *args, **kwargs):
+        return None
+
+    def getrecords2(self, *args, startposition=0, maxrecords=10, **kwargs):
+        MockPagedCSW.requests.append((startposition, maxrecords))
+        if MockPagedCSW.cap is not None:
+            maxrecords = min(maxrecords, MockPagedCSW.cap)
+        self.records = {}
+        stop = min(startposition + maxrecords - 1, MockPagedCSW.matches)
+        for ii in range(max(startposition, 1), stop + 1):
+            rec = MockRecord()
+            rec.references = refs
+            self.records["rec%d" % ii] = rec
+        nextrecord = stop + 1 if stop < MockPagedCSW.matches else 0
+        self.results = {
+            "matches": MockPagedCSW.matches,
+            "returned": len(self.records),
+            "nextrecord": nextrecord,
+        }
+
+
 class MockNcDataset:
 
     # S1B_IW_RAW__0SDV_20190107T171737_20190107T171810_014391_01AC8B_78F4.zip
@@ -93,6 +137,9 @@ class MockNcDataset:
     def __init__(self, *args, **kwargs):
         return None
 
+    def close(self):
+        return None
+
 
 class MockNcDataset2:
 
@@ -105,6 +152,9 @@ class MockNcDataset2:
     def __init__(self, *args, **kwargs):
         return None
 
+    def close(self):
+        return None
+
 
 class MockDataset1:
 
@@ -187,6 +237,36 @@ def testSearchCSW_Init_offline(monkeypatch):
         assert len(ds.urls) == 1
 
 
+@pytest.mark.core
+def testSearchCSW_iter_records(monkeypatch):
+    """ Test that records and urls are yielded page by page without
+    executing the search on initialisation.
+    """
+    with monkeypatch.context() as mp:
+        mp.setattr("fadg.find_and_collocate.CatalogueServiceWeb", MockPagedCSW)
+        MockPagedCSW.requests = []
+        ds = SearchCSW(text="Arome", lazy=True, pagesize=5)
+        assert ds.records is None
+        assert ds.urls is None
+        assert MockPagedCSW.requests == []
+
+        records = ds.iter_records()
+        key, record = next(records)
+        assert key == "rec1"
+        assert MockPagedCSW.requests == [(1, 5)]
+        keys = [key] + [kk for kk, rr in records]
+        assert keys == ["rec%d" % ii for ii in range(1, 26)]
+        assert len(MockPagedCSW.requests) == 3
+
+        urls = list(ds.iter_odap_urls())
+        assert len(urls) == 25
+        assert urls[0] == refs[0]["url"]
+
+        # Concurrent pages
+        ds = SearchCSW(lazy=True, pagesize=10, workers=4)
+        assert len(list(ds.iter_records())) == 25
+
+
 @pytest.mark.core
 def testCollocate__execute(s1filename, monkeypatch):
     """ Test that the csw connection is called, and that the function
@@ -200,6 +280,319 @@ def testCollocate__execute(s1filename, monkeypatch):
         assert records["rec1"].references == refs
 
 
+@pytest.mark.core
+def testCollocate__execute_parallel(s1filename, monkeypatch):
+    """ Test that pages are fetched concurrently after the first page,
+    and merged into one dict.
+    """
+    with monkeypatch.context() as mp:
+        mp.setattr("fadg.find_and_collocate.CatalogueServiceWeb", MockPagedCSW)
+        mp.setattr("fadg.find_and_collocate.netCDF4.Dataset", MockNcDataset)
+        ds = Collocate(s1filename)
+
+        MockPagedCSW.requests = []
+        records = ds._execute([], pagesize=10, workers=4)
+        assert list(records.keys()) == ["rec%d" % ii for ii in range(1, 26)]
+        assert sorted(MockPagedCSW.requests) == [(1, 10), (11, 10), (21, 5)]
+
+        # Limited by max_records
+        MockPagedCSW.requests = []
+        records = ds._execute([], pagesize=10, max_records=15, workers=4)
+        assert len(records) == 15
+        assert sorted(MockPagedCSW.requests) == [(1, 10), (11, 5)]
+
+        # Only one page
+        MockPagedCSW.requests = []
+        records = ds._execute([], pagesize=30, workers=4)
+        assert len(records) == 25
+        assert MockPagedCSW.requests == [(1, 30)]
+
+    # The service caps the page size
+    class CappedCSW(MockPagedCSW):
+        def getrecords2(self, *args, startposition=0, maxrecords=10, **kwargs):
+            if startposition > 1:
+                maxrecords = min(maxrecords, 3)
+            super().getrecords2(*args, startposition=startposition, maxrecords=maxrecords,
+                                **kwargs)
+
+    with monkeypatch.context() as mp:
+        mp.setattr("fadg.find_and_collocate.CatalogueServiceWeb", MockPagedCSW)
+        mp.setattr("fadg.find_and_collocate.netCDF4.Dataset", MockNcDataset)
+        ds = Collocate(s1filename)
+        MockPagedCSW.requests = []
+        MockPagedCSW.matches, MockPagedCSW.cap = 50, 5
+        try:
+            records = ds._execute([], pagesize=10, workers=4)
+        finally:
+            MockPagedCSW.matches, MockPagedCSW.cap = 25, None
+        assert sorted(records.keys()) == sorted("rec%d" % ii for ii in range(1, 51))
+        assert sorted(MockPagedCSW.requests) == [(1, 10)] + [(ii, 5) for ii in range(6, 51, 5)]
+        assert ds.request_count == 10
+
+        # Windows that are not returned in full are completed
+        mp.setattr("fadg.find_and_collocate.CatalogueServiceWeb", CappedCSW)
+        MockPagedCSW.requests = []
+        records = ds._execute([], pagesize=10, workers=4)
+        assert list(records.keys()) == ["rec%d" % ii for ii in range(1, 26)]
+        assert sorted(MockPagedCSW.requests) == [(1, 10), (11, 3), (14, 3), (17, 3), (20, 1),
+                                                 (21, 3), (24, 2)]
+        assert ds.request_count == 7
+
+
+@pytest.mark.core
+def testCollocate__execute_paging(s1filename, monkeypatch):
+    """ Test that the page size grows, that paging stops when the
+    matched records are exhausted, and that the number of requests is
+    counted.
+    """
+    class Constraint:
+        values = ["8"]
+
+    with monkeypatch.context() as mp:
+        mp.setattr("fadg.find_and_collocate.CatalogueServiceWeb", MockPagedCSW)
+        mp.setattr("fadg.find_and_collocate.netCDF4.Dataset", MockNcDataset)
+        ds = Collocate(s1filename)
+
+        MockPagedCSW.requests = []
+        records = ds._execute([], pagesize=5)
+        assert list(records.keys()) == ["rec%d" % ii for ii in range(1, 26)]
+        assert MockPagedCSW.requests == [(1, 5), (6, 10), (16, 20)]
+        assert ds.request_count == 3
+
+        # Limited by max_records
+        MockPagedCSW.requests = []
+        records = ds._execute([], pagesize=5, max_records=12)
+        assert len(records) == 12
+        assert MockPagedCSW.requests == [(1, 5), (6, 7)]
+
+        # Limited by the configured maximum page size
+        MockPagedCSW.requests = []
+        records = ds._execute([], pagesize=5, max_pagesize=5)
+        assert len(records) == 25
+        assert ds.request_count == 5
+
+        # Limited by the page size advertised by the service
+        MockPagedCSW.requests = []
+        MockPagedCSW.constraints = {"MaxRecordDefault": Constraint()}
+        records = ds._execute([], pagesize=5)
+        del MockPagedCSW.constraints
+        assert len(records) == 25
+        assert MockPagedCSW.requests == [(1, 5), (6, 8), (14, 8), (22, 8)]
+
+        # The service silently caps the page size
+        MockPagedCSW.requests = []
+        MockPagedCSW.cap = 4
+        records = ds._execute([], pagesize=5)
+        MockPagedCSW.cap = None
+        assert len(records) == 25
+        assert MockPagedCSW.requests[:3] == [(1, 5), (5, 4), (9, 4)]
+        assert ds.request_count == 7
+
+
+@pytest.mark.core
+def testCollocate__execute_pooled(s1filename, monkeypatch):
+    """ Test that pooled searches share one session and only request
+    the capabilities once per endpoint.
+    """
+    class Capabilities:
+        calls = 0
+
+        def __init__(self, *args, **kwargs):
+            Capabilities.calls += 1
+            self.constraints = {}
+
+    class Response:
+        def __init__(self, content):
+            self.content = content
+
+        def raise_for_status(self):
+            return None
+
+    class Session:
+        posts = []
+
+        def post(self, url, data=None, **kwargs):
+            Session.posts.append(url)
+            return Response(getRecordsResponse(1, 10, 2))
+
+    with monkeypatch.context() as mp:
+        mp.setattr("fadg.find_and_collocate.netCDF4.Dataset", MockNcDataset)
+        mp.setattr("fadg.csw.CatalogueServiceWeb", Capabilities)
+        mp.setattr("fadg.csw.get_session", lambda: Session())
+        mp.setattr("fadg.csw.CAPABILITIES", CapabilitiesCache())
+        records = Collocate(s1filename).get_collocations(pooled=True)
+        assert sorted(records.keys()) == ["rec1", "rec2"]
+        records = Meps(s1filename).get_collocations(pooled=True)
+        assert len(records) == 2
+        records = Collocate(s1filename).get_collocations(pooled=True, workers=4)
+        assert len(records) == 2
+        assert Capabilities.calls == 1
+        assert Session.posts == ["https://data.csw.met.no"]*3
+
+
+@pytest.mark.core
+def testSearchCSW_elements(monkeypatch):
+    """ Test that only the given elements are requested, through both
+    owslib and pooled connections.
+    """
+    class MockXmlCSW:
+        requests = []
+
+        def __init__(self, *args, **kwargs):
+            return None
+
+        def getrecords2(self, xml=None, startposition=1, maxrecords=10, **kwargs):
+            MockXmlCSW.requests.append(xml)
+            self.records, self.results = parse_getrecords_response(
+                getRecordsResponse(startposition, maxrecords, 3))
+
+    class Session:
+        posts = []
+
+        def post(self, url, data=None, **kwargs):
+            Session.posts.append(data)
+            return SimpleNamespace(content=getRecordsResponse(1, 10, 3),
+                                   raise_for_status=lambda: None)
+
+    def element_names(xml):
+        return [elem.text for elem in etree.fromstring(xml).iter(
+            "{http://www.opengis.net/cat/csw/2.0.2}ElementName")]
+
+    time = datetime.datetime(2024, 4, 6, 5, tzinfo=timezone("utc"))
+    cache = QueryCache()
+    with monkeypatch.context() as mp:
+        mp.setattr("fadg.find_and_collocate.CatalogueServiceWeb", MockXmlCSW)
+        mp.setattr("fadg.csw.CatalogueServiceWeb", lambda *args, **kwargs: None)
+        mp.setattr("fadg.csw.get_session", lambda: Session())
+        mp.setattr("fadg.csw.CAPABILITIES", CapabilitiesCache())
+        ds = SearchCSW(time=time, text="Arome", query_cache=cache)
+        assert MockXmlCSW.requests == [None]
+        assert len(ds.records) == 3
+
+        ds = SearchCSW(time=time, text="Arome", elements=SLIM_ELEMENTS, query_cache=cache)
+        assert element_names(MockXmlCSW.requests[1]) == SLIM_ELEMENTS
+        assert ds.records["rec2"].temporal == "2024-04-06T02:00:00Z/2024-04-06T02:59:59Z"
+        assert SearchCSW.get_odap_url(ds.records["rec2"]).endswith("rec2.nc")
+        assert len(cache) == 2
+
+        SearchCSW(time=time, text="Arome", elements=SLIM_ELEMENTS, pooled=True)
+        assert element_names(Session.posts[0]) == SLIM_ELEMENTS
+
+        with pytest.raises(ValueError):
+            SearchCSW(time=time, text="Arome", elements=SLIM_ELEMENTS,
+                      outputschema=SearchCSW.ISO_SCHEMA)
+
+
+@pytest.mark.core
+def testSearchCSW_federated(monkeypatch):
+    """ Test that several CSW endpoints are searched concurrently, that
+    the records are deduplicated, and that slow or failing endpoints
+    give partial results.
+    """
+    release = threading.Event()
+
+    def record(url):
+        rec = MockRecord()
+        rec.references = [{"scheme": "OPENDAP:OPENDAP", "url": url}]
+        return rec
+
+    class MockFederatedCSW:
+
+        catalogues = {
+            "https://a": {"rec1": "https://t/1.nc", "rec2": "https://t/2.nc"},
+            "https://b": {"rec2": "https://t/2.nc", "copy1": "https://t/1.nc",
+                          "rec4": "https://t/4.nc"},
+            "https://slow": {"rec5": "https://t/5.nc"},
+        }
+
+        def __init__(self, endpoint, *args, **kwargs):
+            self.endpoint = endpoint
+
+        def getrecords2(self, *args, **kwargs):
+            if self.endpoint == "https://broken":
+                raise requests.ConnectionError("Connection refused")
+            if self.endpoint == "https://slow":
+                release.wait(5)
+            self.records = {key: record(url)
+                            for key, url in self.catalogues[self.endpoint].items()}
+            self.results = {"matches": len(self.records), "nextrecord": 0}
+
+    time = datetime.datetime(2024, 4, 6, 5, tzinfo=timezone("utc"))
+    with monkeypatch.context() as mp:
+        mp.setattr("fadg.find_and_collocate.CatalogueServiceWeb", MockFederatedCSW)
+        ds = SearchCSW(time=time, endpoint=["https://a", "https://b"])
+        assert sorted(ds.records.keys()) == ["rec1", "rec2", "rec4"]
+        assert ds.request_count == 2
+        assert ds.endpoint_status == {"https://a": "ok", "https://b": "ok"}
+
+        ds = SearchCSW(time=time, endpoint=["https://b", "https://a"])
+        assert sorted(ds.records.keys()) == ["copy1", "rec2", "rec4"]
+
+        # Partial results
+        ds = SearchCSW(time=time, endpoint=["https://slow", "https://broken", "https://a"],
+                       endpoint_timeout={"https://slow": 0.05})
+        release.set()
+        assert sorted(ds.records.keys()) == ["rec1", "rec2"]
+        assert ds.endpoint_status["https://slow"] == "timeout"
+        assert isinstance(ds.endpoint_status["https://broken"], requests.ConnectionError)
+        assert ds.request_count == 1
+
+        release.clear()
+        with pytest.raises(DeadlineExceeded):
+            SearchCSW(time=time, endpoint=["https://slow"], endpoint_timeout=0.05)
+        release.set()
+        with pytest.raises(requests.ConnectionError):
+            SearchCSW(time=time, endpoint=["https://broken"])
+
+        ds = SearchCSW(time=time, endpoint=["https://a", "https://b"], lazy=True)
+        assert [key for key, rec in ds.iter_records()] == ["rec1", "rec2", "rec4"]
+
+
+@pytest.mark.core
+def testSearchCSW_query_cache(s1filename, monkeypatch):
+    """ Test that repeated searches are answered from the query cache.
+    """
+    cache = QueryCache()
+    time = datetime.datetime(2024, 4, 6, 5, tzinfo=timezone("utc"))
+    with monkeypatch.context() as mp:
+        mp.setattr("fadg.find_and_collocate.CatalogueServiceWeb", MockPagedCSW)
+        mp.setattr("fadg.find_and_collocate.netCDF4.Dataset", MockNcDataset)
+        MockPagedCSW.requests = []
+        ds = SearchCSW(time=time, text="Arome", query_cache=cache)
+        count = len(MockPagedCSW.requests)
+        assert len(ds.records) == 25
+        assert ds.request_count == count
+
+        ds = SearchCSW(time=time, text="Arome", query_cache=cache)
+        assert len(ds.records) == 25
+        assert ds.request_count == 0
+        assert len(MockPagedCSW.requests) == count
+
+        # Other searches are sent
+        SearchCSW(time=time, text="Arome", max_records=5, query_cache=cache)
+        SearchCSW(time=time, text="Meps", query_cache=cache)
+        SearchCSW(time=time, text="Arome", endpoint="https://csw", query_cache=cache)
+        assert len(cache) == 4
+
+        # Lazy searches use the cache too
+        MockPagedCSW.requests = []
+        ds = SearchCSW(time=time, text="Arome", lazy=True, query_cache=cache)
+        assert len(list(ds.iter_records())) == 25
+        assert MockPagedCSW.requests == []
+        ds = SearchCSW(time=time, text="Norkyst", lazy=True, query_cache=cache)
+        assert len(list(ds.iter_records())) == 25
+        count = len(MockPagedCSW.requests)
+        assert len(list(ds.iter_odap_urls())) == 25
+        assert len(MockPagedCSW.requests) == count
+        assert len(cache) == 5
+
+        coll = Collocate(s1filename)
+        records = coll.get_collocations(query_cache=cache)
+        count = len(MockPagedCSW.requests)
+        assert coll.get_collocations(query_cache=cache) == records
+        assert len(MockPagedCSW.requests) == count
+
+
 @pytest.mark.core
 def testCollocate__set_dataset_date(s1filename, monkeypatch):
     """ Test setting the time
@@ -235,10 +628,8 @@ def testCollocate_get_odap_url_of_nearest(s1filename, csw_records, monkeypatch):
         smock = SelectMock()
         smock.side_effect = [
             MockNcDataset(),  # Init Collocate
-            MockDataset1(),    # assert_available
-            MockDataset1(),    # get_time_coverage
-            MockDataset2(),   # assert_available
-            MockDataset2()    # get_time_coverage
+            MockDataset1(),   # probe
+            MockDataset2(),   # probe
         ]
         mp.setattr("fadg.find_and_collocate.netCDF4.Dataset", smock)
         mp.setattr("fadg.find_and_collocate.CatalogueServiceWeb", MockCSW)
@@ -298,6 +689,52 @@ def testCollocate_Init(s1filename, monkeypatch):
         assert coll.time == tt
 
 
+@pytest.mark.core
+def testCollocate_lazy(s1filename, monkeypatch):
+    """ Test that the dataset is opened once, on first access, and
+    closed, and not opened at all if time and bbox are given.
+    """
+    opened = []
+
+    class ClosingDataset(MockNcDataset):
+
+        def __init__(self, *args, **kwargs):
+            self.closed = False
+            opened.append(self)
+
+        def close(self):
+            self.closed = True
+
+    tt = datetime.datetime(2019, 1, 7, 17, 17, 37, tzinfo=timezone("utc"))
+    with monkeypatch.context() as mp:
+        mp.setattr("fadg.find_and_collocate.netCDF4.Dataset", ClosingDataset)
+        coll = Collocate(s1filename)
+        assert opened == []
+        assert coll.bbox == [-3., 58., 5., 65.]
+        assert coll.time == tt
+        assert coll.bboxes == [[-3., 58., 5., 65.]]
+        assert coll.polygon is None
+        assert len(opened) == 1
+        assert opened[0].closed
+
+        # Given values are kept, and only the missing ones are read
+        coll = Collocate(s1filename, bbox=[0, 60, 10, 70])
+        assert coll.bbox == [0., 60., 10., 70.]
+        assert len(opened) == 1
+        assert coll.time == tt
+        assert coll.bbox == [0., 60., 10., 70.]
+        assert len(opened) == 2
+
+        mp.setattr("fadg.find_and_collocate.netCDF4.Dataset", Fail)
+        coll = Meps(s1filename, tt, bbox=[0, 60, 10, 70])
+        assert coll.time == tt
+        assert coll.bboxes == [[0., 60., 10., 70.]]
+
+        coll = Collocate(s1filename)
+        with pytest.raises(OSError):
+            coll.time
+
+
 @pytest.mark.core
 def testCollocate_assert_available(monkeypatch):
     """ Test that assert_available raises error if a dataset is not
@@ -344,6 +781,51 @@ def testCollocate_search_functions(s1filename, monkeypatch):
         assert start.toXML().getchildren()[1].text == "2019-01-08 17:17:37"
 
 
+@pytest.mark.core
+def testSearchCSW_temporal_overlap(monkeypatch):
+    """ Test that searches use the overlap filter if the CSW service
+    supports TempExtent_end, and the begin date filter otherwise.
+    """
+    class Operation:
+        constraints = [SimpleNamespace(name="SupportedISOQueryables",
+                                       values=["apiso:TempExtent_begin", "apiso:TempExtent_end"])]
+
+    class MockQueryablesCSW(MockCSW):
+
+        queryables = True
+        filters = []
+
+        def get_operation_by_name(self, name):
+            if not MockQueryablesCSW.queryables:
+                raise KeyError(name)
+            return Operation()
+
+        def getrecords2(self, constraints=None, **kwargs):
+            MockQueryablesCSW.filters.append(constraints)
+            super().getrecords2(**kwargs)
+
+    def properties(filter_list):
+        return [(op.propertyname, op.literal) for op in filter_list[0].operations[:2]]
+
+    time = timezone("Europe/Oslo").localize(datetime.datetime(2024, 4, 6, 7, 30))
+    ds = SearchCSW(time=time, dt=0.5, lazy=True)
+    assert properties(ds.filter_list) == [("apiso:TempExtent_begin", "2024-04-06T06:00:00Z"),
+                                          ("apiso:TempExtent_end", "2024-04-06T05:00:00Z")]
+    legacy = SearchCSW._adapt_temporal_filter(ds.filter_list, None)
+    assert properties(legacy) == [("apiso:TempExtent_begin", "2024-04-06T06:00:00Z"),
+                                  ("apiso:TempExtent_begin", "2024-04-06T05:00:00Z")]
+    # The original filter is not modified
+    assert ds.filter_list[0].operations[1].propertyname == "apiso:TempExtent_end"
+
+    with monkeypatch.context() as mp:
+        mp.setattr("fadg.find_and_collocate.CatalogueServiceWeb", MockQueryablesCSW)
+        SearchCSW(time=time, dt=0.5)
+        MockQueryablesCSW.queryables = False
+        SearchCSW(time=time, dt=0.5)
+    assert [properties(filters)[1][0] for filters in MockQueryablesCSW.filters] == \
+        ["apiso:TempExtent_end", "apiso:TempExtent_begin"]
+
+
 @pytest.mark.core
 def testCollocate_get_odap_url(csw_record):
     """ Test that the opendap url is returned.
@@ -366,6 +848,28 @@ def testCollocate_get_time_coverage(csw_record, monkeypatch):
         assert start == parse("2024-04-06T10:00:00Z")
         assert end == parse("2024-04-06T10:02:00Z")
 
+    # The dataset is opened once, and closed, with a cache
+    opened = []
+    closed = []
+
+    class Dataset(MockDataset1):
+        def __init__(self, url):
+            super().__init__()
+            opened.append(url)
+
+        def close(self):
+            closed.append(True)
+
+    cache = MetadataCache(path=":memory:")
+    with monkeypatch.context() as mp:
+        mp.setattr("fadg.find_and_collocate.netCDF4.Dataset", Dataset)
+        for ii in range(2):
+            start, end = Collocate.get_time_coverage("file.nc", cache=cache)
+            assert end == parse("2024-04-06T10:02:00Z")
+        assert opened == ["file.nc"]
+        assert closed == [True]
+        assert cache.get("file.nc")["time_coverage_start"] == start
+
 
 @pytest.mark.core
 def testCollocate_get_nearest_collocation_by_time(s1filename, csw_records, csw_4_records,
@@ -383,95 +887,581 @@ def testCollocate_get_nearest_collocation_by_time(s1filename, csw_records, csw_4
             # Init Collocate
             MockNcDataset(),
             # Test get_nearest_collocation_by_time_coverage_start
-            MockDataset1(),    # assert_available
-            MockDataset1(),    # get_time_coverage
-            MockDataset2(),   # assert_available
-            MockDataset2(),   # get_time_coverage
+            MockDataset1(),   # probe
+            MockDataset2(),   # probe
             # Test get_nearest_collocation_by_time_coverage_end
-            MockDataset1(),    # assert_available
-            MockDataset1(),    # get_time_coverage
-            MockDataset2(),   # assert_available
-            MockDataset2(),   # get_time_coverage
+            MockDataset1(),   # probe
+            MockDataset2(),   # probe
             # Test failing _get_nearest_by_time(csw_records, 0, rel=1)
-            MockDataset1(),    # assert_available
-            MockDataset1(),    # get_time_coverage
-            MockDataset2(),   # assert_available
-            MockDataset2(),   # get_time_coverage
+            MockDataset1(),   # probe
+            MockDataset2(),   # probe
             # Test failing _get_nearest_by_time(csw_records, 0, rel=2)
-            MockDataset3(),    # assert_available
-            MockDataset3(),    # get_time_coverage
-            MockDataset4(),   # assert_available
-            MockDataset4(),   # get_time_coverage
+            MockDataset3(),   # probe
+            MockDataset4(),   # probe
             # Test _get_nearest_by_time(csw_4_records, 0, rel=1)
-            MockDataset1(),    # assert_available
-            MockDataset1(),    # get_time_coverage
-            MockDataset2(),   # assert_available
-            MockDataset2(),   # get_time_coverage
-            MockDataset3(),    # assert_available
-            MockDataset3(),    # get_time_coverage
-            MockDataset4(),   # assert_available
-            MockDataset4(),   # get_time_coverage
+            MockDataset1(),   # probe
+            MockDataset2(),   # probe
+            MockDataset3(),   # probe
+            MockDataset4(),   # probe
             # Test _get_nearest_by_time(csw_4_records, 0, rel=2)
-            MockDataset1(),    # assert_available
-            MockDataset1(),    # get_time_coverage
-            MockDataset2(),   # assert_available
-            MockDataset2(),   # get_time_coverage
-            MockDataset3(),    # assert_available
-            MockDataset3(),    # get_time_coverage
-            MockDataset4(),   # assert_available
-            MockDataset4(),   # get_time_coverage
+            MockDataset1(),   # probe
+            MockDataset2(),   # probe
+            MockDataset3(),   # probe
+            MockDataset4(),   # probe
             # Test coll._get_nearest_by_time(csw_records, 0, rel=4)
-            MockDataset1(),    # assert_available
-            MockDataset1(),    # get_time_coverage
-            MockDataset2(),   # assert_available
-            MockDataset2(),   # get_time_coverage
+            MockDataset1(),   # probe
+            MockDataset2(),   # probe
             # Init Collocate for testing _get_nearest_by_time
             MockNcDataset(),
         ]
         mp.setattr("fadg.find_and_collocate.netCDF4.Dataset", smock)
         mp.setattr("fadg.find_and_collocate.CatalogueServiceWeb", MockCSW)
-        # Init Collocate
+        # Init Collocate, the dataset is opened on first access
         coll = Collocate(s1filename)
-        # assert_available and get_time_coverage
-        tt = coll.get_nearest_collocation_by_time_coverage_start(csw_records)
+        assert coll.time.year == 2019
+        # Probe sequentially to keep the order of the mocked datasets
+        tt = coll.get_nearest_collocation_by_time_coverage_start(csw_records, workers=1)
         assert tt == csw_records["rec1"]
-        # assert_available and get_time_coverage
-        tt = coll.get_nearest_collocation_by_time_coverage_end(csw_records)
+        tt = coll.get_nearest_collocation_by_time_coverage_end(csw_records, workers=1)
         assert tt == csw_records["rec1"]
         with pytest.raises(ValueError) as ee:
-            # assert_available and get_time_coverage
             tt = coll.get_nearest_collocation_by_time_coverage_end({})
         assert str(ee.value) == "Input records dict is empty."
 
         with pytest.raises(ValueError) as ee:
-            rec = coll._get_nearest_by_time(csw_records, 0, rel=1)
+            rec = coll._get_nearest_by_time(csw_records, 0, rel=1, workers=1)
         assert "No available datasets before" in str(ee.value)
         with pytest.raises(ValueError) as ee:
-            rec = coll._get_nearest_by_time(csw_records, 0, rel=2)
+            rec = coll._get_nearest_by_time(csw_records, 0, rel=2, workers=1)
         assert "No available datasets after" in str(ee.value)
-        rec = coll._get_nearest_by_time(csw_4_records, 0, rel=1)
+        rec = coll._get_nearest_by_time(csw_4_records, 0, rel=1, workers=1)
         assert rec.time_coverage_start == "2019-01-07T10:00:00Z"
-        rec = coll._get_nearest_by_time(csw_4_records, 0, rel=2)
+        rec = coll._get_nearest_by_time(csw_4_records, 0, rel=2, workers=1)
         assert rec.time_coverage_start == "2024-04-06T10:00:00Z"
 
         with pytest.raises(ValueError) as ee:
-            coll._get_nearest_by_time(csw_records, 0, rel=4)
+            coll._get_nearest_by_time(csw_records, 0, rel=4, workers=1)
         assert "rel must be 0, 1 or 2" == str(ee.value)
 
-        def raiseVErr():
-            raise ValueError("TEST")
-
         # Test _get_nearest_by_time fails when urls (in csw_records)
         # are invalid
         # Init Collocate
         coll = Collocate(s1filename)
-        mp.setattr("fadg.find_and_collocate.Collocate.assert_available",
-                   lambda *a, **k: raiseVErr())
+        assert coll.time.year == 2019
+        mp.setattr("fadg.find_and_collocate.netCDF4.Dataset", Fail)
         with pytest.raises(ValueError) as ee:
             recs = coll._get_nearest_by_time(csw_records, 0)
             assert recs == []
         assert "No available datasets" in str(ee.value)
-        assert "TEST" in caplog.text
+        assert "is not available" in caplog.text
+
+
+@pytest.mark.core
+def testCollocate_probe(monkeypatch):
+    """ Test that probe opens the dataset once and returns its
+    availability and time coverage.
+    """
+    class SelectMock(Mock):
+        pass
+
+    with monkeypatch.context() as mp:
+        smock = SelectMock()
+        smock.side_effect = [MockDataset1()]
+        mp.setattr("fadg.find_and_collocate.netCDF4.Dataset", smock)
+        metadata = Collocate.probe("url1")
+        assert smock.call_count == 1
+        assert metadata["url"] == "url1"
+        assert metadata["available"] is True
+        assert metadata["time_coverage_start"] == parse("2024-04-06T10:00:00Z")
+        assert metadata["time_coverage_end"] == parse("2024-04-06T10:02:00Z")
+
+    with monkeypatch.context() as mp:
+        mp.setattr("fadg.find_and_collocate.netCDF4.Dataset", Fail)
+        metadata = Collocate.probe("url1")
+        assert metadata["available"] is False
+        assert metadata["time_coverage_start"] is None
+
+
+@pytest.mark.core
+def testCollocate_probe_many(monkeypatch):
+    """ Test that probe_many returns results in input order, both
+    sequentially and in a thread pool.
+    """
+    datasets = {
+        "url1": MockDataset1,
+        "url2": MockDataset2,
+        "url3": MockDataset3,
+    }
+    opening = []
+    overlaps = []
+
+    def dataset(url):
+        opening.append(url)
+        overlaps.append(len(opening))
+        threading.Event().wait(0.01)
+        opening.remove(url)
+        return datasets[url.split("/")[-1]]()
+
+    with monkeypatch.context() as mp:
+        mp.setattr("fadg.find_and_collocate.netCDF4.Dataset", dataset)
+        urls = ["url1", "url2", "url3"]
+        for workers in [1, 3, 8]:
+            probes = Collocate.probe_many(urls, workers=workers)
+            assert [pp["url"] for pp in probes] == urls
+            assert probes[1]["time_coverage_start"] == parse("2024-04-07T10:00:00Z")
+
+        # netCDF4 opens are not made concurrently in threads
+        overlaps.clear()
+        probes = Collocate.probe_many(urls)
+        assert [pp["url"] for pp in probes] == urls
+        assert overlaps == [1, 1, 1]
+
+        # Nor as fallback of DAS requests made in threads
+        mp.setattr("fadg.find_and_collocate.dap.fetch_global_attributes",
+                   Mock(side_effect=requests.ConnectionError))
+        overlaps.clear()
+        probes = Collocate.probe_many(urls + ["https://server/url2"], reader="das")
+        assert overlaps == [1, 1, 1, 1]
+        assert probes[3]["time_coverage_start"] == parse("2024-04-07T10:00:00Z")
+        assert Collocate.probe_many([]) == []
+        with pytest.raises(ValueError) as ee:
+            Collocate.probe_many(urls, workers=0)
+        assert str(ee.value) == "workers must be a positive integer"
+
+
+@pytest.mark.core
+def testCollocate_availability_cache(monkeypatch):
+    """ Test that known missing datasets are not opened again, and
+    that known available datasets are not checked again.
+    """
+    opened = []
+
+    def dataset(url):
+        opened.append(url)
+        if url == "missing":
+            raise OSError("Not found")
+        return MockDataset1()
+
+    with monkeypatch.context() as mp:
+        mp.setattr("fadg.find_and_collocate.netCDF4.Dataset", dataset)
+        for workers in [1, 2]:
+            probes = Collocate.probe_many(["missing", "url1"], workers=workers)
+            assert [pp["available"] for pp in probes] == [False, True]
+        assert opened == ["missing", "url1", "url1"]
+        assert get_availability_cache().failures("missing") == 1
+        assert Collocate.probe("missing")["available"] is False
+
+        with pytest.raises(ValueError):
+            Collocate.assert_available("missing")
+        Collocate.assert_available("url1")
+        assert opened == ["missing", "url1", "url1"]
+
+        # Disabled cache
+        set_availability_cache(False)
+        assert Collocate.probe("missing")["available"] is False
+        assert opened[-1] == "missing"
+
+
+@pytest.mark.core
+def testSearchCSW_get_record_time_coverage():
+    """ Test reading the temporal extent of Dublin Core and ISO 19139
+    records.
+    """
+    rec = MockRecord()
+    rec.temporal = "2024-04-06T10:00:00Z/2024-04-06T10:02:00Z"
+    start, end = SearchCSW.get_record_time_coverage(rec)
+    assert start == parse("2024-04-06T10:00:00Z")
+    assert end == parse("2024-04-06T10:02:00Z")
+
+    # Too coarse, open ended or missing
+    rec.temporal = "2024-04-06/.."
+    assert SearchCSW.get_record_time_coverage(rec) == (None, None)
+    rec.temporal = "2024-04-06 10:00:00"
+    start, end = SearchCSW.get_record_time_coverage(rec)
+    assert start == datetime.datetime(2024, 4, 6, 10, tzinfo=timezone("utc"))
+    assert end is None
+    assert SearchCSW.get_record_time_coverage(MockRecord()) == (None, None)
+
+    # ISO 19139
+    rec = MockRecord()
+    ident = MockRecord()
+    ident.temporalextent_start = "2024-04-06T10:00:00Z"
+    ident.temporalextent_end = "2024-04-06T10:02:00Z"
+    rec.identification = [ident]
+    start, end = SearchCSW.get_record_time_coverage(rec)
+    assert start == parse("2024-04-06T10:00:00Z")
+    assert end == parse("2024-04-06T10:02:00Z")
+
+
+@pytest.mark.core
+def testSearchCSW_get_odap_url_iso():
+    """ Test that the OPeNDAP url is found in ISO 19139 records.
+    """
+    rec = MockRecord()
+    rec.distribution = None
+    assert SearchCSW.get_odap_url(rec) is None
+    wms = MockRecord()
+    wms.protocol = "OGC:WMS"
+    wms.url = "https://wms"
+    odap = MockRecord()
+    odap.protocol = "OPeNDAP:OPeNDAP"
+    odap.url = "https://odap"
+    rec.distribution = MockRecord()
+    rec.distribution.online = [wms]
+    assert SearchCSW.get_odap_url(rec) is None
+    rec.distribution.online = [wms, odap]
+    assert SearchCSW.get_odap_url(rec) == "https://odap"
+
+
+@pytest.mark.core
+def testCollocate_get_nearest_by_record_times(s1filename, monkeypatch):
+    """ Test that datasets are only opened for records without a
+    precise temporal extent.
+    """
+    class SelectMock(Mock):
+        pass
+
+    rec1 = MockRecord()
+    rec1.references = refs
+    rec1.temporal = "2019-01-07T10:00:00Z/2019-01-07T10:02:00Z"
+    rec2 = MockRecord()
+    rec2.references = refs
+    rec2.temporal = "2019-01-07/2019-01-07"
+    records = {"rec1": rec1, "rec2": rec2}
+    with monkeypatch.context() as mp:
+        smock = SelectMock()
+        smock.side_effect = [MockNcDataset(), MockDataset3()]
+        mp.setattr("fadg.find_and_collocate.netCDF4.Dataset", smock)
+        coll = Collocate(s1filename)
+        assert coll.time.year == 2019
+        rec = coll._get_nearest_by_time(records, 0, record_times=True)
+        assert rec == rec1
+        assert smock.call_count == 2
+
+
+@pytest.mark.core
+def testCollocate_time_coverage_intervals(s1filename, monkeypatch):
+    """ Test selecting records by overlap with, and containment of,
+    the input time (2019-01-07T17:17:37).
+    """
+    records = {}
+    for key, temporal in [("early", "2019-01-06T00:00:00Z/2019-01-06T12:00:00Z"),
+                          ("run12", "2019-01-07T12:00:00Z/2019-01-09T12:00:00Z"),
+                          ("run18", "2019-01-07T18:00:00Z/2019-01-10T00:00:00Z"),
+                          ("run06", "2019-01-07T06:00:00Z/2019-01-08T06:00:00Z"),
+                          ("late", "2019-01-09T00:00:00Z/2019-01-09T06:00:00Z")]:
+        records[key] = MockRecord()
+        records[key].references = refs
+        records[key].temporal = temporal
+
+    with monkeypatch.context() as mp:
+        mp.setattr("fadg.find_and_collocate.netCDF4.Dataset", MockNcDataset)
+        coll = Collocate(s1filename)
+        assert coll.time.year == 2019
+    with monkeypatch.context() as mp:
+        mp.setattr("fadg.find_and_collocate.netCDF4.Dataset", Fail)
+        overlapping = coll.get_overlapping_collocations(records, dt=1, record_times=True)
+        assert sorted(overlapping.keys()) == ["run06", "run12", "run18"]
+        overlapping = coll.get_overlapping_collocations(records, dt=30, record_times=True)
+        assert sorted(overlapping.keys()) == ["early", "run06", "run12", "run18"]
+
+        # The latest run that contains the input time
+        rec = coll.get_nearest_collocation_by_time_coverage(records, record_times=True)
+        assert rec == records["run12"]
+
+        # Otherwise the smallest gap
+        del records["run06"], records["run12"]
+        rec = coll.get_nearest_collocation_by_time_coverage(records, record_times=True)
+        assert rec == records["run18"]
+
+        # Datasets without precise record times are probed
+        with pytest.raises(ValueError) as ee:
+            coll.get_nearest_collocation_by_time_coverage({"rec1": MockRecord()})
+        assert str(ee.value) == "No available datasets for the given search interval."
+
+
+@pytest.mark.core
+def testCollocate_das_reader(s1filename, monkeypatch):
+    """ Test that metadata is read from the DAS response, and that
+    netCDF4 is used as fallback.
+    """
+    class SelectMock(Mock):
+        pass
+
+    das = {
+        "time_coverage_start": "2024-04-06T10:00:00Z",
+        "time_coverage_end": "2024-04-06T10:02:00Z",
+        "geospatial_lon_min": -3.,
+        "geospatial_lat_min": 58.,
+        "geospatial_lon_max": 5.,
+        "geospatial_lat_max": 65.,
+    }
+
+    def fetch(url, session=None):
+        if "missing" in url:
+            raise FileNotFoundError
+        if "broken" in url:
+            raise requests.ConnectionError
+        return das
+
+    with monkeypatch.context() as mp:
+        smock = SelectMock()
+        smock.side_effect = [MockNcDataset(), MockDataset2()]
+        mp.setattr("fadg.find_and_collocate.netCDF4.Dataset", smock)
+        mp.setattr("fadg.find_and_collocate.dap.fetch_global_attributes", fetch)
+
+        # Local files are opened with netCDF4
+        coll = Collocate(s1filename, reader="das")
+        assert coll.bbox == [-3., 58., 5., 65.]
+        assert smock.call_count == 1
+
+        metadata = Collocate.probe("https://server/file.nc", reader="das")
+        assert metadata["available"] is True
+        assert metadata["time_coverage_start"] == parse("2024-04-06T10:00:00Z")
+        assert metadata["geospatial_lat_max"] == 65.
+        metadata = Collocate.probe("https://server/missing.nc", reader="das")
+        assert metadata["available"] is False
+        assert smock.call_count == 1
+        # Fallback to netCDF4
+        metadata = Collocate.probe("https://server/broken.nc", reader="das")
+        assert metadata["time_coverage_start"] == parse("2024-04-07T10:00:00Z")
+        assert smock.call_count == 2
+
+        start, end = Collocate.get_time_coverage("https://server/file.nc", reader="das")
+        assert end == parse("2024-04-06T10:02:00Z")
+        with pytest.raises(OSError):
+            Collocate.get_time_coverage("https://server/missing.nc", reader="das")
+
+        coll = Collocate("https://server/file.nc", reader="das")
+        assert coll.time == parse("2024-04-06T10:00:00Z")
+        assert coll.bbox == [-3., 58., 5., 65.]
+        assert smock.call_count == 2
+
+        with pytest.raises(ValueError) as ee:
+            Collocate.probe("https://server/file.nc", reader="pydap")
+        assert str(ee.value) == "reader must be one of netcdf, das"
+
+    with monkeypatch.context() as mp:
+        mp.setattr("fadg.find_and_collocate.dap.is_available",
+                   lambda url, session=None: "missing" not in url)
+        assert Collocate.assert_available("https://server/file.nc", reader="das") is None
+        with pytest.raises(ValueError) as ee:
+            Collocate.assert_available("https://server/missing.nc", reader="das")
+        assert "is not available" in str(ee.value)
+
+        # Fallback to netCDF4
+        for error in [requests.ConnectionError, requests.HTTPError("HTTP 503")]:
+            mp.setattr("fadg.find_and_collocate.dap.is_available", Mock(side_effect=error))
+            mp.setattr("fadg.find_and_collocate.netCDF4.Dataset", MockNcDataset)
+            assert Collocate.assert_available("https://server/file.nc", reader="das") is None
+
+
+@pytest.mark.core
+def testCollocate_cache(s1filename, monkeypatch):
+    """ Test that datasets are only opened once when a metadata cache
+    is used.
+    """
+    class SelectMock(Mock):
+        pass
+
+    cache = MetadataCache(path=":memory:")
+    records = {"rec1": MockRecord()}
+    records["rec1"].references = refs
+    with monkeypatch.context() as mp:
+        smock = SelectMock()
+        smock.side_effect = [MockNcDataset(), MockDataset1()]
+        mp.setattr("fadg.find_and_collocate.netCDF4.Dataset", smock)
+        coll = Collocate(s1filename, cache=cache)
+        assert coll.time.year == 2019
+        rec = coll.get_nearest_collocation_by_time_coverage_start(records)
+        assert rec == records["rec1"]
+        assert smock.call_count == 2
+
+        # Second round is served from the cache
+        coll = Collocate(s1filename, cache=cache)
+        assert coll.time == datetime.datetime(2019, 1, 7, 17, 17, 37, tzinfo=timezone("utc"))
+        assert coll.bbox == [-3., 58., 5., 65.]
+        rec = coll.get_nearest_collocation_by_time_coverage_start(records)
+        assert rec == records["rec1"]
+        start, end = Collocate.get_time_coverage(refs[0]["url"], cache=cache)
+        assert start == parse("2024-04-06T10:00:00Z")
+        assert end == parse("2024-04-06T10:02:00Z")
+        assert smock.call_count == 2
+
+
+@pytest.mark.core
+def testCollocate_batch(monkeypatch):
+    """ Test that the search windows of many inputs are merged into few
+    CSW queries, and that the records are assigned back to each input.
+    """
+    north = [-3., 58., 5., 65.]
+    south = [-60., -70., -50., -60.]
+
+    def record(temporal, bbox):
+        rec = MockRecord()
+        rec.references = refs
+        rec.temporal = temporal
+        rec.bbox = None if bbox is None else Mock(minx=str(bbox[0]), miny=str(bbox[1]),
+                                                  maxx=str(bbox[2]), maxy=str(bbox[3]))
+        return rec
+
+    class MockWindowCSW:
+
+        queries = []
+
+        def __init__(self, *args, **kwargs):
+            return None
+
+        def getrecords2(self, constraints=None, **kwargs):
+            MockWindowCSW.queries.append(constraints)
+            self.records = {
+                "r1": record("2024-04-06T09:00:00Z/2024-04-06T10:00:00Z", north),
+                "r2": record("2024-04-07T15:00:00Z/2024-04-07T16:00:00Z", north),
+                "r3": record("2024-04-20T08:00:00Z/2024-04-20T09:00:00Z", north),
+                "r4": record("2024-04-06/2024-04-07", south),
+                "r5": record(None, None),
+            }
+            self.results = {"matches": 5, "returned": 5, "nextrecord": 0}
+
+    def metadata(url, time, bbox):
+        metadata = {"url": url, "available": True, "time_coverage_start": parse(time),
+                    "time_coverage_end": None}
+        metadata.update(zip(Collocate.GEOSPATIAL_FIELDS, bbox))
+        return metadata
+
+    cache = MetadataCache(path=":memory:")
+    cache.put(metadata("a.nc", "2024-04-06T10:00:00Z", north))
+    cache.put(metadata("b.nc", "2024-04-06T16:00:00Z", north))
+    cache.put(metadata("c.nc", "2024-04-20T10:00:00Z", north))
+    cache.put(metadata("d.nc", "2024-04-06T12:00:00Z", south))
+    with monkeypatch.context() as mp:
+        mp.setattr("fadg.find_and_collocate.netCDF4.Dataset", Fail)
+        mp.setattr("fadg.find_and_collocate.CatalogueServiceWeb", MockWindowCSW)
+        collocations = Collocate.batch(["a.nc", "b.nc", "c.nc", "d.nc", "e.nc"],
+                                       product=Meps, cache=cache, subset="surface")
+
+    # a and b share a query, c is far in time and d far in space
+    assert len(MockWindowCSW.queries) == 3
+    assert "Meps 2.5 km deterministic surface parameters" in str(
+        [vars(ff) for ff in MockWindowCSW.queries[0][0].operations])
+    assert sorted(collocations.keys()) == ["a.nc", "b.nc", "c.nc", "d.nc"]
+    assert isinstance(collocations["a.nc"][0], Meps)
+    assert collocations["d.nc"][0].bbox == south
+    assert sorted(collocations["a.nc"][1].keys()) == ["r1", "r5"]
+    assert sorted(collocations["b.nc"][1].keys()) == ["r1", "r2", "r5"]
+    assert sorted(collocations["c.nc"][1].keys()) == ["r3", "r5"]
+    assert sorted(collocations["d.nc"][1].keys()) == ["r4", "r5"]
+
+    # Without merging, there is one query per input
+    MockWindowCSW.queries = []
+    with monkeypatch.context() as mp:
+        mp.setattr("fadg.find_and_collocate.CatalogueServiceWeb", MockWindowCSW)
+        collocations = Collocate.batch(["a.nc", "b.nc"], cache=cache, max_window=0)
+    assert len(MockWindowCSW.queries) == 2
+    assert sorted(collocations["a.nc"][1].keys()) == ["r1", "r5"]
+    assert Collocate.batch([], cache=cache) == {}
+
+    # Merged queries that reach max_records are split
+    MockWindowCSW.queries = []
+    with monkeypatch.context() as mp:
+        mp.setattr("fadg.find_and_collocate.CatalogueServiceWeb", MockWindowCSW)
+        collocations = Collocate.batch(["a.nc", "b.nc"], cache=cache, max_records=5)
+    assert len(MockWindowCSW.queries) == 3
+    assert sorted(collocations["a.nc"][1].keys()) == ["r1", "r5"]
+    assert sorted(collocations["b.nc"][1].keys()) == ["r1", "r2", "r5"]
+
+    # Also if the records are filtered locally before they are counted
+    MockWindowCSW.queries = []
+    with monkeypatch.context() as mp:
+        mp.setattr("fadg.find_and_collocate.CatalogueServiceWeb", MockWindowCSW)
+        collocations = Collocate.batch(["a.nc", "b.nc"], cache=cache, max_records=5, snap=24)
+    assert len(MockWindowCSW.queries) == 3
+    assert sorted(collocations["b.nc"][1].keys()) == ["r1", "r2", "r5"]
+
+
+@pytest.mark.core
+def testCollocate_snap(monkeypatch):
+    """ Test that snapped search windows and areas of nearby scenes
+    share a cached query, and that the records are selected by the
+    exact window and area.
+    """
+    north = [-3., 58., 4.8, 65.]
+
+    def record(temporal, minx="0", maxx="1"):
+        rec = MockRecord()
+        rec.references = refs
+        rec.temporal = temporal
+        rec.bbox = Mock(minx=minx, miny="60", maxx=maxx, maxy="61")
+        return rec
+
+    class MockSnapCSW:
+
+        queries = []
+
+        def __init__(self, *args, **kwargs):
+            return None
+
+        def getrecords2(self, constraints=None, **kwargs):
+            MockSnapCSW.queries.append(constraints)
+            self.records = {
+                "r1": record("2024-04-06T09:00:00Z/2024-04-06T10:00:00Z"),
+                "r2": record("2024-04-06T11:05:00Z/2024-04-06T11:30:00Z"),
+                "r3": record("2024-04-06T20:00:00Z/2024-04-06T21:00:00Z"),
+                "r4": record("2024-04-06T10:00:00Z/2024-04-06T10:30:00Z", "-4.5", "-4"),
+            }
+            self.results = {"matches": 4, "returned": 4, "nextrecord": 0}
+
+    cache = MetadataCache(path=":memory:")
+    for url, time, bbox in [("a.nc", "2024-04-06T10:00:00Z", north),
+                            ("b.nc", "2024-04-06T10:10:00Z", [-2.5, 58.2, 4.9, 64.9])]:
+        metadata = {"url": url, "available": True, "time_coverage_start": parse(time),
+                    "time_coverage_end": None}
+        metadata.update(zip(Collocate.GEOSPATIAL_FIELDS, bbox))
+        cache.put(metadata)
+
+    queries = QueryCache()
+    with monkeypatch.context() as mp:
+        mp.setattr("fadg.find_and_collocate.netCDF4.Dataset", Fail)
+        mp.setattr("fadg.find_and_collocate.CatalogueServiceWeb", MockSnapCSW)
+        coll_a = Collocate("a.nc", cache=cache)
+        coll_b = Collocate("b.nc", cache=cache)
+        utc = timezone("utc")
+        assert coll_a._snap_window(dt=1, snap=24) == (
+            datetime.datetime(2024, 4, 6, tzinfo=utc), datetime.datetime(2024, 4, 7, tzinfo=utc))
+        assert coll_b._snap_window(dt=1, snap=datetime.timedelta(hours=1)) == (
+            datetime.datetime(2024, 4, 6, 9, tzinfo=utc),
+            datetime.datetime(2024, 4, 6, 12, tzinfo=utc))
+        with pytest.raises(ValueError):
+            coll_a._snap_window(snap=0)
+        assert coll_a._snap_bboxes() == coll_b._snap_bboxes() == [[-5., 55., 5., 65.]]
+        assert coll_b._snap_bboxes(grid=1) == [[-3., 58., 5., 65.]]
+        with pytest.raises(ValueError):
+            coll_a._snap_bboxes(grid=0)
+
+        records = coll_a.get_collocations(dt=1, snap=24, query_cache=queries)
+        assert sorted(records.keys()) == ["r1"]
+        assert len(MockSnapCSW.queries) == 1
+        xml = etree.tostring(MockSnapCSW.queries[0][0].toXML()).decode()
+        assert "2024-04-06T00:00:00Z" in xml and "2024-04-07T00:00:00Z" in xml
+        assert "-5.0 55.0" in xml and "-3.0" not in xml
+
+        # The superset query is reused, and filtered by the exact window and area
+        records = coll_b.get_collocations(dt=1, snap=24, query_cache=queries)
+        assert sorted(records.keys()) == ["r1", "r2"]
+        assert coll_b.request_count == 0
+        assert len(MockSnapCSW.queries) == 1
+
+        # Without a grid, the exact area is sent
+        coll_b.get_collocations(dt=1, snap=24, grid=None, query_cache=queries)
+        assert len(MockSnapCSW.queries) == 2
+        xml = etree.tostring(MockSnapCSW.queries[1][0].toXML()).decode()
+        assert "-2.5" in xml and "4.9" in xml
+
+        # Without snapping, the exact window is sent
+        coll_b.get_collocations(dt=1, query_cache=queries)
+        assert len(MockSnapCSW.queries) == 3
+        xml = etree.tostring(MockSnapCSW.queries[2][0].toXML()).decode()
+        assert "2024-04-06T09:10:00Z" in xml and "2024-04-06T11:10:00Z" in xml
 
 
 @pytest.mark.core
@@ -485,9 +1475,17 @@ def testNorKyst800(s1filename, monkeypatch):
         records = coll.get_collocations()
         assert records["rec1"].references == refs
 
-    url = coll.get_odap_url_of_nearest()
+    session = MockCatalogSession({"fou-hi/norkyst800m-1h": [
+        "NorKyst-800m_ZDEPTHS_his.an.2019010600.nc",
+        "NorKyst-800m_ZDEPTHS_his.an.2019010700.nc"]})
+    NorKyst800.PATTERN.clear()
+    with monkeypatch.context() as mp:
+        mp.setattr("fadg.thredds.get_session", lambda: session)
+        url = coll.get_odap_url_of_nearest()
+    NorKyst800.PATTERN.clear()
     assert url == ("https://thredds.met.no/thredds/dodsC/fou-hi/"
                    "norkyst800m-1h/NorKyst-800m_ZDEPTHS_his.an.2019010700.nc")
+    assert len(session.requests) == 1
 
 
 @pytest.mark.core
@@ -525,15 +1523,186 @@ def testMETNordic(s1filename, monkeypatch):
         records = coll.get_collocations()
         assert records["rec1"].references == refs
 
+    # The datasets are not opened, and missing hours are skipped
+    session = MockCatalogSession({"metpparchivev3/2019/01/07": [
+        "met_analysis_1_0km_nordic_20190107T%02dZ.nc" % hh for hh in [16, 17, 19]]})
+    METNordic.PATTERN.clear()
     with monkeypatch.context() as mp:
         mp.setattr("fadg.find_and_collocate.netCDF4.Dataset", MockNcDataset)
+        mp.setattr("fadg.thredds.get_session", lambda: session)
         coll = METNordic(s1filename)
+        assert coll.time.year == 2019
+        mp.setattr("fadg.find_and_collocate.netCDF4.Dataset", None)
         url = coll.get_odap_url_of_nearest()
         assert url == ("https://thredds.met.no/thredds/dodsC/metpparchivev3/"
                        "2019/01/07/met_analysis_1_0km_nordic_20190107T17Z.nc")
+        session.directories["metpparchivev3/2019/01/07"].remove(
+            "met_analysis_1_0km_nordic_20190107T17Z.nc")
+        METNordic.PATTERN.clear()
+        url = coll.get_odap_url_of_nearest()
+        assert url == ("https://thredds.met.no/thredds/dodsC/metpparchivev3/"
+                       "2019/01/07/met_analysis_1_0km_nordic_20190107T16Z.nc")
+        coll.time = datetime.datetime(2019, 3, 1, tzinfo=timezone("utc"))
+        with pytest.raises(ValueError):
+            coll.get_odap_url_of_nearest()
+    METNordic.PATTERN.clear()
+
+
+class MockFootprintNcDataset:
+    """ Dataset with a triangular footprint given in lat/lon order.
+    """
+
+    time_coverage_start = "20190107T171737"
+    time_coverage_end = "20190107T171810"
+    geospatial_lon_min = 0.
+    geospatial_lon_max = 10.
+    geospatial_lat_min = 60.
+    geospatial_lat_max = 70.
+    geospatial_bounds = "POLYGON ((60 0, 60 10, 70 0, 60 0))"
+
+    def __init__(self, *args, **kwargs):
+        return None
+
+    def close(self):
+        return None
+
+
+class MockFootprintCSW:
+    """ Local stand-in for a CSW service, which records the filter
+    and returns records outside and inside the footprint.
+    """
+
+    filters = []
+
+    def __init__(self, *args, **kwargs):
+        return None
+
+    def getrecords2(self, constraints=None, *args, **kwargs):
+        MockFootprintCSW.filters = constraints
+        self.records = {}
+        for key, bbox in [("outside", [8., 68., 9., 69.]), ("inside", [1., 61., 2., 62.]),
+                          ("nobbox", None)]:
+            rec = MockRecord()
+            rec.references = refs
+            rec.bbox = None
+            if bbox is not None:
+                rec.bbox = SimpleNamespace(minx=bbox[0], miny=bbox[1], maxx=bbox[2],
+                                           maxy=bbox[3])
+            self.records[key] = rec
+        self.results = {"nextrecord": 0}
 
 
 @pytest.mark.core
-def testWeatherForecast(s1filename):
-    with pytest.raises(NotImplementedError):
-        WeatherForecast(s1filename)
+def testCollocate_footprint(s1filename, monkeypatch):
+    """ Test that the footprint of the input dataset is used in the
+    CSW filter and for filtering the records.
+    """
+    with monkeypatch.context() as mp:
+        mp.setattr("fadg.find_and_collocate.CatalogueServiceWeb", MockFootprintCSW)
+        mp.setattr("fadg.find_and_collocate.netCDF4.Dataset", MockFootprintNcDataset)
+        coll = Collocate(s1filename)
+        # The lat/lon order of the WKT is detected
+        assert coll.polygon.bbox == [0., 60., 10., 70.]
+        records = coll.get_collocations()
+        assert sorted(records.keys()) == ["inside", "nobbox"]
+        xml = etree.tostring(MockFootprintCSW.filters[0].toXML()).decode()
+        assert "Intersects" in xml
+        assert "BBOX" not in xml
+
+        # Without footprint
+        mp.setattr("fadg.find_and_collocate.netCDF4.Dataset", MockNcDataset)
+        coll = Collocate(s1filename)
+        assert coll.polygon is None
+        assert len(coll.get_collocations()) == 3
+
+        # SearchCSW with a WKT polygon
+        ds = SearchCSW(polygon="POLYGON ((0 60, 10 60, 0 70, 0 60))")
+        assert ds.bbox == [0., 60., 10., 70.]
+        assert sorted(ds.records.keys()) == ["inside", "nobbox"]
+        ds = SearchCSW(polygon="POLYGON ((0 60, 10 60, 0 70, 0 60))", lazy=True)
+        assert [key for key, rec in ds.iter_records()] == ["inside", "nobbox"]
+
+    metadata = Collocate._read_metadata(MockFootprintNcDataset, s1filename)
+    assert Collocate._read_footprint(dict(metadata, geospatial_bounds="POINT (1 2)")) is None
+
+
+class MockAntimeridianNcDataset(MockNcDataset):
+    """ Dataset that crosses the antimeridian, with ACDD bounds
+    lon_min > lon_max.
+    """
+
+    geospatial_lon_min = 170.
+    geospatial_lon_max = -170.
+
+
+class MockBBoxCSW:
+    """ Local stand-in for a CSW service, which returns one record per
+    BBox filter.
+    """
+
+    requests = []
+
+    def __init__(self, *args, **kwargs):
+        return None
+
+    def getrecords2(self, constraints=None, *args, **kwargs):
+        xml = etree.tostring(constraints[0].toXML()).decode()
+        MockBBoxCSW.requests.append(xml)
+        self.records = {}
+        for ii in range(xml.count("<ogc:BBOX>")):
+            rec = MockRecord()
+            rec.references = refs
+            self.records["rec%d_%d" % (len(MockBBoxCSW.requests), ii)] = rec
+        self.results = {"nextrecord": 0}
+
+
+@pytest.mark.core
+def testCollocate_antimeridian(s1filename, monkeypatch):
+    """ Test that search areas that cross the antimeridian are split
+    into an Or of two bounding boxes, or into two queries.
+    """
+    MockBBoxCSW.requests = []
+    with monkeypatch.context() as mp:
+        mp.setattr("fadg.find_and_collocate.CatalogueServiceWeb", MockBBoxCSW)
+        mp.setattr("fadg.find_and_collocate.netCDF4.Dataset", MockAntimeridianNcDataset)
+        coll = Collocate(s1filename)
+        assert coll.bboxes == [[170., 58., 180., 65.], [-180., 58., -170., 65.]]
+        assert len(coll.get_collocations()) == 2
+        assert len(MockBBoxCSW.requests) == 1
+        assert "<ogc:Or>" in MockBBoxCSW.requests[0]
+
+        MockBBoxCSW.requests = []
+        records = coll.get_collocations(split_queries=True)
+        assert len(records) == 2
+        assert coll.request_count == 2
+        assert [xml.count("<ogc:BBOX>") for xml in MockBBoxCSW.requests] == [1, 1]
+        assert not any("<ogc:Or>" in xml for xml in MockBBoxCSW.requests)
+
+        # Records are selected locally by both boxes
+        rec = MockRecord()
+        rec.bbox = SimpleNamespace(minx=-175., miny=60., maxx=-172., maxy=62.)
+        assert len(coll._select_collocations({"rec": rec}, dt=24)) == 1
+        rec.bbox = SimpleNamespace(minx=0., miny=60., maxx=10., maxy=62.)
+        assert len(coll._select_collocations({"rec": rec}, dt=24)) == 0
+
+
+@pytest.mark.core
+def testWeatherForecast(s1filename, monkeypatch):
+    """ Test that all forecast products are searched within the
+    footprint.
+    """
+    with monkeypatch.context() as mp:
+        mp.setattr("fadg.find_and_collocate.CatalogueServiceWeb", MockFootprintCSW)
+        mp.setattr("fadg.find_and_collocate.netCDF4.Dataset", MockFootprintNcDataset)
+        coll = WeatherForecast(s1filename)
+        records = coll.get_collocations()
+        assert sorted(records.keys()) == ["inside", "nobbox"]
+        xml = etree.tostring(MockFootprintCSW.filters[0].toXML()).decode()
+        assert AromeArctic.SUBSETS["deterministic"] in xml
+        assert Meps.SUBSETS["surface"] in xml
+
+        coll.get_collocations(products=["meps"])
+        xml = etree.tostring(MockFootprintCSW.filters[0].toXML()).decode()
+        assert AromeArctic.SUBSETS["deterministic"] not in xml
+        with pytest.raises(ValueError):
+            coll.get_collocations(products=[])
@@ -0,0 +1,200 @@
+"""
+Collocation : CSW request module tests
+======================================
+
+Copyright 2024 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import pytest
+
+from types import SimpleNamespace
+
+from owslib import fes
+from owslib.etree import etree
+
+from tools import getRecordsResponse
+
+from fadg.csw import CSWConnection
+from fadg.csw import CapabilitiesCache
+from fadg.csw import get_queryables
+from fadg.csw import getrecords_xml
+from fadg.csw import SLIM_ELEMENTS
+from fadg.csw import parse_getrecords_response
+
+NS = {
+    "csw": "http://www.opengis.net/cat/csw/2.0.2",
+    "ogc": "http://www.opengis.net/ogc",
+}
+
+
+@pytest.mark.core
+def testCSW_getrecords_xml():
+    """ Test that a GetRecords POST request is created with paging
+    parameters and the given filter.
+    """
+    text = fes.PropertyIsLike("csw:AnyText", literal="Arome")
+    xml = etree.fromstring(getrecords_xml([text], startposition=11, maxrecords=5))
+    assert xml.tag == "{%s}GetRecords" % NS["csw"]
+    assert xml.get("startPosition") == "11"
+    assert xml.get("maxRecords") == "5"
+    assert xml.get("outputSchema") == "http://www.opengis.net/cat/csw/2.0.2"
+    assert xml.find("csw:Query/csw:ElementSetName", NS).text == "full"
+    literal = xml.find("csw:Query/csw:Constraint/ogc:Filter/ogc:PropertyIsLike/ogc:Literal",
+                       NS)
+    assert literal.text == "Arome"
+
+    # Without constraints
+    xml = etree.fromstring(getrecords_xml([], esn="brief"))
+    assert xml.find("csw:Query/csw:Constraint", NS) is None
+    assert xml.find("csw:Query/csw:ElementSetName", NS).text == "brief"
+
+    # Only the given elements
+    xml = etree.fromstring(getrecords_xml([], elements=SLIM_ELEMENTS))
+    assert xml.find("csw:Query/csw:ElementSetName", NS) is None
+    names = [elem.text for elem in xml.findall("csw:Query/csw:ElementName", NS)]
+    assert names == ["dc:identifier", "dct:references", "dct:temporal", "ows:BoundingBox"]
+    assert xml.nsmap["dct"] == "http://purl.org/dc/terms/"
+
+
+@pytest.mark.core
+def testCSW_parse_getrecords_response():
+    """ Test parsing of GetRecords responses and exception reports.
+    """
+    records, results = parse_getrecords_response(getRecordsResponse(1, 10, 25))
+    assert list(records.keys()) == ["rec%d" % ii for ii in range(1, 11)]
+    assert results == {"matches": 25, "returned": 10, "nextrecord": 11}
+    assert records["rec2"].references[0]["scheme"] == "OPENDAP:OPENDAP"
+    assert records["rec2"].temporal == "2024-04-06T02:00:00Z/2024-04-06T02:59:59Z"
+
+    records, results = parse_getrecords_response(getRecordsResponse(21, 10, 25))
+    assert len(records) == 5
+    assert results["nextrecord"] == 0
+
+    report = (
+        b"<ows:ExceptionReport xmlns:ows=\"http://www.opengis.net/ows\" version=\"1.2.0\">"
+        b"<ows:Exception exceptionCode=\"InvalidParameterValue\">"
+        b"<ows:ExceptionText>Invalid constraint</ows:ExceptionText>"
+        b"</ows:Exception></ows:ExceptionReport>")
+    with pytest.raises(ValueError) as ee:
+        parse_getrecords_response(report)
+    assert "Invalid constraint" in str(ee.value)
+
+    with pytest.raises(ValueError) as ee:
+        parse_getrecords_response(b"<csw:GetRecordsResponse xmlns:csw=\"%s\"/>"
+                                  % NS["csw"].encode())
+    assert "missing SearchResults" in str(ee.value)
+
+
+class MockCapabilities:
+
+    calls = 0
+
+    def __init__(self, *args, **kwargs):
+        MockCapabilities.calls += 1
+        self.constraints = {"MaxRecordDefault": "test"}
+
+    def get_operation_by_name(self, name):
+        class Operation:
+            methods = [
+                {"type": "Get", "url": "https://csw/get"},
+                {"type": "Post", "url": "https://csw/post"},
+            ]
+            constraints = [
+                SimpleNamespace(name="SupportedDublinCoreQueryables", values=["dc:title"]),
+                SimpleNamespace(name="SupportedISOQueryables",
+                                values=["apiso:TempExtent_begin", "apiso:TempExtent_end"]),
+                SimpleNamespace(name="PostEncoding", values=["XML"]),
+            ]
+        return Operation()
+
+
+class MockResponse:
+
+    def __init__(self, content):
+        self.content = content
+
+    def raise_for_status(self):
+        return None
+
+
+class MockSession:
+
+    def __init__(self):
+        self.posts = []
+
+    def post(self, url, data=None, timeout=None, headers=None):
+        xml = etree.fromstring(data)
+        start = int(xml.get("startPosition"))
+        maxrecords = int(xml.get("maxRecords"))
+        self.posts.append((url, start, maxrecords))
+        return MockResponse(getRecordsResponse(start, maxrecords, 25))
+
+
+@pytest.mark.core
+def testCSW_CapabilitiesCache(monkeypatch):
+    """ Test that capabilities are requested once per endpoint until
+    they expire.
+    """
+    clock = [1000.]
+    with monkeypatch.context() as mp:
+        mp.setattr("fadg.csw.CatalogueServiceWeb", MockCapabilities)
+        mp.setattr("fadg.csw.time.time", lambda: clock[0])
+        MockCapabilities.calls = 0
+        cache = CapabilitiesCache(ttl=10)
+        assert cache.peek("https://csw1") is None
+        caps = cache.get("https://csw1")
+        assert cache.get("https://csw1") is caps
+        assert cache.peek("https://csw1") is caps
+        assert MockCapabilities.calls == 1
+        cache.get("https://csw2")
+        assert MockCapabilities.calls == 2
+
+        clock[0] += 11
+        assert cache.peek("https://csw1") is None
+        assert cache.get("https://csw1") is not caps
+        assert MockCapabilities.calls == 3
+
+        cache.clear()
+        cache.get("https://csw1")
+        assert MockCapabilities.calls == 4
+
+
+@pytest.mark.core
+def testCSW_CSWConnection():
+    """ Test that GetRecords is posted through the session to the url
+    advertised in the capabilities.
+    """
+    session = MockSession()
+    conn = CSWConnection("https://csw", session=session, capabilities=MockCapabilities())
+    assert conn.constraints == {"MaxRecordDefault": "test"}
+    conn.getrecords2(constraints=[], startposition=21, maxrecords=10)
+    assert session.posts == [("https://csw/post", 21, 10)]
+    assert len(conn.records) == 5
+    assert conn.results["nextrecord"] == 0
+
+    # Without capabilities
+    conn = CSWConnection("https://csw", session=session)
+    assert conn.constraints == {}
+    conn.getrecords2()
+    assert session.posts[-1] == ("https://csw", 1, 10)
+
+
+@pytest.mark.core
+def testCSW_get_queryables():
+    """ Test reading the queryables advertised for GetRecords.
+    """
+    assert get_queryables(MockCapabilities()) == {
+        "dc:title", "apiso:TempExtent_begin", "apiso:TempExtent_end"}
+    assert get_queryables(None) is None
+    assert get_queryables(SimpleNamespace()) is None
@@ -0,0 +1,144 @@
+"""
+Collocation : DAP module tests
+==============================
+
+Copyright 2024 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import pytest
+import requests
+
+from fadg.dap import das_url
+from fadg.dap import is_available
+from fadg.dap import fetch_global_attributes
+from fadg.dap import parse_das
+from fadg.dap import global_attributes
+
+DAS = """Attributes {
+    time {
+        String units "seconds since 1970-01-01 00:00:00";
+        Float64 _FillValue NaN;
+    }
+    NC_GLOBAL {
+        String title "A \\"quoted\\" title; with {braces}";
+        String summary "Two
+lines";
+        String time_coverage_start "2024-04-06T10:00:00Z";
+        String time_coverage_end "2024-04-06T10:02:00Z";
+        Float64 geospatial_lat_min 58.0;
+        Float32 geospatial_lon_min -3.5;
+        Int32 levels 1, 2, 3;
+    }
+    DODS_EXTRA {
+        String Unlimited_Dimension "time";
+    }
+}
+"""
+
+
+@pytest.mark.core
+def testDAP_das_url():
+    """ Test that the DAS url is created from an OPeNDAP url.
+    """
+    assert das_url("https://server/dodsC/file.nc") == "https://server/dodsC/file.nc.das"
+    assert das_url("https://server/dodsC/file.nc#fillmismatch") == (
+        "https://server/dodsC/file.nc.das")
+    assert das_url("https://server/dodsC/file.ncml?time") == (
+        "https://server/dodsC/file.ncml.das")
+
+
+@pytest.mark.core
+def testDAP_parse_das():
+    """ Test parsing of attribute containers, types and strings.
+    """
+    containers = parse_das(DAS)
+    assert list(containers.keys()) == ["time", "NC_GLOBAL", "DODS_EXTRA"]
+    assert containers["time"]["units"] == "seconds since 1970-01-01 00:00:00"
+    attrs = containers["NC_GLOBAL"]
+    assert attrs["title"] == 'A "quoted" title; with {braces}'
+    assert attrs["summary"] == "Two\nlines"
+    assert attrs["geospatial_lat_min"] == 58.0
+    assert attrs["geospatial_lon_min"] == -3.5
+    assert attrs["levels"] == [1, 2, 3]
+
+    with pytest.raises(ValueError) as ee:
+        parse_das("<html>Not found</html>")
+    assert str(ee.value) == "Invalid DAS response."
+    with pytest.raises(ValueError) as ee:
+        parse_das("Attributes { NC_GLOBAL { String title \"x\";")
+    assert "unbalanced braces" in str(ee.value)
+
+
+@pytest.mark.core
+def testDAP_global_attributes():
+    """ Test that the global attributes are returned.
+    """
+    attrs = global_attributes(DAS)
+    assert attrs["time_coverage_start"] == "2024-04-06T10:00:00Z"
+    assert global_attributes("Attributes {\n}") == {}
+
+
+class MockResponse:
+
+    def __init__(self, status_code, text=""):
+        self.status_code = status_code
+        self.text = text
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError("HTTP %d" % self.status_code)
+
+
+@pytest.mark.core
+def testDAP_fetch_global_attributes(monkeypatch):
+    """ Test that only the DAS response is fetched, and that errors
+    are reported.
+    """
+    calls = []
+
+    def get(url, timeout=None):
+        calls.append(url)
+        return MockResponse(200, DAS)
+
+    with monkeypatch.context() as mp:
+        mp.setattr("fadg.dap.requests.get", get)
+        attrs = fetch_global_attributes("https://server/dodsC/file.nc", timeout=5)
+        assert attrs["time_coverage_end"] == "2024-04-06T10:02:00Z"
+        assert calls == ["https://server/dodsC/file.nc.das"]
+
+        for status in [404, 410]:
+            mp.setattr("fadg.dap.requests.get", lambda *a, **k: MockResponse(status))
+            with pytest.raises(FileNotFoundError):
+                fetch_global_attributes("https://server/dodsC/file.nc")
+        mp.setattr("fadg.dap.requests.get", lambda *a, **k: MockResponse(500))
+        with pytest.raises(requests.HTTPError):
+            fetch_global_attributes("https://server/dodsC/file.nc")
+
+
+@pytest.mark.core
+def testDAP_is_available(monkeypatch):
+    """ Test availability check with HTTP HEAD.
+    """
+    with monkeypatch.context() as mp:
+        mp.setattr("fadg.dap.requests.head", lambda *a, **k: MockResponse(200))
+        assert is_available("https://server/dodsC/file.nc") is True
+        for status in [404, 410]:
+            mp.setattr("fadg.dap.requests.head", lambda *a, **k: MockResponse(status))
+            assert is_available("https://server/dodsC/file.nc") is False
+
+        # Server errors do not mean that the dataset is missing
+        for status in [503, 429, 405]:
+            mp.setattr("fadg.dap.requests.head", lambda *a, **k: MockResponse(status))
+            with pytest.raises(requests.HTTPError):
+                is_available("https://server/dodsC/file.nc")
@@ -0,0 +1,121 @@
+"""
+Collocation : Geometry module tests
+===================================
+
+Copyright 2024 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import pytest
+
+import numpy as np
+
+from fadg.geometry import Footprint
+from fadg.geometry import split_bbox
+
+# Triangle with a hole, and a square
+TRIANGLE = "POLYGON ((0 0, 10 0, 0 10, 0 0), (1 1, 3 1, 1 3, 1 1))"
+MULTI = "SRID=4326;MULTIPOLYGON (((0 0, 10 0, 0 10, 0 0)), ((20 20, 22 20, 22 22, 20 22)))"
+
+
+@pytest.mark.core
+def testFootprint_from_wkt():
+    """ Test reading WKT polygons and multipolygons.
+    """
+    footprint = Footprint.from_wkt(TRIANGLE)
+    assert len(footprint.polygons) == 1
+    assert len(footprint.polygons[0]) == 2
+    assert footprint.bbox == [0., 0., 10., 10.]
+    assert Footprint.from_wkt(footprint.wkt).bbox == footprint.bbox
+
+    footprint = Footprint.from_wkt(MULTI)
+    assert len(footprint.polygons) == 2
+    # Open rings are closed
+    assert footprint.polygons[1][0].shape == (5, 2)
+    assert footprint.bbox == [0., 0., 22., 22.]
+    assert footprint.wkt.startswith("MULTIPOLYGON")
+
+    assert Footprint.from_wkt("POLYGON ((60 5, 60 6, 61 6, 60 5))").swapped().bbox == \
+        [5., 60., 6., 61.]
+
+    for wkt in ["POINT (1 2)", "POLYGON ((0 0, 1 1, 0 0))", "POLYGON ((0 0, 1 0, 1 1)",
+                "POLYGON ((a b, 1 0, 1 1))", None]:
+        with pytest.raises(ValueError):
+            Footprint.from_wkt(wkt)
+
+
+@pytest.mark.core
+def testFootprint_contains_points():
+    """ Test the even-odd point in polygon test, including holes.
+    """
+    footprint = Footprint.from_wkt(MULTI)
+    inside = footprint.contains_points([0.5, 4, 6, 21, 15], [0.5, 4, 6, 21, 15])
+    assert inside.tolist() == [True, True, False, True, False]
+    inside = Footprint.from_wkt(TRIANGLE).contains_points([1.5, 5], [1.5, 1])
+    assert inside.tolist() == [False, True]
+
+
+@pytest.mark.core
+def testFootprint_intersects_bboxes():
+    """ Test the vectorised bounding box intersection test.
+    """
+    footprint = Footprint.from_wkt(TRIANGLE)
+    bboxes = [
+        [8, 8, 9, 9],          # inside the bounding box, outside the triangle
+        [4, 4, 9, 9],          # contains a vertex-free part of the hypotenuse
+        [-1, -1, 11, 11],      # contains the triangle
+        [1.2, 1.2, 1.4, 1.4],  # inside the hole
+        [2, -5, 3, 5],         # crosses an edge
+        [20, 20, 30, 30],      # outside the bounding box
+    ]
+    assert footprint.intersects_bboxes(bboxes).tolist() == \
+        [False, True, True, False, True, False]
+    assert footprint.intersects_bboxes(np.empty((0, 4))).tolist() == []
+
+    assert footprint.intersects(Footprint.from_bbox([4, 4, 9, 9]))
+    assert not footprint.intersects(Footprint.from_bbox([8, 8, 9, 9]))
+    assert not footprint.intersects(Footprint.from_bbox([1.2, 1.2, 1.4, 1.4]))
+    assert Footprint.from_bbox([-1, -1, 11, 11]).intersects(footprint)
+
+
+@pytest.mark.core
+def testGeometry_split_bbox():
+    """ Test splitting of bounding boxes that cross the antimeridian.
+    """
+    assert split_bbox([-3, 58, 5, 65]) == [[-3., 58., 5., 65.]]
+    assert split_bbox([170, 60, -170, 70]) == [[170., 60., 180., 70.], [-180., 60., -170., 70.]]
+    assert split_bbox([170, 60, 190, 70]) == [[170., 60., 180., 70.], [-180., 60., -170., 70.]]
+    assert split_bbox([190, 60, 200, 95]) == [[-170., 60., -160., 90.]]
+    assert split_bbox([-180, -90, 180, 90]) == [[-180., -90., 180., 90.]]
+    assert split_bbox([0, 80, 360, 90]) == [[-180., 80., 180., 90.]]
+
+
+@pytest.mark.core
+def testFootprint_bboxes():
+    """ Test tight bounding boxes of footprints that cross the
+    antimeridian or enclose a pole.
+    """
+    footprint = Footprint.from_wkt("POLYGON ((0 60, 10 60, 0 70, 0 60))")
+    assert not footprint.wraps
+    assert footprint.bboxes() == [[0., 60., 10., 70.]]
+
+    footprint = Footprint.from_wkt("POLYGON ((170 60, -170 60, -170 70, 170 70, 170 60))")
+    assert footprint.wraps
+    assert footprint.bbox == [-170., 60., 170., 70.]
+    assert footprint.bboxes() == [[170., 60., 180., 70.], [-180., 60., -170., 70.]]
+
+    footprint = Footprint.from_wkt("POLYGON ((0 80, 90 81, 180 82, -90 83, 0 80))")
+    assert footprint.wraps
+    assert footprint.bboxes() == [[-180., 80., 180., 90.]]
+    footprint = Footprint.from_wkt("POLYGON ((0 -80, -90 -81, 180 -82, 90 -83, 0 -80))")
+    assert footprint.bboxes() == [[-180., -90., 180., -80.]]
@@ -0,0 +1,130 @@
+"""
+Collocation : Index module tests
+================================
+
+Copyright 2024 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import pytest
+import datetime
+
+import numpy as np
+
+from pytz import timezone
+
+from fadg.index import TimeIndex
+from fadg.index import IntervalIndex
+from fadg.index import to_datetime64
+
+
+def utc(*args):
+    return datetime.datetime(*args, tzinfo=timezone("utc"))
+
+
+@pytest.mark.core
+def testIndex_to_datetime64():
+    """ Test conversion of mixed time representations to UTC.
+    """
+    times = to_datetime64([utc(2024, 4, 6, 10), datetime.datetime(2024, 4, 6, 10),
+                           "2024-04-06T12:00:00+02:00", np.datetime64("2024-04-06T10:00")])
+    assert times.dtype == np.dtype("datetime64[ns]")
+    assert (times == np.datetime64("2024-04-06T10:00:00", "ns")).all()
+    assert len(to_datetime64([])) == 0
+    assert to_datetime64(np.array(["2024-04-06"], dtype="datetime64[D]"))[0] == \
+        np.datetime64("2024-04-06T00:00:00", "ns")
+
+
+@pytest.mark.core
+def testTimeIndex_nearest():
+    """ Test nearest, before and after lookups, also with tolerance and
+    for many times at once.
+    """
+    index = TimeIndex([utc(2024, 4, 6, hh) for hh in [5, 1, 3]], ["a", "b", "c"])
+    assert len(index) == 3
+    assert index.keys == ["b", "c", "a"]
+
+    assert index.nearest(utc(2024, 4, 6, 2, 50)) == "c"
+    assert index.nearest(utc(2024, 4, 6, 3), rel=1) == "b"
+    assert index.nearest(utc(2024, 4, 6, 3), rel=2) == "a"
+    assert index.nearest(utc(2024, 4, 6, 0), rel=1) is None
+    assert index.nearest(utc(2024, 4, 6, 6), rel=2) is None
+    # Equidistant candidates resolve to the earlier one
+    assert index.nearest(utc(2024, 4, 6, 4)) == "c"
+
+    assert index.nearest(utc(2024, 4, 6, 7), tolerance=datetime.timedelta(hours=1)) is None
+    assert index.nearest(utc(2024, 4, 6, 7), tolerance=datetime.timedelta(hours=2)) == "a"
+
+    times = [utc(2024, 4, 6, hh) for hh in range(8)]
+    assert index.nearest_many(times) == ["b", "b", "b", "c", "c", "a", "a", "a"]
+    assert index.nearest_many(times, rel=1) == [None, None, "b", "b", "c", "c", "a", "a"]
+    assert list(index.positions(times, rel=2)) == [0, 1, 1, 2, 2, -1, -1, -1]
+
+    assert TimeIndex([]).nearest(utc(2024, 4, 6)) is None
+    with pytest.raises(ValueError) as ee:
+        index.nearest(utc(2024, 4, 6), rel=3)
+    assert str(ee.value) == "rel must be 0, 1 or 2"
+    with pytest.raises(ValueError):
+        TimeIndex([utc(2024, 4, 6)], ["a", "b"])
+
+
+@pytest.mark.core
+def testTimeIndex_k_nearest_and_within():
+    """ Test k-nearest and tolerance window lookups.
+    """
+    index = TimeIndex([utc(2024, 4, 6, hh) for hh in [5, 1, 3]], ["a", "b", "c"])
+    time = utc(2024, 4, 6, 3, 10)
+    assert index.k_nearest(time, 2) == ["c", "a"]
+    assert index.k_nearest(time, 5) == ["c", "a", "b"]
+    assert index.k_nearest(time, 5, tolerance=datetime.timedelta(hours=2)) == ["c", "a"]
+    assert index.k_nearest(time, 0) == []
+
+    assert index.within(utc(2024, 4, 6, 3), datetime.timedelta(hours=2)) == ["b", "c", "a"]
+    assert index.within(utc(2024, 4, 6, 3), datetime.timedelta(hours=1)) == ["c"]
+    assert index.within(utc(2024, 4, 7), datetime.timedelta(hours=1)) == []
+
+
+@pytest.mark.core
+def testIntervalIndex():
+    """ Test overlap, containment and gap-minimising queries.
+    """
+    index = IntervalIndex(
+        [utc(2024, 4, 6, 0), utc(2024, 4, 6, 12), utc(2024, 4, 6, 6), utc(2024, 4, 7, 0)],
+        [utc(2024, 4, 6, 8), utc(2024, 4, 6, 13), utc(2024, 4, 6, 14), utc(2024, 4, 7, 6)],
+        ["a", "c", "b", "d"])
+    assert len(index) == 4
+    assert index.keys == ["a", "b", "c", "d"]
+
+    assert index.containing(utc(2024, 4, 6, 7)) == ["a", "b"]
+    assert index.containing(utc(2024, 4, 6, 14)) == ["b"]
+    assert index.containing(utc(2024, 4, 6, 20)) == []
+    assert index.overlapping(utc(2024, 4, 6, 13), utc(2024, 4, 6, 23)) == ["b", "c"]
+    assert index.overlapping(utc(2024, 4, 6, 13), utc(2024, 4, 7)) == ["b", "c", "d"]
+    assert index.count_overlapping(utc(2024, 4, 6, 13), utc(2024, 4, 7)) == 3
+    assert index.count_overlapping(utc(2024, 4, 6, 20)) == 0
+
+    # The latest start among equal overlaps, then the longest overlap
+    assert index.nearest(utc(2024, 4, 6, 7)) == "b"
+    assert index.nearest(utc(2024, 4, 6, 5), utc(2024, 4, 6, 7)) == "a"
+    # The smallest gap
+    assert index.nearest(utc(2024, 4, 6, 17)) == "b"
+    assert index.nearest(utc(2024, 4, 6, 20)) == "d"
+    assert index.nearest(utc(2024, 4, 5)) == "a"
+    assert index.nearest(utc(2024, 4, 8)) == "d"
+    assert IntervalIndex([], []).nearest(utc(2024, 4, 8)) is None
+    assert IntervalIndex([], []).overlapping(utc(2024, 4, 8)) == []
+
+    with pytest.raises(ValueError):
+        index.overlapping(utc(2024, 4, 7), utc(2024, 4, 6))
+    with pytest.raises(ValueError):
+        IntervalIndex([utc(2024, 4, 7)], [utc(2024, 4, 6)])
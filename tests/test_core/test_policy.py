@@ -0,0 +1,252 @@
+"""
+Collocation : Policy module tests
+=================================
+
+Copyright 2024 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import time
+import pytest
+import requests
+import threading
+
+from fadg.policy import CallPolicy
+from fadg.policy import DeadlineExceeded
+from fadg.policy import get_policy
+from fadg.policy import set_policy
+from fadg.cache import MetadataCache
+from fadg.cache import get_availability_cache
+from fadg.find_and_collocate import Collocate
+
+URL = "https://thredds.met.no/thredds/dodsC/file.nc"
+MIRROR = "https://mirror.met.no/thredds/dodsC/file.nc"
+
+
+@pytest.mark.core
+def testCallPolicy_deadline_and_retries():
+    """ Test that slow calls are abandoned at the deadline, and that
+    only retryable errors are retried.
+    """
+    policy = CallPolicy(timeout=0.05, retries=1, backoff=0.)
+    release = threading.Event()
+    with pytest.raises(DeadlineExceeded):
+        policy.call("slow", release.wait, 5)
+    release.set()
+    stats = policy.stats("slow")
+    assert (stats["calls"], stats["attempts"], stats["timeouts"]) == (1, 2, 2)
+    assert (stats["retries"], stats["failures"], stats["p50"]) == (1, 1, None)
+
+    attempts = []
+
+    def flaky(value):
+        attempts.append(value)
+        if len(attempts) < 3:
+            raise requests.ConnectionError
+        return value
+
+    policy.retries = 2
+    assert policy.call("flaky", flaky, "ok") == "ok"
+    assert attempts == ["ok"]*3
+    stats = policy.stats("flaky")
+    assert (stats["retries"], stats["failures"]) == (2, 0)
+    assert stats["p50"] == stats["max"] and stats["max"] >= 0
+
+    def missing():
+        attempts.append("missing")
+        raise FileNotFoundError
+
+    attempts = []
+    with pytest.raises(FileNotFoundError):
+        policy.call("missing", missing)
+    assert attempts == ["missing"]
+    assert sorted(policy.stats().keys()) == ["flaky", "missing", "slow"]
+
+    policy.reset_stats()
+    assert policy.stats() == {}
+    assert CallPolicy(timeout=None).call("local", sum, [1, 2]) == 3
+
+
+@pytest.mark.core
+def testCallPolicy_hedging():
+    """ Test that slow or failing requests are hedged against mirrors,
+    and that the first successful response wins.
+    """
+    mirrors = {"https://thredds.met.no/thredds": ["https://mirror.met.no/thredds"]}
+    policy = CallPolicy(timeout=2, retries=0, hedge_after=0.02, mirrors=mirrors)
+    assert policy.alternatives(URL) == [URL, MIRROR]
+    assert policy.alternatives("/local/file.nc") == ["/local/file.nc"]
+
+    release = threading.Event()
+
+    def slow_primary(url):
+        if url == URL:
+            release.wait(5)
+        return url
+
+    assert policy.call_url("dap", slow_primary, URL) == MIRROR
+    release.set()
+    stats = policy.stats("dap")
+    assert (stats["hedges"], stats["hedge_wins"]) == (1, 1)
+
+    # A fast primary is not hedged
+    assert policy.call_url("fast", lambda url: url, URL) == URL
+    assert policy.stats("fast")["hedges"] == 0
+
+    def failing_primary(url):
+        if url == URL:
+            raise requests.ConnectionError
+        return url
+
+    assert policy.call_url("failing", failing_primary, URL) == MIRROR
+
+    def failing(url):
+        raise requests.ConnectionError
+
+    with pytest.raises(requests.ConnectionError):
+        policy.call_url("down", failing, URL)
+
+    policy.timeout = 0.05
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        policy.call_url("stalled", lambda url: time.sleep(0.5), URL)
+    assert time.monotonic() - start < 0.5
+    assert policy.stats("stalled")["hedges"] == 1
+
+
+@pytest.mark.core
+def testCallPolicy_shared(monkeypatch):
+    """ Test that the remote calls of Collocate use the shared policy.
+    """
+    set_policy(None)
+    assert get_policy().timeout == 60
+    assert get_policy() is get_policy()
+
+    mirrors = {"https://thredds.met.no/thredds": ["https://mirror.met.no/thredds"]}
+    set_policy(CallPolicy(timeout=1, hedge_after=0.02, mirrors=mirrors))
+    opened = []
+    release = threading.Event()
+
+    def fetch(url, session=None):
+        opened.append(url)
+        if url == URL:
+            release.wait(5)
+            raise requests.ConnectionError
+        return {"time_coverage_start": "2024-04-06T10:00:00Z"}
+
+    with monkeypatch.context() as mp:
+        mp.setattr("fadg.find_and_collocate.dap.fetch_global_attributes", fetch)
+        metadata = Collocate._read_das_metadata(URL)
+        assert metadata["time_coverage_start"] is not None
+    release.set()
+    assert opened == [URL, MIRROR]
+    assert get_policy().stats("dap")["hedge_wins"] == 1
+
+    # netCDF4 opens are not hedged
+    with monkeypatch.context() as mp:
+        mp.setattr("fadg.find_and_collocate.netCDF4.Dataset", lambda url: url)
+        assert Collocate._open_dataset(URL) == URL
+    assert get_policy().stats("netcdf")["hedges"] == 0
+
+
+@pytest.mark.core
+def testCallPolicy_serial():
+    """ Test that serial calls do not overlap, and are not retried
+    after the deadline while the abandoned call is running.
+    """
+    policy = CallPolicy(timeout=0.2, retries=2, backoff=0.)
+    running = []
+    overlaps = []
+
+    def call(value):
+        running.append(value)
+        overlaps.append(len(running))
+        threading.Event().wait(0.01)
+        running.remove(value)
+        return value
+
+    threads = [threading.Thread(target=policy.call_serial, args=("serial", call, ii))
+               for ii in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert overlaps == [1]*8
+    assert policy.stats("serial")["calls"] == 8
+
+    release = threading.Event()
+    policy = CallPolicy(timeout=0.05, retries=2, backoff=0.)
+    with pytest.raises(DeadlineExceeded):
+        policy.call_serial("stalled", release.wait, 5)
+    assert policy.stats("stalled")["attempts"] == 1
+    assert policy.stats("stalled")["retries"] == 0
+    # Later calls wait for the abandoned call, and are dropped after
+    # their deadline
+    ran = []
+    with pytest.raises(DeadlineExceeded):
+        policy.call_serial("stalled", ran.append, "late")
+    release.set()
+    policy._get_executor().shutdown(wait=True)
+    assert ran == []
+
+
+@pytest.mark.core
+def testCallPolicy_cancel_queued():
+    """ Test that calls which have not started by the deadline are
+    dropped, and do not run later.
+    """
+    policy = CallPolicy(timeout=0.05, retries=0, workers=1)
+    release = threading.Event()
+    ran = []
+    with pytest.raises(DeadlineExceeded):
+        policy.call("busy", release.wait, 5)
+    with pytest.raises(DeadlineExceeded):
+        policy.call("queued", ran.append, "queued")
+    release.set()
+    policy._get_executor().shutdown(wait=True)
+    assert ran == []
+
+
+@pytest.mark.core
+def testCallPolicy_deadline_is_not_unavailable(monkeypatch):
+    """ Test that datasets that do not respond in time are neither
+    reopened with #fillmismatch, nor cached as unavailable.
+    """
+    set_policy(CallPolicy(timeout=0.05, retries=1, backoff=0.))
+    release = threading.Event()
+    opened = []
+
+    def dataset(url):
+        opened.append(url)
+        release.wait(5)
+
+    cache = MetadataCache(path=":memory:")
+    try:
+        with monkeypatch.context() as mp:
+            mp.setattr("fadg.find_and_collocate.netCDF4.Dataset", dataset)
+            with pytest.raises(DeadlineExceeded):
+                Collocate(URL).time
+            # Not retried while the abandoned open is running
+            assert opened == [URL]
+
+            metadata = Collocate.probe(URL)
+            assert metadata["available"] is None
+            assert get_availability_cache().get(URL) is None
+            assert Collocate.probe_many([URL], cache=cache)[0]["available"] is None
+            assert cache.get(URL) is None
+
+            with pytest.raises(DeadlineExceeded):
+                Collocate.assert_available(URL)
+            assert get_availability_cache().get(URL) is None
+    finally:
+        release.set()
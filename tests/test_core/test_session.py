@@ -0,0 +1,38 @@
+"""
+Collocation : Session module tests
+==================================
+
+Copyright 2024 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import pytest
+
+from fadg.session import get_session
+from fadg.session import close_session
+
+
+@pytest.mark.core
+def testSession_get_session():
+    """ Test that one pooled session is shared until it is closed.
+    """
+    close_session()
+    session = get_session(pool_maxsize=5)
+    assert get_session() is session
+    adapter = session.get_adapter("https://data.csw.met.no")
+    assert adapter._pool_maxsize == 5
+
+    close_session()
+    assert get_session() is not session
+    close_session()
+    close_session()
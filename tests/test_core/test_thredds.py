@@ -0,0 +1,117 @@
+"""
+Collocation : THREDDS module tests
+==================================
+
+Copyright 2024 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import os
+import pytest
+import datetime
+
+from pytz import timezone
+
+from tools import threddsCatalog
+from tools import MockCatalogSession
+
+from fadg.thredds import catalog_url
+from fadg.thredds import parse_catalog
+from fadg.thredds import PatternProduct
+
+URL = "https://thredds.met.no/thredds/dodsC/archive"
+TEMPLATE = URL + "/%Y/%m/%d/analysis_%Y%m%dT%HZ.nc"
+
+
+def utc(*args):
+    return datetime.datetime(*args, tzinfo=timezone("utc"))
+
+
+@pytest.mark.core
+def testTHREDDS_catalog():
+    """ Test catalog urls and parsing of catalog.xml.
+    """
+    assert catalog_url(URL + "/2019/01/07/file.nc") == \
+        "https://thredds.met.no/thredds/catalog/archive/2019/01/07/catalog.xml"
+    assert catalog_url("https://thredds.met.no/thredds/dodsC/file.nc") == \
+        "https://thredds.met.no/thredds/catalog/catalog.xml"
+    with pytest.raises(ValueError):
+        catalog_url("https://thredds.met.no/thredds/fileServer/file.nc")
+
+    assert parse_catalog(threddsCatalog("archive", ["a.nc", "b.nc"])) == {"a.nc", "b.nc"}
+    with pytest.raises(ValueError):
+        parse_catalog("<catalog")
+
+
+@pytest.mark.core
+def testPatternProduct_nearest(monkeypatch):
+    """ Test that the nearest existing file is found in either
+    direction, and that each directory is listed once.
+    """
+    session = MockCatalogSession({
+        "archive/2019/01/07": ["analysis_20190107T%02dZ.nc" % hh for hh in [15, 20, 23]],
+        "archive/2019/01/08": ["analysis_20190108T01Z.nc"],
+    })
+    monkeypatch.setattr("fadg.thredds.get_session", lambda: session)
+    product = PatternProduct(TEMPLATE, step=datetime.timedelta(hours=1))
+
+    assert product.url(utc(2019, 1, 7, 17)) == URL + "/2019/01/07/analysis_20190107T17Z.nc"
+    assert product.nearest(utc(2019, 1, 7, 17, 20)) == \
+        URL + "/2019/01/07/analysis_20190107T15Z.nc"
+    assert product.nearest(utc(2019, 1, 7, 17, 40)) == \
+        URL + "/2019/01/07/analysis_20190107T20Z.nc"
+    # Equidistant files resolve to the earlier one
+    assert product.nearest(utc(2019, 1, 7, 17, 30)) == \
+        URL + "/2019/01/07/analysis_20190107T15Z.nc"
+    # Across the day boundary, and without time zone
+    assert product.nearest(datetime.datetime(2019, 1, 8, 0, 40)) == \
+        URL + "/2019/01/08/analysis_20190108T01Z.nc"
+    assert product.nearest(utc(2019, 1, 7, 17, 30), max_steps=1) is None
+    assert product.request_count == 2
+    assert len(session.requests) == 2
+
+    # Missing directories are cached as empty
+    assert product.nearest(utc(2019, 1, 10, 12), max_steps=6) is None
+    assert product.nearest(utc(2019, 1, 10, 12), max_steps=6) is None
+    assert len(session.requests) == 3
+
+    # Listings expire after ttl seconds
+    product.ttl = -1
+    product.nearest(utc(2019, 1, 7, 20))
+    assert len(session.requests) == 4
+    product.clear()
+    product.ttl = None
+    product.nearest(utc(2019, 1, 7, 20))
+    assert len(session.requests) == 5
+
+
+@pytest.mark.core
+def testPatternProduct_coverage_and_templates(tmp_path):
+    """ Test files that cover a time interval, several templates, and
+    local directories.
+    """
+    for name in ["daily_20190106.nc", "renamed_20190108.nc"]:
+        open(os.path.join(tmp_path, name), "w").close()
+    product = PatternProduct([os.path.join(tmp_path, "daily_%Y%m%d.nc"),
+                              os.path.join(tmp_path, "renamed_%Y%m%d.nc")],
+                             step=datetime.timedelta(days=1),
+                             coverage=datetime.timedelta(days=1))
+    # The time is covered by the file of the previous day
+    assert product.nearest(utc(2019, 1, 6, 23)) == os.path.join(tmp_path, "daily_20190106.nc")
+    assert product.nearest(utc(2019, 1, 7, 13)) == \
+        os.path.join(tmp_path, "renamed_20190108.nc")
+    assert product.nearest(utc(2019, 1, 7, 11)) == os.path.join(tmp_path, "daily_20190106.nc")
+    assert product.request_count == 0
+
+    with pytest.raises(ValueError):
+        PatternProduct(TEMPLATE, step=datetime.timedelta(0))
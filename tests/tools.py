@@ -16,6 +16,9 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+import os
+
+from types import SimpleNamespace
 
 
 # File I/O
@@ -32,6 +35,75 @@ def writeFile(fileName, fileData):
         outFile.write(fileData)
 
 
+# CSW
+
+def getRecordsResponse(start, maxrecords, matches, url="https://thredds.met.no/thredds/dodsC"):
+    """Return a CSW GetRecords response with Dublin Core records
+    rec<start> to rec<start + maxrecords - 1>, limited by matches. The
+    records cover [-3, 58, 5, 65].
+    """
+    stop = min(start + maxrecords - 1, matches)
+    nextRecord = stop + 1 if stop < matches else 0
+    records = []
+    for ii in range(start, stop + 1):
+        records.append(
+            "<csw:Record>"
+            "<dc:identifier>rec%d</dc:identifier>"
+            "<dc:title>Record %d</dc:title>"
+            "<dct:references scheme=\"OPENDAP:OPENDAP\">%s/rec%d.nc</dct:references>"
+            "<dct:temporal>2024-04-06T%02d:00:00Z/2024-04-06T%02d:59:59Z</dct:temporal>"
+            "<ows:BoundingBox crs=\"urn:ogc:def:crs:OGC:1.3:CRS84\" dimensions=\"2\">"
+            "<ows:LowerCorner>-3 58</ows:LowerCorner><ows:UpperCorner>5 65</ows:UpperCorner>"
+            "</ows:BoundingBox>"
+            "</csw:Record>" % (ii, ii, url, ii, ii % 24, ii % 24))
+    return (
+        "<?xml version=\"1.0\" encoding=\"UTF-8\"?>"
+        "<csw:GetRecordsResponse xmlns:csw=\"http://www.opengis.net/cat/csw/2.0.2\" "
+        "xmlns:dc=\"http://purl.org/dc/elements/1.1/\" "
+        "xmlns:dct=\"http://purl.org/dc/terms/\" "
+        "xmlns:ows=\"http://www.opengis.net/ows\" version=\"2.0.2\">"
+        "<csw:SearchStatus timestamp=\"2024-04-18T13:00:00Z\"/>"
+        "<csw:SearchResults numberOfRecordsMatched=\"%d\" numberOfRecordsReturned=\"%d\" "
+        "nextRecord=\"%d\" recordSchema=\"http://www.opengis.net/cat/csw/2.0.2\" "
+        "elementSet=\"full\">%s</csw:SearchResults>"
+        "</csw:GetRecordsResponse>" % (matches, len(records), nextRecord, "".join(records))
+    ).encode("utf-8")
+
+
+# THREDDS
+
+def threddsCatalog(path, files):
+    """Return a THREDDS catalog.xml of directory path listing the
+    given files.
+    """
+    datasets = "".join('<dataset name="%s" ID="%s/%s" urlPath="%s/%s"/>' % (
+        name, path, name, path, name) for name in files)
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<catalog xmlns="http://www.unidata.ucar.edu/namespaces/thredds/InvCatalog/v1.0" '
+            'version="1.0.1"><service name="all" serviceType="Compound" base=""/>'
+            '<dataset name="%s" ID="%s">%s</dataset></catalog>' % (path, path, datasets))
+
+
+class MockCatalogSession:
+    """Local stand-in for a THREDDS server, serving the catalogs of
+    the given directories.
+    """
+
+    def __init__(self, directories):
+        self.directories = directories
+        self.requests = []
+
+    def get(self, url, timeout=None):
+        self.requests.append(url)
+        prefix = "https://thredds.met.no/thredds/catalog/"
+        path = os.path.dirname(url[len(prefix):])
+        if path not in self.directories:
+            return SimpleNamespace(status_code=404, text="Not found",
+                                   raise_for_status=lambda: None)
+        return SimpleNamespace(status_code=200, text=threddsCatalog(path, self.directories[path]),
+                               raise_for_status=lambda: None)
+
+
 # Exceptions
 
 def causeOSError(*args, **kwargs):